@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Stone Selection & Visual Sale Grid',
-    'version': '19.0.9.10.0',
+    'version': '19.0.9.11.0',
     'category': 'Sales/Sales',
     'summary': 'Selección visual de placas con reserva estricta y estatus de entrega',
     'description': """
@@ -25,6 +25,8 @@
     'data': [
         'security/ir.model.access.csv',
         'data/archive_quote_backups.xml',
+        'data/stone_confirm_queue_cron.xml',
+        'data/stone_commitment_ledger_cron.xml',
         'views/sale_views.xml',
         'views/stock_views.xml',
         'data/mail_template_sale_confirmation.xml',
@@ -32,6 +34,7 @@
     'assets': {
         'web.assets_backend': [
             'sale_stone_selection/static/src/js/sale_autosave.js',
+            'sale_stone_selection/static/src/js/stone_inventory_payload.js',
             'sale_stone_selection/static/src/scss/stone_styles.scss',
             'sale_stone_selection/static/src/components/stone_grid/stone_grid.xml',
             'sale_stone_selection/static/src/components/stone_grid/stone_grid.js',
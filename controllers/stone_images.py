@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from odoo import http
+from odoo.exceptions import AccessError
+from odoo.http import request
+
+from ..models.stone_image_variant import STONE_IMAGE_SOURCES, STONE_IMAGE_SIZES
+
+# Las URLs llevan ?unique=<etag>: si la foto cambia, cambia la URL, así que
+# el navegador puede guardar cada variante una semana sin revalidar.
+CACHE_MAX_AGE = 7 * 24 * 3600
+
+
+class StoneImageController(http.Controller):
+
+    @http.route(
+        '/sale_stone_selection/image/<string:source>/<int:res_id>/<string:size>',
+        type='http', auth='user', methods=['GET'])
+    def stone_image(self, source, res_id, size, **kwargs):
+        if source not in STONE_IMAGE_SOURCES or size not in STONE_IMAGE_SIZES:
+            raise request.not_found()
+        model_name, field_name = STONE_IMAGE_SOURCES[source]
+        if model_name not in request.env:
+            raise request.not_found()
+
+        record = request.env[model_name].browse(res_id).exists()
+        if not record:
+            raise request.not_found()
+        try:
+            record.check_access('read')
+        except AccessError:
+            raise request.not_found()
+
+        Variant = request.env['stone.image.variant']
+        etag = Variant._stone_variant_etag(record, field_name, size)
+        headers = [
+            ('ETag', '"%s"' % etag),
+            ('Cache-Control', 'private, max-age=%s' % CACHE_MAX_AGE),
+        ]
+        if request.httprequest.if_none_match.contains(etag):
+            return request.make_response(b'', headers=headers, status=304)
+
+        variant = Variant._stone_get_variant(record, field_name, size)
+        if not variant:
+            raise request.not_found()
+        content, mimetype, _etag = variant
+        headers += [
+            ('Content-Type', mimetype),
+            ('Content-Length', str(len(content))),
+        ]
+        return request.make_response(content, headers=headers)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Rellena x_confirmed_order_id en los respaldos de cotización que ya
+    existían. El respaldo guarda 'Convertido a <V/…>' en origin y la orden
+    confirmada guarda el folio COT en origin; se usa el primero y, si no
+    cuadra, el segundo. Ante varios candidatos gana el de id menor.
+
+    Dos UPDATE con una sola igualdad cada uno (un OR en el JOIN impide hash
+    o merge join y se vuelve un nested loop respaldos × órdenes)."""
+    if not version:
+        return
+
+    # 1) origin del respaldo = 'Convertido a ' || folio de la orden.
+    cr.execute("""
+        UPDATE sale_order b
+           SET x_confirmed_order_id = m.so_id
+          FROM (
+                SELECT DISTINCT ON (b2.id) b2.id AS backup_id, so.id AS so_id
+                  FROM sale_order b2
+                  JOIN sale_order so
+                    ON b2.origin = 'Convertido a ' || so.name
+                 WHERE b2.x_is_quote_backup = TRUE
+                   AND b2.x_confirmed_order_id IS NULL
+                   AND so.id != b2.id
+                   AND so.state IN ('sale', 'done')
+                   AND COALESCE(so.x_is_quote_backup, FALSE) = FALSE
+                 ORDER BY b2.id, so.id
+               ) m
+         WHERE b.id = m.backup_id
+    """)
+    by_backup_origin = cr.rowcount
+
+    # 2) origin de la orden = folio del respaldo, solo para los que quedaron.
+    cr.execute("""
+        UPDATE sale_order b
+           SET x_confirmed_order_id = m.so_id
+          FROM (
+                SELECT DISTINCT ON (b2.id) b2.id AS backup_id, so.id AS so_id
+                  FROM sale_order b2
+                  JOIN sale_order so
+                    ON so.origin = b2.name
+                 WHERE b2.x_is_quote_backup = TRUE
+                   AND b2.x_confirmed_order_id IS NULL
+                   AND so.id != b2.id
+                   AND so.state IN ('sale', 'done')
+                   AND COALESCE(so.x_is_quote_backup, FALSE) = FALSE
+                 ORDER BY b2.id, so.id
+               ) m
+         WHERE b.id = m.backup_id
+           AND b.x_confirmed_order_id IS NULL
+    """)
+    _logger.info(
+        '[STONE] x_confirmed_order_id rellenado en %s respaldo(s) de '
+        'cotización (%s por origin del respaldo, %s por origin de la orden).',
+        by_backup_origin + cr.rowcount, by_backup_origin, cr.rowcount)
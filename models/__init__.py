@@ -3,9 +3,15 @@
 from . import sale_order
 from . import sale_order_line
 from . import stock_quant
+from . import stock_lot
 from . import stock_move
 from . import stock_move_line
 from . import sale_stone_swap_history
+from . import stock_lot_commitment
+from . import sale_stone_selector_generation
+from . import stone_image_variant
+from . import sale_stone_confirm_job
+from . import sale_stone_confirm_job_progress
 
 # IMPORTANTE:
 # No importar sale_swap_wizard aquí.
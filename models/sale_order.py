@@ -2,11 +2,14 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from odoo.tools import float_compare
-import json
 import logging
 
+from .sale_order_line import StoneBreakdown
+
 _logger = logging.getLogger(__name__)
 
+ARCHIVE_BATCH_SIZE = 1000
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
@@ -24,6 +27,36 @@ class SaleOrder(models.Model):
         help="Indica que esta orden es una copia de respaldo de la cotización original.",
     )
 
+    # Enlace explícito respaldo → orden confirmada. Reemplaza las búsquedas
+    # por texto sobre 'origin' / 'name' (sin índice, cientos de miles de
+    # órdenes) en los guards de confirmación.
+    x_confirmed_order_id = fields.Many2one(
+        'sale.order',
+        string="Orden de Venta Generada",
+        copy=False,
+        index=True,
+        ondelete='set null',
+        help="En un respaldo de cotización: la orden de venta que se generó "
+             "al confirmarla.",
+    )
+
+    # Confirmación diferida (sale.stone.confirm.job): mientras esté en cola o
+    # confirmándose, la orden no se puede volver a confirmar ni editar líneas.
+    x_stone_confirm_state = fields.Selection([
+        ('queued', 'En cola de confirmación'),
+        ('running', 'Confirmando'),
+    ], string="Confirmación en segundo plano", copy=False, readonly=True)
+    x_stone_confirm_job_id = fields.Many2one(
+        'sale.stone.confirm.job',
+        string="Job de confirmación",
+        copy=False,
+        readonly=True,
+    )
+    x_stone_confirm_progress = fields.Char(
+        related='x_stone_confirm_job_id.progress_label',
+        string="Progreso de confirmación",
+    )
+
     def _stone_clear_quote_stock_selections_before_confirm(self):
         """
         Regla funcional crítica:
@@ -138,21 +171,92 @@ class SaleOrder(models.Model):
             ) % '\n'.join(details))
 
     @api.model
-    def _som_archive_quote_backups(self):
-        """Archiva TODOS los respaldos de cotización (x_is_quote_backup):
-        por construcción ya tienen su homóloga orden de venta V/. Corre en
-        cada -u del módulo (idempotente) — sanea el histórico."""
-        backups = self.search([
+    def _som_archive_quote_backups_domain(self):
+        return [
             ('x_is_quote_backup', '=', True),
             ('active', '=', True),
-        ])
-        if backups:
-            backups.write({'active': False})
+        ]
+
+    @api.model
+    def _som_archive_quote_backups(self, batch_size=ARCHIVE_BATCH_SIZE,
+                                   from_cron=False):
+        """Archiva los respaldos de cotización (x_is_quote_backup) activos:
+        por construcción ya tienen su homóloga orden de venta V/.
+
+        Trabaja por bloques de `batch_size` (nunca carga todo el histórico
+        en memoria ni recalcula dependientes de todos a la vez). Es
+        reanudable sin estado: cada bloque archivado sale del dominio. Con
+        `from_cron`, cada bloque se confirma y reporta con
+        ir.cron._commit_progress, que lleva el presupuesto de tiempo de la
+        corrida y la reprograma si quedan pendientes. Fuera del cron corre
+        completo en la transacción actual."""
+        domain = self._som_archive_quote_backups_domain()
+        IrCron = self.env['ir.cron']
+        if from_cron:
+            IrCron._commit_progress(remaining=self.search_count(domain))
+        archived = 0
+        while True:
+            backups = self.search(domain, order='id', limit=batch_size)
+            if not backups:
+                break
+            backups.with_context(tracking_disable=True).write({'active': False})
+            archived += len(backups)
             _logger.info(
-                '[STONE] %s respaldos de cotización archivados.',
-                len(backups))
+                '[STONE] Respaldos de cotización archivados: %s en esta corrida.',
+                archived)
+            if from_cron and not IrCron._commit_progress(len(backups)):
+                # Se acabó el tiempo de esta corrida; el cron la retoma.
+                break
+        return archived
+
+    @api.model
+    def _som_enqueue_archive_quote_backups(self):
+        """Paso de actualización del módulo: no archiva en línea, despierta
+        al cron que lo hace por bloques fuera del -u."""
+        cron = self.env.ref(
+            'sale_stone_selection.ir_cron_som_archive_quote_backups',
+            raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        else:
+            # Sin el cron (borrado a mano) se archiva en línea, en la
+            # transacción del -u: sin commits intermedios.
+            _logger.warning(
+                '[STONE] Cron de archivado de respaldos no encontrado; '
+                'se archiva en línea.')
+            self._som_archive_quote_backups()
         return True
 
+    @api.model
+    def _som_archive_quote_backups_cron(self):
+        self._som_archive_quote_backups(from_cron=True)
+        return True
+
+    def _stone_check_confirm_lock(self):
+        """Mientras la orden está en cola / confirmándose en segundo plano no
+        se tocan sus líneas (salvo el propio job)."""
+        if self.env.context.get('stone_confirm_job_id'):
+            return
+        locked = self.filtered(lambda o: o.x_stone_confirm_state)
+        if locked:
+            raise UserError(_(
+                'La orden %s se está confirmando en segundo plano; '
+                'espera a que termine para modificar sus líneas.'
+            ) % ', '.join(locked.mapped('name')))
+
+    def write(self, vals):
+        if 'order_line' in vals:
+            self._stone_check_confirm_lock()
+        res = super().write(vals)
+        # Confirmar/cancelar cambia qué lotes compromete la orden: el libro
+        # de compromisos recalcula los de sus líneas al cerrar la transacción.
+        if 'state' in vals:
+            self.env['stock.lot.commitment']._stone_mark_dirty(
+                self.mapped('order_line.lot_ids').ids)
+            self.env['stock.quant']._stone_bump_selector_generation(
+                self.mapped('order_line.product_id').ids)
+        return res
+
     def action_confirm(self):
         """
         Confirmación con:
@@ -174,7 +278,16 @@ class SaleOrder(models.Model):
                 "SELECT id FROM sale_order WHERE id IN %s FOR UPDATE",
                 (tuple(self.ids),),
             )
-            self.invalidate_recordset(['state', 'name', 'x_is_quote_backup'])
+            self.invalidate_recordset([
+                'state', 'name', 'x_is_quote_backup', 'x_stone_confirm_state'])
+
+        job_id = self.env.context.get('stone_confirm_job_id')
+        if not job_id:
+            queued = self.filtered(lambda o: o.x_stone_confirm_state)
+            if queued:
+                raise UserError(_(
+                    'La orden %s ya se está confirmando en segundo plano.'
+                ) % ', '.join(queued.mapped('name')))
 
         # =====================================================================
         # BLOQUEAR DOBLE CONFIRMACIÓN
@@ -205,11 +318,9 @@ class SaleOrder(models.Model):
                     'name': _('Orden de Venta: %s') % order.name,
                 }
 
-            existing_so = self.env['sale.order'].search([
-                ('origin', '=', order.name),
-                ('id', '!=', order.id),
-                ('state', 'in', ('sale', 'done')),
-            ], limit=1)
+            existing_so = order.x_confirmed_order_id
+            if existing_so.state not in ('sale', 'done'):
+                existing_so = self.env['sale.order']
 
             if existing_so:
                 _logger.info("[STONE] Cotización %s ya generó la SO %s. Redirigiendo.", order.name, existing_so.name)
@@ -233,6 +344,18 @@ class SaleOrder(models.Model):
                     'name': _('Cotización: %s') % order.name,
                 }
 
+        # =====================================================================
+        # CONFIRMACIÓN DIFERIDA (opt-in): órdenes grandes se encolan y el
+        # cron termina el trabajo; aquí solo se marcan 'en cola'. El candado
+        # de fila de arriba protege igual contra la doble confirmación.
+        # =====================================================================
+        Job = self.env['sale.stone.confirm.job']
+        if not job_id and (
+            self.env.context.get('stone_deferred_confirm')
+            or Job._stone_should_defer(self)
+        ):
+            return self._stone_enqueue_confirm()
+
         # =====================================================================
         # 0. REGLA NUEVA: limpiar selección de stock en cotizaciones
         # =====================================================================
@@ -248,16 +371,9 @@ class SaleOrder(models.Model):
         for order in self:
             for line in order.order_line.filtered(lambda l: l.lot_ids):
                 lot_ids = line.lot_ids.ids.copy()
-
-                breakdown = {}
-                if line.x_lot_breakdown_json:
-                    try:
-                        if isinstance(line.x_lot_breakdown_json, str):
-                            breakdown = json.loads(line.x_lot_breakdown_json)
-                        elif isinstance(line.x_lot_breakdown_json, dict):
-                            breakdown = line.x_lot_breakdown_json
-                    except (json.JSONDecodeError, TypeError):
-                        breakdown = {}
+                # Accessor armado una vez por línea: los pasos siguientes
+                # lo reciben en vez del dict.
+                breakdown = line._stone_breakdown()
 
                 lines_lots_map[line.id] = {
                     'lot_ids': lot_ids,
@@ -269,11 +385,13 @@ class SaleOrder(models.Model):
                     "[STONE] Protegiendo para línea %s: %s lotes, breakdown: %s",
                     line.id,
                     len(lot_ids),
-                    breakdown,
+                    breakdown.raw,
                 )
 
         has_stone_lots = bool(lines_lots_map)
 
+        self._stone_confirm_progress(_('Respaldo de cotización'))
+
         # =====================================================================
         # 2. DUPLICACIÓN: Crear backup de cotización + renombrar a V
         # =====================================================================
@@ -311,6 +429,7 @@ class SaleOrder(models.Model):
                     'state': 'draft',
                     'origin': 'Convertido a %s' % new_ov_name,
                     'x_is_quote_backup': True,
+                    'x_confirmed_order_id': order.id,
                     'date_order': fields.Datetime.now(),
                     # El respaldo nace ARCHIVADO: la lista de cotizaciones
                     # queda solo con cotizaciones vivas de verdad.
@@ -323,13 +442,7 @@ class SaleOrder(models.Model):
                 backup_quote = order.copy(default=copy_defaults)
 
                 if has_stone_lots and not backup_quote.order_line:
-                    for line in order.order_line:
-                        line_defaults = {
-                            'order_id': backup_quote.id,
-                            'lot_ids': [(5, 0, 0)],
-                            'x_lot_breakdown_json': False,
-                        }
-                        line.copy(default=line_defaults)
+                    order._stone_copy_lines_to_backup(backup_quote)
 
                 _logger.info(
                     "[STONE] Backup creado: %s (ID: %s, x_is_quote_backup=True)",
@@ -342,6 +455,8 @@ class SaleOrder(models.Model):
 
                 _logger.info("[STONE] Orden renombrada: %s → %s", current_cot_name, new_ov_name)
 
+        self._stone_confirm_progress(_('Confirmando'))
+
         # =====================================================================
         # 3. CONFIRMAR: Llamar a super() con o sin protección de lotes
         # =====================================================================
@@ -390,29 +505,33 @@ class SaleOrder(models.Model):
                 _logger.warning("[STONE] No se generaron pickings para la orden %s", order.name)
                 continue
 
-            for picking in pickings:
-                for move in picking.move_ids.filtered(lambda m: m.state not in ['done', 'cancel']):
-                    all_lot_lines = move.move_line_ids.filtered(lambda ml: ml.lot_id)
-                    if all_lot_lines:
-                        _logger.info(
-                            "[STONE] Eliminando %s move_lines existentes para recrear con ubicación correcta",
-                            len(all_lot_lines),
-                        )
-                        all_lot_lines.with_context(ctx).unlink()
-
-            for line in order.order_line:
-                line_data = lines_lots_map.get(line.id)
-                if not line_data:
-                    continue
-
-                lots = self.env['stock.lot'].browse(line_data['lot_ids'])
-                if lots:
-                    self.with_context(ctx)._assign_stone_lots_to_picking(
-                        pickings,
-                        line,
-                        lots,
-                        line_data.get('breakdown', {}),
-                    )
+            all_lot_lines = pickings.move_ids.filtered(
+                lambda m: m.state not in ['done', 'cancel']
+            ).move_line_ids.filtered(lambda ml: ml.lot_id)
+            if all_lot_lines:
+                _logger.info(
+                    "[STONE] Eliminando %s move_lines existentes para recrear con ubicación correcta",
+                    len(all_lot_lines),
+                )
+                all_lot_lines.with_context(ctx).unlink()
+
+            if not job_id:
+                order.with_context(ctx)._stone_bulk_assign_stone_lots(
+                    pickings, lines_lots_map)
+                continue
+
+            # En cola: por bloques de líneas, publicando el avance.
+            line_ids = [l.id for l in order.order_line if l.id in lines_lots_map]
+            chunk_size = Job._stone_assign_chunk_size()
+            for start in range(0, len(line_ids), chunk_size):
+                chunk_ids = line_ids[start:start + chunk_size]
+                order.with_context(ctx)._stone_bulk_assign_stone_lots(
+                    pickings, {lid: lines_lots_map[lid] for lid in chunk_ids})
+                self._stone_confirm_progress(
+                    _('Asignando lotes'),
+                    start + len(chunk_ids),
+                    len(line_ids),
+                )
 
         # 5. Restaurar visualización en Sale Order
         for line_id, line_data in lines_lots_map.items():
@@ -420,14 +539,15 @@ class SaleOrder(models.Model):
             if line.exists() and set(line.lot_ids.ids) != set(line_data['lot_ids']):
                 line.with_context(ctx).write({'lot_ids': [(6, 0, line_data['lot_ids'])]})
 
+        self._stone_confirm_progress(_('Limpieza de la cotización origen'))
+
         # =====================================================================
         # 6. Limpiar lot_ids de la COTIZACIÓN BACKUP
         # =====================================================================
         for order in self:
             if order.origin:
                 source_orders = self.env['sale.order'].search([
-                    ('name', '=', order.origin),
-                    ('id', '!=', order.id),
+                    ('x_confirmed_order_id', '=', order.id),
                     ('state', 'in', ('draft', 'sent', 'cancel')),
                 ], limit=1)
 
@@ -453,6 +573,75 @@ class SaleOrder(models.Model):
         _logger.info("=" * 80)
         return res
 
+    def _stone_copy_lines_to_backup(self, backup_quote):
+        """
+        Copia las líneas de la orden al backup de cotización con UN
+        copy_data multi-registro y UN create, sin selección de stock.
+
+        Antes era un line.copy() por línea (logs, create override,
+        validador de placas duplicadas y bitácora por cada una); en un
+        respaldo archivado y sin placas esas validaciones no aplican, así
+        que se crean en un contexto ligero.
+        """
+        self.ensure_one()
+        SaleLine = self.env['sale.order.line']
+        lines = self.order_line
+        if not lines:
+            return SaleLine.browse()
+
+        vals_list = lines.copy_data(default={'order_id': backup_quote.id})
+        for vals in vals_list:
+            # Una línea nueva ya nace sin placas: quitar las llaves evita que
+            # el create override las trate como selección en cotización.
+            vals.pop('lot_ids', None)
+            vals.pop('x_lot_breakdown_json', None)
+
+        backup_lines = SaleLine.with_context(
+            skip_stone_dup_plate_check=True,
+            skip_hold_validation=True,
+            skip_stone_sync_so=True,
+            skip_stone_sync_picking=True,
+            skip_picking_clean=True,
+            tracking_disable=True,
+            mail_notrack=True,
+        ).create(vals_list)
+        _logger.info(
+            "[STONE] %s línea(s) copiadas al backup %s en bloque.",
+            len(backup_lines),
+            backup_quote.name,
+        )
+        return backup_lines
+
+    def action_stone_confirm_deferred(self):
+        """Confirmar en segundo plano: mismos guards y candado que
+        action_confirm, pero el trabajo pesado lo hace el cron."""
+        return self.with_context(stone_deferred_confirm=True).action_confirm()
+
+    def _stone_enqueue_confirm(self):
+        self.env['sale.stone.confirm.job']._stone_enqueue(self)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Confirmación en segundo plano'),
+                'message': _(
+                    'La orden quedó en cola de confirmación. El avance se '
+                    've en el formulario; al terminar aparecerá con su folio '
+                    'de venta.'),
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            },
+        }
+
+    def _stone_confirm_progress(self, stage, done=0, total=0):
+        """Publica la etapa en el job de cola, si la confirmación viene de
+        uno; en la confirmación normal no hace nada."""
+        job_id = self.env.context.get('stone_confirm_job_id')
+        if job_id:
+            self.env['sale.stone.confirm.job'].browse(job_id)._stone_report_progress(
+                stage, done, total)
+
     def _get_lot_qty_for_line(self, sale_line, lot, breakdown=None):
         tipo = 'placa'
         if hasattr(lot, 'x_tipo') and lot.x_tipo:
@@ -463,20 +652,11 @@ class SaleOrder(models.Model):
         if not is_partial_type:
             return None, 'full_quant'
 
-        if not breakdown:
-            breakdown = {}
-            if sale_line.x_lot_breakdown_json:
-                try:
-                    if isinstance(sale_line.x_lot_breakdown_json, str):
-                        breakdown = json.loads(sale_line.x_lot_breakdown_json)
-                    elif isinstance(sale_line.x_lot_breakdown_json, dict):
-                        breakdown = sale_line.x_lot_breakdown_json
-                except (json.JSONDecodeError, TypeError):
-                    breakdown = {}
-
-        lot_id_str = str(lot.id)
-        if lot_id_str in breakdown:
-            qty = float(breakdown[lot_id_str])
+        # Llaves de lote o de quant (carrito), ya resueltas por el accessor.
+        if not isinstance(breakdown, StoneBreakdown):
+            breakdown = sale_line._stone_breakdown(breakdown or None)
+        qty = breakdown.qty(lot.id)
+        if qty is not None:
             _logger.info(
                 "[STONE] Lote %s tipo=%s: usando breakdown → qty=%s",
                 lot.name,
@@ -485,19 +665,6 @@ class SaleOrder(models.Model):
             )
             return qty, 'breakdown'
 
-        if hasattr(sale_line, 'x_selected_lots') and sale_line.x_selected_lots:
-            for quant in sale_line.x_selected_lots:
-                if quant.lot_id.id == lot.id and str(quant.id) in breakdown:
-                    qty = float(breakdown[str(quant.id)])
-                    _logger.info(
-                        "[STONE] Lote %s tipo=%s: usando breakdown quant_id=%s → qty=%s",
-                        lot.name,
-                        tipo,
-                        quant.id,
-                        qty,
-                    )
-                    return qty, 'breakdown'
-
         num_lots = len(sale_line.lot_ids) if sale_line.lot_ids else 1
         if num_lots > 0 and sale_line.product_uom_qty > 0:
             _logger.info(
@@ -546,6 +713,52 @@ class SaleOrder(models.Model):
 
         return quants
 
+    def _stone_prefetch_assignment_quants(self, product_lot_pairs, source_locations):
+        """
+        {(product_id, lot_id): quants} para todos los pares con UNA sola
+        búsqueda. Trae lo que _stone_get_lot_quants_for_assignment podría
+        elegir (bajo las ubicaciones origen o en ubicaciones internas), en
+        su mismo orden; la elección por move la hace
+        _stone_select_assignment_quants en memoria.
+        """
+        Quant = self.env['stock.quant']
+        pairs = {(pid, lid) for pid, lid in product_lot_pairs if pid and lid}
+        if not pairs:
+            return {}
+
+        domain = [
+            ('product_id', 'in', list({pid for pid, _lid in pairs})),
+            ('lot_id', 'in', list({lid for _pid, lid in pairs})),
+            ('quantity', '>', 0),
+        ]
+        if source_locations:
+            domain += [
+                '|',
+                ('location_id.usage', '=', 'internal'),
+                ('location_id', 'child_of', source_locations.ids),
+            ]
+        else:
+            domain.append(('location_id.usage', '=', 'internal'))
+
+        ids_by_pair = {}
+        for quant in Quant.search(domain, order='quantity desc, location_id, id'):
+            key = (quant.product_id.id, quant.lot_id.id)
+            if key in pairs:
+                ids_by_pair.setdefault(key, []).append(quant.id)
+        return {key: Quant.browse(ids) for key, ids in ids_by_pair.items()}
+
+    def _stone_select_assignment_quants(self, quants, source_location=None):
+        """Mismo criterio que _stone_get_lot_quants_for_assignment sobre
+        quants ya cargados: bajo el origen; si no hay, internos."""
+        selected = quants.browse()
+        if source_location and source_location.parent_path:
+            selected = quants.filtered(
+                lambda q: (q.location_id.parent_path or '').startswith(
+                    source_location.parent_path))
+        if not selected:
+            selected = quants.filtered(lambda q: q.location_id.usage == 'internal')
+        return selected
+
     def _stone_get_lot_physical_qty(self, quants):
         return sum((q.quantity or 0.0) for q in quants)
 
@@ -587,12 +800,12 @@ class SaleOrder(models.Model):
             )
             existing_lines.with_context(ctx).unlink()
 
-    def _stone_create_lot_move_lines(self, move, lot, qty, product, quants, ctx):
+    def _stone_lot_move_line_vals(self, move, lot, qty, product, quants):
+        """Vals de las move lines que reparten `qty` del lote entre `quants`
+        (sin crearlas, para poder crear varias en un solo create)."""
         StockMoveLine = self.env['stock.move.line']
-        created_lines = StockMoveLine.browse()
-        splits = self._stone_build_quant_splits(quants, qty)
-
-        for quant, split_qty in splits:
+        vals_list = []
+        for quant, split_qty in self._stone_build_quant_splits(quants, qty):
             vals = {
                 'move_id': move.id,
                 'picking_id': move.picking_id.id if move.picking_id else False,
@@ -609,35 +822,41 @@ class SaleOrder(models.Model):
             if quant.owner_id and 'owner_id' in StockMoveLine._fields:
                 vals['owner_id'] = quant.owner_id.id
 
-            created_lines |= StockMoveLine.with_context(ctx).create(vals)
-
-            _logger.debug(
-                "[STONE] ✓ Move line creada lote=%s qty=%.6f ubicación=%s picking=%s",
-                lot.name,
-                split_qty,
-                quant.location_id.display_name,
-                move.picking_id.name if move.picking_id else 'N/A',
-            )
+            vals_list.append(vals)
+        return vals_list
 
+    def _stone_create_lot_move_lines(self, move, lot, qty, product, quants, ctx):
+        StockMoveLine = self.env['stock.move.line']
+        vals_list = self._stone_lot_move_line_vals(move, lot, qty, product, quants)
+        if not vals_list:
+            return StockMoveLine.browse()
+
+        created_lines = StockMoveLine.with_context(ctx).create(vals_list)
+        _logger.debug(
+            "[STONE] ✓ %s move line(s) creada(s) lote=%s qty=%.6f picking=%s",
+            len(created_lines),
+            lot.name,
+            qty,
+            move.picking_id.name if move.picking_id else 'N/A',
+        )
         return created_lines
 
-    def _assign_stone_lots_to_picking(self, pickings, sale_line, lots, breakdown=None):
+    def _stone_assignment_plan(self, pickings, sale_line, lots, breakdown=None, quants_by_pair=None):
+        """
+        Qué asignaría _assign_stone_lots_to_picking, sin escribir nada:
+        [{'move', 'entries': [{lot, qty, quants, qty_source, physical_qty}],
+          'total'}] por cada move abierto de la línea en `pickings`.
+        """
         product = sale_line.product_id
         if not lots:
-            return
+            return []
 
-        if not breakdown:
-            breakdown = {}
-
-        ctx = dict(
-            self.env.context,
-            skip_stone_sync=True,
-            skip_picking_clean=True,
-            skip_hold_validation=True,
-            skip_stone_sync_so=True,
-        )
+        # Un solo accessor para todos los lotes y moves de la línea.
+        if not isinstance(breakdown, StoneBreakdown):
+            breakdown = sale_line._stone_breakdown(breakdown or None)
 
         rounding = product.uom_id.rounding or 0.00001
+        plan = []
 
         for picking in pickings:
             # Filtrar TAMBIÉN por línea de venta: dos líneas con el MISMO
@@ -651,6 +870,7 @@ class SaleOrder(models.Model):
             )
 
             for move in moves:
+                entries = []
                 total_for_move = 0.0
 
                 for lot in lots:
@@ -660,11 +880,18 @@ class SaleOrder(models.Model):
                         breakdown,
                     )
 
-                    quants = self._stone_get_lot_quants_for_assignment(
-                        product=product,
-                        lot=lot,
-                        source_location=move.location_id,
-                    )
+                    if quants_by_pair is not None:
+                        quants = self._stone_select_assignment_quants(
+                            quants_by_pair.get(
+                                (product.id, lot.id), self.env['stock.quant']),
+                            source_location=move.location_id,
+                        )
+                    else:
+                        quants = self._stone_get_lot_quants_for_assignment(
+                            product=product,
+                            lot=lot,
+                            source_location=move.location_id,
+                        )
 
                     if not quants:
                         _logger.warning(
@@ -702,41 +929,226 @@ class SaleOrder(models.Model):
                     if float_compare(qty_to_assign, 0, precision_rounding=rounding) <= 0:
                         continue
 
-                    self._stone_unlink_existing_lot_move_lines(move, lot, ctx)
+                    entries.append({
+                        'lot': lot,
+                        'qty': qty_to_assign,
+                        'quants': quants,
+                        'qty_source': qty_source,
+                        'physical_qty': physical_qty,
+                    })
+                    total_for_move += qty_to_assign
+
+                plan.append({
+                    'move': move,
+                    'entries': entries,
+                    'total': total_for_move,
+                })
 
+        return plan
+
+    def _assign_stone_lots_to_picking(self, pickings, sale_line, lots, breakdown=None):
+        product = sale_line.product_id
+        if not lots:
+            return
+
+        ctx = dict(
+            self.env.context,
+            skip_stone_sync=True,
+            skip_picking_clean=True,
+            skip_hold_validation=True,
+            skip_stone_sync_so=True,
+        )
+
+        rounding = product.uom_id.rounding or 0.00001
+
+        for move_plan in self._stone_assignment_plan(pickings, sale_line, lots, breakdown):
+            move = move_plan['move']
+
+            for entry in move_plan['entries']:
+                lot = entry['lot']
+                self._stone_unlink_existing_lot_move_lines(move, lot, ctx)
+
+                _logger.info(
+                    "[STONE] Asignando lote %s qty=%.6f (source=%s, tipo=%s, físico_total=%.6f, quants=%s)",
+                    lot.name,
+                    entry['qty'],
+                    entry['qty_source'],
+                    lot.x_tipo if hasattr(lot, 'x_tipo') else 'placa',
+                    entry['physical_qty'],
+                    len(entry['quants']),
+                )
+
+                self._stone_create_lot_move_lines(
+                    move=move,
+                    lot=lot,
+                    qty=entry['qty'],
+                    product=product,
+                    quants=entry['quants'],
+                    ctx=ctx,
+                )
+
+            total_for_move = move_plan['total']
+            if float_compare(total_for_move, 0, precision_rounding=rounding) > 0:
+                if float_compare(
+                    move.product_uom_qty,
+                    total_for_move,
+                    precision_rounding=rounding,
+                ) != 0:
                     _logger.info(
-                        "[STONE] Asignando lote %s qty=%.6f (source=%s, tipo=%s, físico_total=%.6f, quants=%s)",
-                        lot.name,
-                        qty_to_assign,
-                        qty_source,
-                        lot.x_tipo if hasattr(lot, 'x_tipo') else 'placa',
-                        physical_qty,
-                        len(quants),
+                        "[STONE] Ajustando demanda del move %s de %.6f a %.6f para respetar selección exacta.",
+                        move.id,
+                        move.product_uom_qty,
+                        total_for_move,
                     )
+                    move.with_context(ctx).write({'product_uom_qty': total_for_move})
+
+    def _stone_bulk_assign_stone_lots(self, pickings, lines_lots_map):
+        """
+        Asignación forzada de TODAS las líneas de la orden en bloque:
+        quants de cada (producto, lote) en una sola búsqueda, repartos en
+        memoria, un solo create(vals_list) y la demanda de cada move escrita
+        una vez. Es lo que hacía _assign_stone_lots_to_picking línea por
+        línea y lote por lote, pero con el candado de la orden tomado mucho
+        menos tiempo.
+        """
+        self.ensure_one()
+        Lot = self.env['stock.lot']
+        StockMoveLine = self.env['stock.move.line']
+        ctx = dict(
+            self.env.context,
+            skip_stone_sync=True,
+            skip_picking_clean=True,
+            skip_hold_validation=True,
+            skip_stone_sync_so=True,
+        )
+
+        assignments = []
+        for line in self.order_line:
+            line_data = lines_lots_map.get(line.id)
+            if not line_data:
+                continue
+            lots = Lot.browse(line_data['lot_ids']).exists()
+            if lots:
+                assignments.append((line, lots, line_data.get('breakdown')))
+        if not assignments:
+            return StockMoveLine.browse()
+
+        open_moves = pickings.move_ids.filtered(
+            lambda m: m.state not in ['done', 'cancel'])
+        quants_by_pair = self._stone_prefetch_assignment_quants(
+            [(line.product_id.id, lot.id) for line, lots, _bd in assignments for lot in lots],
+            open_moves.mapped('location_id'),
+        )
 
-                    self._stone_create_lot_move_lines(
+        # (move_id, lot_id) -> vals: si dos líneas tocaran el mismo lote en
+        # el mismo move, gana la última (como el unlink previo por lote).
+        vals_by_key = {}
+        demand_by_move = {}
+        for line, lots, breakdown in assignments:
+            for move_plan in self._stone_assignment_plan(
+                    pickings, line, lots, breakdown, quants_by_pair=quants_by_pair):
+                move = move_plan['move']
+                for entry in move_plan['entries']:
+                    vals_by_key[(move.id, entry['lot'].id)] = self._stone_lot_move_line_vals(
                         move=move,
-                        lot=lot,
-                        qty=qty_to_assign,
-                        product=product,
-                        quants=quants,
-                        ctx=ctx,
+                        lot=entry['lot'],
+                        qty=entry['qty'],
+                        product=line.product_id,
+                        quants=entry['quants'],
                     )
-                    total_for_move += qty_to_assign
+                if move_plan['total'] > 0:
+                    demand_by_move[move] = move_plan['total']
+
+        vals_list = [vals for chunk in vals_by_key.values() for vals in chunk]
+        created = StockMoveLine.browse()
+        if vals_list:
+            created = StockMoveLine.with_context(ctx).create(vals_list)
+        _logger.info(
+            "[STONE] Asignación en bloque %s: %s línea(s), %s lote(s), %s move line(s).",
+            self.name,
+            len(assignments),
+            len(vals_by_key),
+            len(created),
+        )
 
-                if float_compare(total_for_move, 0, precision_rounding=rounding) > 0:
-                    if float_compare(
-                        move.product_uom_qty,
-                        total_for_move,
-                        precision_rounding=rounding,
-                    ) != 0:
-                        _logger.info(
-                            "[STONE] Ajustando demanda del move %s de %.6f a %.6f para respetar selección exacta.",
-                            move.id,
-                            move.product_uom_qty,
-                            total_for_move,
-                        )
-                        move.with_context(ctx).write({'product_uom_qty': total_for_move})
+        for move, total_for_move in demand_by_move.items():
+            rounding = move.product_id.uom_id.rounding or 0.00001
+            if float_compare(
+                move.product_uom_qty,
+                total_for_move,
+                precision_rounding=rounding,
+            ) != 0:
+                _logger.info(
+                    "[STONE] Ajustando demanda del move %s de %.6f a %.6f para respetar selección exacta.",
+                    move.id,
+                    move.product_uom_qty,
+                    total_for_move,
+                )
+                move.with_context(ctx).write({'product_uom_qty': total_for_move})
+
+        return created
+
+    def get_stone_reservation_plan(self):
+        """
+        Dry-run de la asignación forzada (_assign_stone_lots_to_picking) de
+        cada orden: move lines a crear y a quitar y cambios de demanda, con
+        desglose de tiempo y consultas por fase. NO escribe nada.
+
+        Las cotizaciones no tienen pickings ni selección de stock: salen
+        con `skipped` y sin moves.
+        """
+        SaleLine = self.env['sale.order.line']
+        result = {}
+        for order in self:
+            timings = {}
+            lines_out = []
+            skipped = order.state not in ('sale', 'done')
+
+            with SaleLine._stone_plan_phase(timings, 'load'):
+                pickings = order.picking_ids.filtered(
+                    lambda p: p.state not in ['cancel', 'done'])
+                lines = order.order_line.filtered(lambda l: l.lot_ids)
+
+            if not skipped and pickings:
+                plans = []
+                with SaleLine._stone_plan_phase(timings, 'plan'):
+                    for line in lines:
+                        plans.append((line, order._stone_assignment_plan(
+                            pickings, line, line.lot_ids,
+                            line._stone_breakdown())))
+                with SaleLine._stone_plan_phase(timings, 'serialize'):
+                    for line, line_plan in plans:
+                        moves_out = []
+                        for move_plan in line_plan:
+                            move = move_plan['move']
+                            vals_list = []
+                            to_unlink = self.env['stock.move.line'].browse()
+                            for entry in move_plan['entries']:
+                                vals_list += order._stone_lot_move_line_vals(
+                                    move, entry['lot'], entry['qty'],
+                                    line.product_id, entry['quants'])
+                                to_unlink |= move.move_line_ids.filtered(
+                                    lambda ml, lot=entry['lot']: ml.lot_id == lot)
+                            demand_after = (
+                                move_plan['total'] if move_plan['total'] > 0
+                                else move.product_uom_qty or 0.0)
+                            moves_out.append(SaleLine._stone_plan_serialize_move(
+                                move, demand_after, to_unlink, vals_list))
+                        lines_out.append({
+                            'line_id': line.id,
+                            'moves': moves_out,
+                            'totals': SaleLine._stone_plan_totals(moves_out),
+                        })
+
+            all_moves = [m for line in lines_out for m in line['moves']]
+            result[order.id] = {
+                'order_id': order.id,
+                'skipped': skipped,
+                'lines': lines_out,
+                'totals': SaleLine._stone_plan_totals(all_moves),
+                'timings': timings,
+            }
+        return result
 
     def copy_data(self, default=None):
         return super().copy_data(default)
@@ -1,12 +1,55 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from contextlib import contextmanager
 import json
 import logging
+import time
 
 _logger = logging.getLogger(__name__)
 
 
+class StoneBreakdown:
+    """
+    Desglose de una línea ya resuelto: {lot_id: qty} con O(1) por lote.
+
+    El JSON del carrito puede traer llaves de LOT o de QUANT. Las de quant
+    se traducen a su lote con el mapa quant→lote de x_selected_lots (el
+    primer quant con llave gana); una llave de lote siempre gana sobre la
+    de quant. Es el mismo criterio que antes se repetía con un recorrido
+    de x_selected_lots por cada lote consultado.
+    """
+    __slots__ = ('raw', '_by_lot')
+
+    def __init__(self, raw, quant_lot_pairs=()):
+        self.raw = raw or {}
+        by_lot = {}
+        for quant_id, lot_id in quant_lot_pairs:
+            key = str(quant_id)
+            if lot_id and lot_id not in by_lot and key in self.raw:
+                by_lot[lot_id] = self._to_float(self.raw[key])
+        for key, val in self.raw.items():
+            try:
+                by_lot[int(key)] = self._to_float(val)
+            except (TypeError, ValueError):
+                continue
+        self._by_lot = by_lot
+
+    @staticmethod
+    def _to_float(val):
+        try:
+            return float(val or 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def __bool__(self):
+        return bool(self.raw)
+
+    def qty(self, lot_id):
+        """Cantidad del lote en el desglose, o None si no aparece."""
+        return self._by_lot.get(lot_id)
+
+
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
 
@@ -82,6 +125,20 @@ class SaleOrderLine(models.Model):
                 return {}
         return {}
 
+    def _stone_breakdown(self, breakdown=None):
+        """StoneBreakdown de la línea (o de `breakdown`, si se da un dict
+        distinto al guardado). Cuesta O(n) armarlo: cada pasada lo arma UNA
+        vez por línea y pasa el accessor hacia abajo en lugar del dict."""
+        self.ensure_one()
+        if isinstance(breakdown, StoneBreakdown):
+            return breakdown
+        raw = self._parse_breakdown_dict() if breakdown is None else (breakdown or {})
+        quant_lot_pairs = ()
+        if 'x_selected_lots' in self._fields and self.x_selected_lots:
+            quant_lot_pairs = [
+                (quant.id, quant.lot_id.id) for quant in self.x_selected_lots]
+        return StoneBreakdown(raw, quant_lot_pairs)
+
     def _stone_line_get_lot_quants(self, lot, move=None):
         source_location = move.location_id if move and move.location_id else False
 
@@ -129,39 +186,32 @@ class SaleOrderLine(models.Model):
             return move_line.qty_done or 0.0
         return 0.0
 
-    def _stone_line_expected_qty_for_lot(self, lot, breakdown, move=None):
+    def _stone_line_expected_qty_for_lot(self, lot, breakdown, move=None, quants=None, split_lots=None):
         tipo = str(lot.x_tipo).lower() if lot.x_tipo else 'placa'
-        lot_id_str = str(lot.id)
-        quants = self._stone_line_get_lot_quants(lot, move=move)
+        if quants is None:
+            quants = self._stone_line_get_lot_quants(lot, move=move)
         physical_qty = sum((q.quantity or 0.0) for q in quants)
 
         if tipo in ('formato', 'pieza'):
-            if lot_id_str in breakdown:
-                expected_qty = float(breakdown[lot_id_str] or 0.0)
-            else:
-                # El breakdown puede venir con claves de quant.id (flujo del
-                # carrito) en lugar de lot.id — mismo criterio que
-                # _get_lot_qty_for_line en la confirmación.
-                expected_qty = None
-                if hasattr(self, 'x_selected_lots') and self.x_selected_lots:
-                    for quant in self.x_selected_lots:
-                        if quant.lot_id.id == lot.id and str(quant.id) in breakdown:
-                            expected_qty = float(breakdown[str(quant.id)] or 0.0)
-                            break
-
-                if expected_qty is None:
-                    # Formato/pieza SIN desglose: repartir lo vendido entre los
-                    # lotes de la línea (como hace la confirmación) en lugar de
-                    # reservar la placa física COMPLETA. Antes, vender 2 m² de
-                    # un formato podía dejar la entrega con demanda de 15 m².
-                    num_lots = len(self.lot_ids) if self.lot_ids else 1
-                    if num_lots > 0 and (self.product_uom_qty or 0.0) > 0:
-                        expected_qty = min(
-                            (self.product_uom_qty or 0.0) / num_lots,
-                            physical_qty,
-                        )
-                    else:
-                        expected_qty = physical_qty
+            # El breakdown puede venir con claves de quant.id (flujo del
+            # carrito) en lugar de lot.id: el accessor ya las resolvió.
+            accessor = self._stone_breakdown(breakdown)
+            expected_qty = accessor.qty(lot.id)
+            if expected_qty is None:
+                # Formato/pieza SIN desglose: repartir lo vendido entre los
+                # lotes de la línea (como hace la confirmación) en lugar de
+                # reservar la placa física COMPLETA. Antes, vender 2 m² de
+                # un formato podía dejar la entrega con demanda de 15 m².
+                if split_lots is None:
+                    split_lots = self.lot_ids
+                num_lots = len(split_lots) if split_lots else 1
+                if num_lots > 0 and (self.product_uom_qty or 0.0) > 0:
+                    expected_qty = min(
+                        (self.product_uom_qty or 0.0) / num_lots,
+                        physical_qty,
+                    )
+                else:
+                    expected_qty = physical_qty
         else:
             expected_qty = physical_qty
 
@@ -176,22 +226,69 @@ class SaleOrderLine(models.Model):
 
         return expected_qty, physical_qty, tipo, quants
 
-    def _stone_line_create_exact_move_lines(self, move, lot, qty, quants, ctx):
+    def _stone_line_prefetch_lot_quants(self, lots, moves):
+        """
+        {(move_id, lot_id): quants} con UNA sola búsqueda de quants para
+        todos los lotes y moves de la línea. Mismo criterio que
+        _stone_line_get_lot_quants: primero los quants bajo la ubicación
+        origen del move; si no hay, cualquier ubicación interna.
+        """
+        self.ensure_one()
+        Quant = self.env['stock.quant']
+        if not lots:
+            return {}
+
+        domain = [
+            ('lot_id', 'in', lots.ids),
+            ('product_id', '=', self.product_id.id),
+            ('quantity', '>', 0),
+        ]
+        sources = moves.mapped('location_id')
+        if sources:
+            domain += [
+                '|',
+                ('location_id.usage', '=', 'internal'),
+                ('location_id', 'child_of', sources.ids),
+            ]
+        else:
+            domain.append(('location_id.usage', '=', 'internal'))
+        quants = Quant.search(domain, order='quantity desc, location_id, id')
+
+        ids_by_lot = {}
+        for quant in quants:
+            ids_by_lot.setdefault(quant.lot_id.id, []).append(quant.id)
+
+        result = {}
+        for move in moves:
+            source = move.location_id
+            for lot in lots:
+                lot_quants = Quant.browse(ids_by_lot.get(lot.id, []))
+                picked = Quant.browse()
+                if source and source.parent_path:
+                    picked = lot_quants.filtered(
+                        lambda q: (q.location_id.parent_path or '').startswith(
+                            source.parent_path))
+                if not picked:
+                    picked = lot_quants.filtered(
+                        lambda q: q.location_id.usage == 'internal')
+                result[(move.id, lot.id)] = picked
+        return result
+
+    def _stone_line_move_line_vals(self, move, lot, qty, quants):
         if qty <= 0:
-            return self.env['stock.move.line'].browse()
+            return []
 
-        if self.order_id and hasattr(self.order_id, '_stone_create_lot_move_lines'):
-            return self.order_id._stone_create_lot_move_lines(
+        if self.order_id and hasattr(self.order_id, '_stone_lot_move_line_vals'):
+            return self.order_id._stone_lot_move_line_vals(
                 move=move,
                 lot=lot,
                 qty=qty,
                 product=self.product_id,
                 quants=quants,
-                ctx=ctx,
             )
 
         StockMoveLine = self.env['stock.move.line']
-        created = StockMoveLine.browse()
+        vals_list = []
         remaining = qty
 
         for quant in quants.filtered(lambda q: (q.quantity or 0.0) > 0):
@@ -213,10 +310,17 @@ class SaleOrderLine(models.Model):
                 vals['reserved_uom_qty'] = take_qty
             elif 'qty_done' in StockMoveLine._fields:
                 vals['qty_done'] = take_qty
-            created |= StockMoveLine.with_context(ctx).create(vals)
+            vals_list.append(vals)
             remaining -= take_qty
 
-        return created
+        return vals_list
+
+    def _stone_line_create_exact_move_lines(self, move, lot, qty, quants, ctx):
+        StockMoveLine = self.env['stock.move.line']
+        vals_list = self._stone_line_move_line_vals(move, lot, qty, quants)
+        if not vals_list:
+            return StockMoveLine.browse()
+        return StockMoveLine.with_context(ctx).create(vals_list)
 
     # =========================================================================
     # DIAGNÓSTICO / CREATE / WRITE
@@ -265,6 +369,9 @@ class SaleOrderLine(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
+        order_ids = {vals['order_id'] for vals in vals_list if vals.get('order_id')}
+        if order_ids:
+            self.env['sale.order'].browse(order_ids)._stone_check_confirm_lock()
         clean_vals_list = []
 
         for idx, vals in enumerate(vals_list):
@@ -303,6 +410,11 @@ class SaleOrderLine(models.Model):
         for line in lines:
             if line.lot_ids:
                 line._som_log_lot_change(line.lot_ids, 'assign')
+        if new_lines:
+            self.env['stock.lot.commitment']._stone_mark_dirty(
+                new_lines.mapped('lot_ids').ids)
+            self.env['stock.quant']._stone_bump_selector_generation(
+                new_lines.mapped('product_id').ids)
         return lines
 
     # =========================================================================
@@ -314,24 +426,113 @@ class SaleOrderLine(models.Model):
     # motivo para poder contestar "¿quién desasignó el material de V/091?".
 
     def _som_log_lot_change(self, lots, action, reason=None, note=None):
+        """Encola el registro en la bitácora. Se escribe en el precommit de
+        la transacción (_som_flush_lot_logs), fuera del camino crítico del
+        write: un sync de picking que toca 50 líneas ya no hace 50 lecturas
+        de orden/cliente/vendedor ni 50 creates sueltos.
+
+        Cada entrada guarda SU env: el usuario y el contexto del que hizo el
+        cambio (p. ej. som_lot_log_reason) son los que quedan en el registro.
+        Con el contexto `stone_log_lots_now` se escribe en el acto."""
         self.ensure_one()
         if not lots:
             return
-        order = self.order_id
-        material = ''
-        if self.product_id:
-            material = self.x_mask_name or self.product_id.display_name or ''
-        self.env['stock.lot.assignment.log']._som_log_lots(
-            lots,
-            action,
-            document=order,
-            line=self,
-            reason=reason,
-            note=note or material or False,
-            partner=order.partner_id if order else None,
-            salesperson=order.user_id if order else None,
-            product=self.product_id,
-        )
+        entry = (self.env, self.id, action, reason or False,
+                 note or False, tuple(lots.ids))
+        if self.env.context.get('stone_log_lots_now'):
+            self._som_flush_lot_logs([entry])
+            return
+
+        data = self.env.cr.precommit.data
+        pending = data.get('stone_assignment_log')
+        if pending is None:
+            pending = data['stone_assignment_log'] = []
+            env = self.env
+
+            @self.env.cr.precommit.add
+            def _stone_flush_assignment_log():
+                queued = data.pop('stone_assignment_log', [])
+                if queued:
+                    env['sale.order.line']._som_flush_lot_logs(queued)
+                    env.flush_all()
+        pending.append(entry)
+
+    @api.model
+    def _som_flush_lot_logs(self, entries):
+        """Escribe la bitácora encolada, en orden cronológico. Solo se
+        juntan entradas CONSECUTIVAS idénticas (mismo env, línea, acción,
+        motivo y nota) en una llamada con todos sus lotes: un
+        assign→unassign→assign del mismo lote queda como tres registros.
+        Orden, cliente, vendedor y material se leen con prefetch para todas
+        las líneas a la vez.
+
+        Los savepoints del módulo (stone_savepoint) ya recortan lo encolado
+        al revertirse; para los ajenos, el último movimiento de cada
+        (línea, lote) se contrasta con lot_ids real y se omite si no
+        ocurrió: 'assign' de un lote que no quedó en la línea o 'unassign'
+        de uno que sigue en ella."""
+        lines = self.browse({entry[1] for entry in entries}).exists()
+        if not lines:
+            return
+        current = {line.id: set(line.lot_ids.ids) for line in lines}
+        last = {}
+        for index, entry in enumerate(entries):
+            for lot_id in entry[5]:
+                last[(entry[1], lot_id)] = index
+
+        runs = []
+        skipped = 0
+        for index, (env, line_id, action, reason, note, lot_ids) in enumerate(entries):
+            if line_id not in current:
+                continue
+            valid = []
+            for lid in lot_ids:
+                if last[(line_id, lid)] == index and (
+                        (lid in current[line_id]) != (action == 'assign')):
+                    skipped += 1
+                    continue
+                valid.append(lid)
+            if not valid:
+                continue
+            key = (id(env), line_id, action, reason, note)
+            if runs and runs[-1][0] == key:
+                runs[-1][2].extend(lid for lid in valid if lid not in runs[-1][2])
+            else:
+                runs.append((key, env, valid))
+        if skipped:
+            _logger.info(
+                "[STONE LOG] Bitácora: %s movimiento(s) revertido(s) omitido(s)",
+                skipped)
+        if not runs:
+            return
+        # Prefetch en bloque: las lecturas de abajo ya no van línea por línea
+        # (la caché es de la transacción, la comparten todos los env).
+        lines.mapped('order_id.partner_id')
+        lines.mapped('order_id.user_id')
+        lines.mapped('product_id.display_name')
+        if 'x_mask_name' in self._fields:
+            lines.mapped('x_mask_name')
+
+        for (_env_key, line_id, action, reason, note), env, lot_ids in runs:
+            line = env['sale.order.line'].browse(line_id)
+            order = line.order_id
+            material = ''
+            if line.product_id:
+                material = line.x_mask_name or line.product_id.display_name or ''
+            env['stock.lot.assignment.log']._som_log_lots(
+                env['stock.lot'].browse(lot_ids),
+                action,
+                document=order,
+                line=line,
+                reason=reason or None,
+                note=note or material or False,
+                partner=order.partner_id if order else None,
+                salesperson=order.user_id if order else None,
+                product=line.product_id,
+            )
+        _logger.info(
+            "[STONE LOG] Bitácora de asignación: %s registro(s) en %s llamada(s)",
+            len(entries), len(runs))
 
     def _som_snapshot_lot_ids(self):
         """{line_id: set(lot_ids)} ANTES del write, para diferenciar después."""
@@ -379,42 +580,81 @@ class SaleOrderLine(models.Model):
         lote que la línea ya tenía no debe impedir editar cantidades ni
         quitar otras placas — validar solo el delta, jamás la historia."""
         Quant = self.env['stock.quant'].sudo()
+        check_by_line = {}
         for line in self:
             if not line.lot_ids:
                 continue
-            check_lots = line.lot_ids
+            check_lot_ids = set(line.lot_ids.ids)
             if added_by_line is not None:
-                added = added_by_line.get(line.id) or set()
-                check_lots = line.lot_ids.filtered(lambda l: l.id in added)
-                if not check_lots:
-                    continue
+                check_lot_ids &= set(added_by_line.get(line.id) or set())
+            if check_lot_ids:
+                check_by_line[line] = check_lot_ids
+        if not check_by_line:
+            return
+
+        # UNA pasada por write: todos los quants en una búsqueda y un solo
+        # candado en orden de id estable. Antes era un FOR UPDATE por línea
+        # en orden arbitrario, y dos vendedores concurrentes se cruzaban en
+        # deadlock sobre los mismos quants.
+        companies = {
+            (line.company_id or self.env.company).id for line in check_by_line}
+        quants = Quant.search([
+            ('lot_id', 'in', list(set().union(*check_by_line.values()))),
+            ('location_id.usage', '=', 'internal'),
+            ('quantity', '>', 0),
+            ('company_id', 'in', list(companies)),
+        ])
+        if not quants:
+            return
+        self.env.cr.execute(
+            "SELECT id FROM stock_quant WHERE id IN %s ORDER BY id FOR UPDATE",
+            [tuple(sorted(quants.ids))],
+        )
+        quants.invalidate_recordset()
+        # Holds y socios comerciales en bloque (el candado ya se tomó).
+        quants.mapped('x_hold_activo_id.partner_id.commercial_partner_id')
+        self.mapped('order_id.partner_id.commercial_partner_id')
+
+        quants_by_lot = {}
+        for quant in quants:
+            quants_by_lot.setdefault(quant.lot_id.id, []).append(quant)
+
+        violations = []
+        seen = set()
+        for line, check_lot_ids in check_by_line.items():
             company = line.company_id or self.env.company
-            quants = Quant.search([
-                ('lot_id', 'in', check_lots.ids),
-                ('location_id.usage', '=', 'internal'),
-                ('quantity', '>', 0),
-                ('company_id', '=', company.id),
-            ])
-            if not quants:
-                continue
-            self.env.cr.execute(
-                "SELECT id FROM stock_quant WHERE id IN %s FOR UPDATE",
-                [tuple(quants.ids)],
-            )
-            quants.invalidate_recordset()
             order_partner = line.order_id.partner_id
-            for quant in quants:
-                hold = quant.x_hold_activo_id if quant.x_tiene_hold else False
-                if (hold and hold.partner_id and order_partner
-                        and hold.partner_id.commercial_partner_id
-                        != order_partner.commercial_partner_id):
-                    raise UserError(_(
-                        'El lote %(lot)s está APARTADO para %(partner)s y no '
-                        'puede asignarse a este pedido. Si el apartado ya no '
-                        'aplica, cancélalo primero.',
-                        lot=quant.lot_id.name,
-                        partner=hold.partner_id.name,
-                    ))
+            if not order_partner:
+                continue
+            for lot_id in sorted(check_lot_ids):
+                for quant in quants_by_lot.get(lot_id, []):
+                    if quant.company_id != company:
+                        continue
+                    hold = quant.x_hold_activo_id if quant.x_tiene_hold else False
+                    if (hold and hold.partner_id
+                            and hold.partner_id.commercial_partner_id
+                            != order_partner.commercial_partner_id):
+                        key = (quant.lot_id.id, hold.partner_id.id)
+                        if key not in seen:
+                            seen.add(key)
+                            violations.append((quant.lot_id.name, hold.partner_id.name))
+
+        if len(violations) == 1:
+            raise UserError(_(
+                'El lote %(lot)s está APARTADO para %(partner)s y no '
+                'puede asignarse a este pedido. Si el apartado ya no '
+                'aplica, cancélalo primero.',
+                lot=violations[0][0],
+                partner=violations[0][1],
+            ))
+        if violations:
+            raise UserError(_(
+                'Estos lotes están APARTADOS para otros clientes y no pueden '
+                'asignarse a este pedido:\n%(lots)s\n\nSi el apartado ya no '
+                'aplica, cancélalo primero.',
+                lots='\n'.join(
+                    '• %s → %s' % (lot, partner) for lot, partner in violations),
+            ))
 
     def _stone_validate_duplicate_plates_in_order(self, added_by_line=None):
         """Una PLACA no puede vivir en lot_ids de DOS líneas del mismo
@@ -428,39 +668,102 @@ class SaleOrderLine(models.Model):
         candado de move lines)."""
         if self.env.context.get('skip_stone_dup_plate_check'):
             return
-        for order in self.mapped('order_id'):
-            seen = {}
-            for line in order.order_line:
-                if line.display_type or not line.lot_ids:
-                    continue
-                for lot in line.lot_ids:
-                    tipo = str(getattr(lot, 'x_tipo', '') or 'placa').lower()
-                    if tipo in ('formato', 'pieza'):
+        orders = self.mapped('order_id')
+        if not orders:
+            return
+
+        # Solo la placa RECIÉN AGREGADA en este write puede bloquear: si el
+        # write no agregó ninguna placa (solo cantidades de formato/pieza o
+        # quitados) no hay nada que validar.
+        scope_lot_ids = None
+        if added_by_line is not None:
+            added_ids = set().union(*added_by_line.values()) if added_by_line else set()
+            scope_lot_ids = [
+                lot.id for lot in self.env['stock.lot'].browse(list(added_ids))
+                if self._stone_lot_tipo(lot) not in ('formato', 'pieza')
+            ]
+            if not scope_lot_ids:
+                return
+
+        seen_by_order = {}
+        for order_id, line_id, lot_id, lot_name, tipo in self._stone_order_line_lot_rows(
+                orders.ids, scope_lot_ids):
+            if tipo in ('formato', 'pieza'):
+                continue
+            seen = seen_by_order.setdefault(order_id, {})
+            if lot_id in seen and seen[lot_id] != line_id:
+                # Solo la placa RECIÉN AGREGADA en este write puede
+                # bloquear. Un duplicado HISTÓRICO (dato viejo) no
+                # debe impedir editar cantidades ni DESASIGNAR — de
+                # hecho quitar la placa de una línea es justo la
+                # manera de corregirlo, y este candado lo impedía.
+                if added_by_line is not None:
+                    involved = (
+                        added_by_line.get(line_id, set())
+                        | added_by_line.get(seen[lot_id], set()))
+                    if lot_id not in involved:
+                        seen[lot_id] = line_id
                         continue
-                    if lot.id in seen and seen[lot.id] != line.id:
-                        # Solo la placa RECIÉN AGREGADA en este write puede
-                        # bloquear. Un duplicado HISTÓRICO (dato viejo) no
-                        # debe impedir editar cantidades ni DESASIGNAR — de
-                        # hecho quitar la placa de una línea es justo la
-                        # manera de corregirlo, y este candado lo impedía.
-                        if added_by_line is not None:
-                            involved = (
-                                added_by_line.get(line.id, set())
-                                | added_by_line.get(seen[lot.id], set()))
-                            if lot.id not in involved:
-                                seen[lot.id] = line.id
-                                continue
-                        raise UserError(_(
-                            'La placa %(lot)s ya está asignada en OTRA línea '
-                            'de este mismo pedido (%(order)s). Una placa solo '
-                            'puede vivir en una línea: quítala de una de las '
-                            'dos antes de guardar.',
-                            lot=lot.name,
-                            order=order.name,
-                        ))
-                    seen[lot.id] = line.id
+                raise UserError(_(
+                    'La placa %(lot)s ya está asignada en OTRA línea '
+                    'de este mismo pedido (%(order)s). Una placa solo '
+                    'puede vivir en una línea: quítala de una de las '
+                    'dos antes de guardar.',
+                    lot=lot_name,
+                    order=orders.browse(order_id).name,
+                ))
+            seen[lot_id] = line_id
+
+    @api.model
+    def _stone_lot_tipo(self, lot):
+        return str(getattr(lot, 'x_tipo', '') or 'placa').lower()
+
+    @api.model
+    def _stone_order_line_lot_rows(self, order_ids, lot_ids=None):
+        """(order_id, line_id, lot_id, lot_name, tipo) de las líneas con
+        placas de las órdenes, en el orden de las líneas y de los lotes,
+        con UNA consulta sobre la tabla relación (opcionalmente acotada a
+        `lot_ids`)."""
+        Lot = self.env['stock.lot']
+        field = self._fields['lot_ids']
+        tipo_field = Lot._fields.get('x_tipo')
+        self.flush_model(['lot_ids', 'order_id', 'display_type', 'sequence'])
+        Lot.flush_model(['name'] + (['x_tipo'] if tipo_field else []))
+
+        tipo_sql = (
+            "LOWER(COALESCE(lot.x_tipo, 'placa'))"
+            if tipo_field and tipo_field.store and tipo_field.column_type
+            else "NULL"
+        )
+        where = ["sol.order_id IN %s", "sol.display_type IS NULL"]
+        params = [tuple(order_ids)]
+        if lot_ids is not None:
+            where.append("rel.{col2} IN %s".format(col2=field.column2))
+            params.append(tuple(lot_ids))
+        self.env.cr.execute("""
+            SELECT sol.order_id, sol.id, lot.id, lot.name, {tipo}
+              FROM {rel} rel
+              JOIN sale_order_line sol ON sol.id = rel.{col1}
+              JOIN stock_lot lot ON lot.id = rel.{col2}
+             WHERE {where}
+             ORDER BY sol.order_id, sol.sequence, sol.id, lot.name, lot.id
+        """.format(
+            tipo=tipo_sql,
+            rel=field.relation,
+            col1=field.column1,
+            col2=field.column2,
+            where=' AND '.join(where),
+        ), params)
+        rows = self.env.cr.fetchall()
+        if tipo_sql == "NULL":
+            # x_tipo no almacenado: se resuelve por ORM, una sola lectura.
+            lots = {lot.id: lot for lot in Lot.browse({r[2] for r in rows})}
+            rows = [r[:4] + (self._stone_lot_tipo(lots[r[2]]),) for r in rows]
+        return rows
 
     def write(self, vals):
+        # El widget escribe la línea directo (no pasa por sale.order.write).
+        self.mapped('order_id')._stone_check_confirm_lock()
         vals = dict(vals or {})
 
         has_selection_vals = any(
@@ -552,6 +855,16 @@ class SaleOrderLine(models.Model):
         if lots_before is not None:
             self._som_log_lot_diff(lots_before)
 
+        # La cantidad vendida reparte formatos/piezas entre los lotes: también
+        # cambia cuánto compromete la línea.
+        if has_selection_vals or {'product_uom_qty', 'product_id'} & set(vals):
+            touched = set(self.mapped('lot_ids').ids)
+            for before_ids in (lots_before or {}).values():
+                touched |= before_ids
+            self.env['stock.lot.commitment']._stone_mark_dirty(touched)
+            self.env['stock.quant']._stone_bump_selector_generation(
+                self.mapped('product_id').ids)
+
         if (
             any(k in vals for k in ('lot_ids', 'x_lot_breakdown_json'))
             and not self.env.context.get('skip_stone_sync_picking')
@@ -566,13 +879,33 @@ class SaleOrderLine(models.Model):
 
         return result
 
+    def unlink(self):
+        self.mapped('order_id')._stone_check_confirm_lock()
+        # Una línea borrada deja de comprometer sus placas.
+        lot_ids = self.mapped('lot_ids').ids
+        product_ids = self.mapped('product_id').ids
+        res = super().unlink()
+        if lot_ids:
+            self.env['stock.lot.commitment']._stone_mark_dirty(lot_ids)
+            self.env['stock.quant']._stone_bump_selector_generation(product_ids)
+        return res
+
     def _sync_lots_to_picking_moves(self):
+        """
+        Reconcilia las move lines de los moves abiertos con la selección.
+
+        Por línea: una sola búsqueda de quants para todos los lotes, un plan
+        de diferencias por move (agregar / reconstruir / quitar) y luego,
+        por move, UN unlink y UN create multi-registro. Antes cada lote
+        buscaba sus quants y cada split de quant era un create() propio.
+        """
         ctx = dict(
             self.env.context,
             skip_stone_sync_so=True,
             skip_picking_clean=True,
             skip_hold_validation=True,
         )
+        StockMoveLine = self.env['stock.move.line']
 
         for sale_line in self:
             if not sale_line._stone_can_select_lots():
@@ -583,114 +916,253 @@ class SaleOrderLine(models.Model):
                 continue
 
             target_lots = sale_line.lot_ids
-            breakdown = sale_line._parse_breakdown_dict()
+            breakdown = sale_line._stone_breakdown()
 
             moves = sale_line.move_ids.filtered(lambda m: m.state not in ['cancel', 'done'])
+            if not moves:
+                continue
+
+            quants_by_key = sale_line._stone_line_prefetch_lot_quants(target_lots, moves)
 
             for move in moves:
                 picking = move.picking_id
-                expected_by_lot = {}
-                total_qty = 0.0
-
-                for lot in target_lots:
-                    expected_qty, physical_qty, tipo, quants = sale_line._stone_line_expected_qty_for_lot(
-                        lot,
-                        breakdown,
-                        move=move,
-                    )
-                    expected_by_lot[lot.id] = {
-                        'qty': expected_qty,
-                        'physical_qty': physical_qty,
-                        'tipo': tipo,
-                        'quants': quants,
-                    }
-                    total_qty += expected_qty
+                plan = sale_line._stone_line_sync_plan(
+                    move, target_lots, breakdown, quants_by_key)
 
-                if total_qty > 0 and abs((move.product_uom_qty or 0.0) - total_qty) > 0.0001:
+                if plan['total_qty'] > 0 and abs((move.product_uom_qty or 0.0) - plan['total_qty']) > 0.0001:
                     _logger.info(
                         "[STONE SYNC] Ajustando demanda Move %s de %s a %s",
                         move.id,
                         move.product_uom_qty,
-                        total_qty,
+                        plan['total_qty'],
                     )
-                    move.with_context(ctx).write({'product_uom_qty': total_qty})
+                    move.with_context(ctx).write({'product_uom_qty': plan['total_qty']})
 
-                existing_move_lines = move.move_line_ids
-                existing_lots = existing_move_lines.mapped('lot_id')
-
-                lots_to_remove = existing_lots - target_lots
-                if lots_to_remove:
-                    lines_to_unlink = existing_move_lines.filtered(lambda ml: ml.lot_id in lots_to_remove)
+                if plan['to_unlink']:
                     _logger.info(
-                        "[STONE SYNC] Eliminando %s lote(s) del picking %s",
-                        len(lines_to_unlink),
+                        "[STONE SYNC] Picking %s: quitando %s lote(s), reconstruyendo %s, "
+                        "%s move line(s) eliminadas",
                         picking.name if picking else 'N/A',
+                        len(plan['removed']),
+                        len(plan['rebuilt']),
+                        len(plan['to_unlink']),
                     )
-                    lines_to_unlink.with_context(ctx).unlink()
+                    plan['to_unlink'].with_context(ctx).unlink()
 
-                lots_to_add = target_lots - existing_lots
-                if lots_to_add:
+                if plan['vals_list']:
                     _logger.info(
-                        "[STONE SYNC] Agregando %s lote(s) al picking %s",
-                        len(lots_to_add),
+                        "[STONE SYNC] Picking %s: agregando %s lote(s), %s move line(s) nuevas",
                         picking.name if picking else 'N/A',
+                        len(plan['added']),
+                        len(plan['vals_list']),
                     )
-                    for lot in lots_to_add:
-                        data = expected_by_lot.get(lot.id) or {}
-                        qty = data.get('qty') or 0.0
-                        quants = data.get('quants') or sale_line._stone_line_get_lot_quants(lot, move=move)
-
-                        if not quants:
-                            _logger.warning(
-                                "[STONE SYNC] No se pudo sincronizar lote %s: no hay stock físico encontrado.",
-                                lot.name,
-                            )
-                            continue
-
-                        if qty <= 0:
-                            continue
-
-                        sale_line._stone_line_create_exact_move_lines(move, lot, qty, quants, ctx)
-
-                for lot in (target_lots & existing_lots):
-                    existing_lines = move.move_line_ids.filtered(lambda ml: ml.lot_id.id == lot.id)
-                    data = expected_by_lot.get(lot.id) or {}
-                    expected_qty = data.get('qty') or 0.0
-                    quants = data.get('quants') or sale_line._stone_line_get_lot_quants(lot, move=move)
-
-                    if not existing_lines:
-                        if expected_qty > 0 and quants:
-                            sale_line._stone_line_create_exact_move_lines(move, lot, expected_qty, quants, ctx)
-                        continue
-
-                    current_qty = sum(sale_line._stone_line_move_line_qty(ml) for ml in existing_lines)
-                    valid_location_ids = set(quants.mapped('location_id').ids) if quants else set()
-                    current_location_ids = set(existing_lines.mapped('location_id').ids)
+                    StockMoveLine.with_context(ctx).create(plan['vals_list'])
 
-                    needs_rebuild = abs(current_qty - expected_qty) > 0.0001
-                    if valid_location_ids and (current_location_ids - valid_location_ids):
-                        needs_rebuild = True
+    def _stone_line_sync_plan(self, move, target_lots, breakdown, quants_by_key):
+        """Plan de diferencias de un move contra la selección, sin escribir
+        nada: move lines a borrar, vals a crear y demanda total esperada."""
+        self.ensure_one()
+        StockMoveLine = self.env['stock.move.line']
+        Quant = self.env['stock.quant']
 
-                    if not needs_rebuild:
-                        continue
+        lines_by_lot = {}
+        for ml in move.move_line_ids:
+            if ml.lot_id:
+                lines_by_lot.setdefault(ml.lot_id.id, StockMoveLine.browse())
+                lines_by_lot[ml.lot_id.id] |= ml
+
+        plan = {
+            'total_qty': 0.0,
+            'to_unlink': StockMoveLine.browse(),
+            'vals_list': [],
+            'demand_before': move.product_uom_qty or 0.0,
+            'added': [],
+            'rebuilt': [],
+            'removed': [],
+        }
+
+        for lot in target_lots:
+            quants = quants_by_key.get((move.id, lot.id), Quant.browse())
+            expected_qty, _physical_qty, _tipo, quants = self._stone_line_expected_qty_for_lot(
+                lot,
+                breakdown,
+                move=move,
+                quants=quants,
+                split_lots=target_lots,
+            )
+            plan['total_qty'] += expected_qty
 
-                    _logger.info(
-                        "[STONE SYNC] Reconstruyendo lote %s en move %s: actual %.6f → esperado %.6f",
+            existing_lines = lines_by_lot.pop(lot.id, StockMoveLine.browse())
+            if not existing_lines:
+                if not quants:
+                    _logger.warning(
+                        "[STONE SYNC] No se pudo sincronizar lote %s: no hay stock físico encontrado.",
                         lot.name,
-                        move.id,
-                        current_qty,
-                        expected_qty,
                     )
-                    existing_lines.with_context(ctx).unlink()
+                    continue
+                if expected_qty > 0:
+                    plan['vals_list'] += self._stone_line_move_line_vals(
+                        move, lot, expected_qty, quants)
+                    plan['added'].append(lot.id)
+                continue
+
+            current_qty = sum(self._stone_line_move_line_qty(ml) for ml in existing_lines)
+            valid_location_ids = set(quants.mapped('location_id').ids) if quants else set()
+            current_location_ids = set(existing_lines.mapped('location_id').ids)
+
+            needs_rebuild = abs(current_qty - expected_qty) > 0.0001
+            if valid_location_ids and (current_location_ids - valid_location_ids):
+                needs_rebuild = True
+
+            if not needs_rebuild:
+                continue
+
+            _logger.info(
+                "[STONE SYNC] Reconstruyendo lote %s en move %s: actual %.6f → esperado %.6f",
+                lot.name,
+                move.id,
+                current_qty,
+                expected_qty,
+            )
+            plan['to_unlink'] |= existing_lines
+            plan['rebuilt'].append(lot.id)
+            if expected_qty > 0 and quants:
+                plan['vals_list'] += self._stone_line_move_line_vals(
+                    move, lot, expected_qty, quants)
+
+        # Lo que queda en lines_by_lot son lotes que ya no están en la línea.
+        for lot_id, lines in lines_by_lot.items():
+            plan['to_unlink'] |= lines
+            plan['removed'].append(lot_id)
+
+        return plan
+
+    # =========================================================================
+    # PLAN DE RESERVA (dry-run): qué haría la sincronización, sin escribir
+    # =========================================================================
+
+    @api.model
+    @contextmanager
+    def _stone_plan_phase(self, timings, phase):
+        """Acumula en `timings[phase]` milisegundos y consultas SQL."""
+        cr = self.env.cr
+        queries_before = getattr(cr, 'sql_log_count', 0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = timings.setdefault(phase, {'ms': 0.0, 'queries': 0})
+            entry['ms'] += round((time.perf_counter() - started) * 1000.0, 3)
+            entry['queries'] += getattr(cr, 'sql_log_count', 0) - queries_before
 
-                    if expected_qty > 0 and quants:
-                        sale_line._stone_line_create_exact_move_lines(
-                            move,
-                            lot,
-                            expected_qty,
-                            quants,
-                            ctx,
-                        )
+    @api.model
+    def _stone_plan_vals_qty(self, vals):
+        for key in ('quantity', 'reserved_uom_qty', 'qty_done'):
+            if key in vals:
+                return vals[key] or 0.0
+        return 0.0
+
+    @api.model
+    def _stone_plan_serialize_move(self, move, demand_after, to_unlink, vals_list):
+        """Forma común (línea y orden) de lo planeado para un move."""
+        Lot = self.env['stock.lot']
+        Location = self.env['stock.location']
+        lot_names = dict(
+            (lot.id, lot.name or '') for lot in
+            Lot.browse({v['lot_id'] for v in vals_list} | set(to_unlink.mapped('lot_id').ids))
+        )
+        locations = dict(
+            (loc.id, loc.display_name or '') for loc in
+            Location.browse({v['location_id'] for v in vals_list})
+        )
+        demand_before = move.product_uom_qty or 0.0
+        return {
+            'move_id': move.id,
+            'picking': move.picking_id.name if move.picking_id else '',
+            'demand_before': demand_before,
+            'demand_after': demand_after,
+            'demand_changes': abs(demand_after - demand_before) > 0.0001,
+            'adds': [{
+                'lot_id': vals['lot_id'],
+                'lot_name': lot_names.get(vals['lot_id'], ''),
+                'location_id': vals['location_id'],
+                'location': locations.get(vals['location_id'], ''),
+                'qty': self._stone_plan_vals_qty(vals),
+            } for vals in vals_list],
+            'removals': [{
+                'move_line_id': ml.id,
+                'lot_id': ml.lot_id.id,
+                'lot_name': lot_names.get(ml.lot_id.id, ''),
+                'location_id': ml.location_id.id,
+                'location': ml.location_id.display_name or '',
+                'qty': self._stone_line_move_line_qty(ml),
+            } for ml in to_unlink],
+        }
+
+    @api.model
+    def _stone_plan_totals(self, moves):
+        return {
+            'moves': len(moves),
+            'adds': sum(len(m['adds']) for m in moves),
+            'removals': sum(len(m['removals']) for m in moves),
+            'demand_changes': len([m for m in moves if m['demand_changes']]),
+        }
+
+    def get_stone_reservation_plan(self, lot_ids=None, breakdown=None):
+        """
+        Dry-run de _sync_lots_to_picking_moves: por línea, las move lines que
+        se agregarían y quitarían y los cambios de demanda, más el desglose
+        de tiempo y consultas por fase. NO escribe nada.
+
+        `lot_ids` / `breakdown` permiten previsualizar una selección
+        propuesta (solo con una línea); por defecto se usa la guardada.
+        """
+        if (lot_ids is not None or breakdown is not None) and len(self) != 1:
+            raise UserError(_(
+                'La previsualización de una selección propuesta es por línea.'))
+
+        result = {}
+        for sale_line in self:
+            timings = {}
+            moves_out = []
+            skipped = False
+
+            with self._stone_plan_phase(timings, 'load'):
+                if not sale_line._stone_can_select_lots():
+                    skipped = True
+                else:
+                    target_lots = (
+                        self.env['stock.lot'].browse(lot_ids).exists()
+                        if lot_ids is not None else sale_line.lot_ids
+                    )
+                    line_breakdown = sale_line._stone_breakdown(
+                        dict(breakdown) if breakdown is not None else None)
+                    moves = sale_line.move_ids.filtered(
+                        lambda m: m.state not in ['cancel', 'done'])
+
+            if not skipped and moves:
+                with self._stone_plan_phase(timings, 'prefetch_quants'):
+                    quants_by_key = sale_line._stone_line_prefetch_lot_quants(
+                        target_lots, moves)
+                plans = []
+                with self._stone_plan_phase(timings, 'plan'):
+                    for move in moves:
+                        plans.append((move, sale_line._stone_line_sync_plan(
+                            move, target_lots, line_breakdown, quants_by_key)))
+                with self._stone_plan_phase(timings, 'serialize'):
+                    for move, plan in plans:
+                        demand_after = plan['total_qty'] if plan['total_qty'] > 0 else plan['demand_before']
+                        moves_out.append(self._stone_plan_serialize_move(
+                            move, demand_after, plan['to_unlink'], plan['vals_list']))
+
+            result[sale_line.id] = {
+                'line_id': sale_line.id,
+                'skipped': skipped,
+                'moves': moves_out,
+                'totals': self._stone_plan_totals(moves_out),
+                'timings': timings,
+            }
+        return result
 
     def read(self, fields=None, load='_classic_read'):
         result = super(SaleOrderLine, self).read(fields, load)
@@ -746,18 +1218,13 @@ class SaleOrderLine(models.Model):
 
     def _som_breakdown_qty_for_lot(self, breakdown, lot):
         """Cantidad asignada del lote en el desglose. El breakdown del
-        carrito puede venir con llave de LOT o de QUANT — se buscan ambas
-        (mismo criterio que _stone_line_expected_qty_for_lot)."""
+        carrito puede venir con llave de LOT o de QUANT — se resuelven
+        ambas con el accessor (mismo criterio que
+        _stone_line_expected_qty_for_lot). `breakdown` puede ser un dict o
+        un StoneBreakdown ya armado."""
         if not breakdown:
             return None
-        val = breakdown.get(str(lot.id))
-        if val is not None:
-            return float(val)
-        if 'x_selected_lots' in self._fields and self.x_selected_lots:
-            for quant in self.x_selected_lots:
-                if quant.lot_id.id == lot.id and str(quant.id) in breakdown:
-                    return float(breakdown[str(quant.id)])
-        return None
+        return self._stone_breakdown(breakdown).qty(lot.id)
 
     def _get_all_sale_lots_with_qty(self):
         self.ensure_one()
@@ -780,7 +1247,7 @@ class SaleOrderLine(models.Model):
             return self._som_cap_lot_breakdown_to_line(list(lot_data.values()))
 
         if self.lot_ids:
-            breakdown = self._parse_breakdown_dict()
+            breakdown = self._stone_breakdown()
 
             result = []
             for lot in self.lot_ids:
@@ -810,7 +1277,7 @@ class SaleOrderLine(models.Model):
         # lote tampoco hay move lines con lote. Sin este fallback, el reporte
         # detalle no mostraba el desglose de lotes de productos tipo pieza.
         if 'x_selected_lots' in self._fields and self.x_selected_lots:
-            breakdown = self._parse_breakdown_dict()
+            breakdown = self._stone_breakdown()
             result = []
             seen_lot_ids = set()
             for quant in self.x_selected_lots:
@@ -819,14 +1286,10 @@ class SaleOrderLine(models.Model):
                     continue
                 seen_lot_ids.add(lot.id)
                 tipo = str(lot.x_tipo).lower() if lot.x_tipo else 'placa'
-                lot_id_str = str(lot.id)
 
                 bqty = None
                 if tipo in ('formato', 'pieza'):
-                    if lot_id_str in breakdown:
-                        bqty = float(breakdown[lot_id_str])
-                    elif str(quant.id) in breakdown:
-                        bqty = float(breakdown[str(quant.id)])
+                    bqty = breakdown.qty(lot.id)
                 if bqty is not None:
                     qty = bqty
                 else:
@@ -844,6 +1307,39 @@ class SaleOrderLine(models.Model):
 
         return []
 
+    # =========================================================================
+    # SNAPSHOT de línea para la lista inline (un solo viaje)
+    # =========================================================================
+    # Al desplegar una línea el widget hacía 4–5 RPC en serie (empaque,
+    # estatus completo, totales y re-lectura de Solicitado). Este método
+    # devuelve todo junto y acepta muchas líneas a la vez: el widget agrupa
+    # las líneas que se despliegan en el mismo tick en una sola llamada.
+
+    def _stone_line_pack_info(self):
+        """Empaque estándar de la línea (standard_pack_som es opcional)."""
+        self.ensure_one()
+        pack = self._stone_safe_get(self, 'standard_pack_id')
+        qty_per_pack = 0.0
+        if pack:
+            qty_per_pack = float(self._stone_safe_get(pack, 'qty_per_pack', 0.0) or 0.0)
+        return {
+            'has_pack': qty_per_pack > 0,
+            'qty_per_pack': qty_per_pack,
+            'pack_id': pack.id if pack else 0,
+        }
+
+    def get_stone_line_snapshot(self):
+        """{line_id: {pack, lots, product_uom_qty}} por línea."""
+        result = {}
+        status_map = self._stone_lots_full_status_map()
+        for line in self:
+            result[line.id] = {
+                'pack': line._stone_line_pack_info(),
+                'lots': status_map.get(line.id, []),
+                'product_uom_qty': line.product_uom_qty,
+            }
+        return result
+
     # =========================================================================
     # API NUEVA: Estatus de entrega completo por lote
     # =========================================================================
@@ -859,45 +1355,61 @@ class SaleOrderLine(models.Model):
 
     def get_stone_lots_full_status(self):
         self.ensure_one()
+        return self._stone_lots_full_status_map().get(self.id, [])
 
-        if not self._stone_can_select_lots():
-            return []
+    def get_stone_lots_full_status_by_line(self):
+        """Versión multi-línea: {line_id: [estatus por lote]}."""
+        return self._stone_lots_full_status_map()
 
-        breakdown = self._parse_breakdown_dict()
-        current_lot_ids = list(self.lot_ids.ids)
+    @api.model
+    def _stone_new_lot_status_info(self):
+        return {
+            'qty_delivered': 0.0,
+            'qty_returned': 0.0,
+            'qty_redelivered_confirmed': 0.0,
+            'qty_redelivered_pending': 0.0,
+            'qty_pick_ticket': 0.0,
+            'remissions': [],
+            'returns': [],
+            'redeliveries_confirmed': [],
+            'redeliveries_pending': [],
+            'pick_tickets': [],
+            'swap_replaced_by': [],
+            'swap_replacement_of': [],
+        }
+
+    def _stone_lots_full_status_map(self):
+        """
+        {line_id: [estatus por lote]} para varias líneas a la vez.
 
-        Doc = self.env['sale.delivery.document']
-        docs = Doc.search([
-            ('sale_order_id', '=', self.order_id.id),
-            ('state', 'in', ('prepared', 'confirmed')),
-        ])
+        Documentos de entrega, swaps y quants se leen UNA vez para todas
+        las líneas (antes cada línea volvía a recorrer todos los documentos
+        de la orden). Las líneas no seleccionables devuelven [].
+        """
+        result = {line.id: [] for line in self}
+        lines = self.filtered(lambda l: l._stone_can_select_lots())
+        if not lines:
+            return result
 
+        line_ids = set(lines.ids)
+        # (line_id, lot_id) -> acumulados de documentos y swaps
         info = {}
 
-        def get_info(lot_id):
-            if lot_id not in info:
-                info[lot_id] = {
-                    'qty_delivered': 0.0,
-                    'qty_returned': 0.0,
-                    'qty_redelivered_confirmed': 0.0,
-                    'qty_redelivered_pending': 0.0,
-                    'qty_pick_ticket': 0.0,
-                    'remissions': [],
-                    'returns': [],
-                    'redeliveries_confirmed': [],
-                    'redeliveries_pending': [],
-                    'pick_tickets': [],
-                    'swap_replaced_by': [],
-                    'swap_replacement_of': [],
-                }
-            return info[lot_id]
+        def get_info(line_id, lot_id):
+            key = (line_id, lot_id)
+            if key not in info:
+                info[key] = self._stone_new_lot_status_info()
+            return info[key]
 
+        docs = self.env['sale.delivery.document'].search([
+            ('sale_order_id', 'in', lines.order_id.ids),
+            ('state', 'in', ('prepared', 'confirmed')),
+        ])
         for doc in docs:
             for dl in doc.line_ids:
-                if dl.sale_line_id != self or not dl.lot_id:
+                if dl.sale_line_id.id not in line_ids or not dl.lot_id:
                     continue
-                lot_id = dl.lot_id.id
-                d = get_info(lot_id)
+                d = get_info(dl.sale_line_id.id, dl.lot_id.id)
                 qty = dl.qty_done or dl.qty_selected or 0.0
 
                 if doc.document_type == 'remission' and doc.state == 'confirmed':
@@ -928,10 +1440,11 @@ class SaleOrderLine(models.Model):
                     if ref and ref not in d['pick_tickets']:
                         d['pick_tickets'].append(ref)
 
-        ghost_lot_ids = []
+        current_by_line = {line.id: list(line.lot_ids.ids) for line in lines}
+        ghosts_by_line = {line.id: [] for line in lines}
         try:
             swaps = self.env['sale.stone.swap.history'].search([
-                ('sale_line_id', '=', self.id),
+                ('sale_line_id', 'in', lines.ids),
             ], order='create_date asc, id asc')
 
             for sw in swaps:
@@ -939,32 +1452,39 @@ class SaleOrderLine(models.Model):
                 new = sw.new_lot_id
                 if not old or not new:
                     continue
-                get_info(old.id)['swap_replaced_by'].append(
+                line_id = sw.sale_line_id.id
+                get_info(line_id, old.id)['swap_replaced_by'].append(
                     {'lot_id': new.id, 'lot_name': new.name or ''}
                 )
-                get_info(new.id)['swap_replacement_of'].append(
+                get_info(line_id, new.id)['swap_replacement_of'].append(
                     {'lot_id': old.id, 'lot_name': old.name or ''}
                 )
-                if old.id not in current_lot_ids and old.id not in ghost_lot_ids:
-                    ghost_lot_ids.append(old.id)
+                ghosts = ghosts_by_line[line_id]
+                if old.id not in current_by_line[line_id] and old.id not in ghosts:
+                    ghosts.append(old.id)
         except Exception as exc:
             _logger.warning(
                 "[STONE STATUS] No se pudo cargar swap history: %s", exc
             )
 
-        all_lot_ids = list(current_lot_ids) + [
-            lid for lid in ghost_lot_ids if lid not in current_lot_ids
-        ]
+        lots_by_line = {}
+        every_lot_id = set()
+        for line_id, current in current_by_line.items():
+            lot_ids = list(current) + [
+                lid for lid in ghosts_by_line[line_id] if lid not in current
+            ]
+            lots_by_line[line_id] = lot_ids
+            every_lot_id.update(lot_ids)
 
-        if not all_lot_ids:
-            return []
+        if not every_lot_id:
+            return result
 
-        Lot = self.env['stock.lot']
-        lots = Lot.browse(all_lot_ids)
-        lots_map = {l.id: l for l in lots if l.exists()}
+        lots_map = {
+            l.id: l for l in self.env['stock.lot'].browse(list(every_lot_id)).exists()
+        }
 
         quants = self.env['stock.quant'].search([
-            ('lot_id', 'in', all_lot_ids),
+            ('lot_id', 'in', list(every_lot_id)),
             ('location_id.usage', '=', 'internal'),
             ('quantity', '>', 0),
         ])
@@ -980,15 +1500,49 @@ class SaleOrderLine(models.Model):
                                      or '').split('/') if p]
                 loc_map[q.lot_id.id] = '/'.join(parts[-2:]) if parts else ''
 
+        # Datos del lote que no dependen de la línea: una vez por lote.
+        photo_urls = self.env['stock.quant']._stone_lot_photo_urls(
+            self.env['stock.lot'].browse(list(lots_map)))
+        lot_common = {}
+        for lot_id, lot in lots_map.items():
+            lot_common[lot_id] = {
+                'lot_name': lot.name or '',
+                'tipo': (lot.x_tipo or 'placa').lower() if self._stone_safe_get(lot, 'x_tipo') else 'placa',
+                'x_bloque': self._stone_safe_get(lot, 'x_bloque', '') or '',
+                'x_atado': self._stone_safe_get(lot, 'x_atado', '') or '',
+                'x_alto': self._stone_safe_get(lot, 'x_alto', 0) or 0,
+                'x_ancho': self._stone_safe_get(lot, 'x_ancho', 0) or 0,
+                'x_grosor': self._stone_safe_get(lot, 'x_grosor', 0) or 0,
+                'x_color': self._stone_safe_get(lot, 'x_color', '') or '',
+                'location': loc_map.get(lot_id, ''),
+                # Miniatura por URL cacheable: el base64 completo por lote
+                # inflaba la respuesta del estatus en cada despliegue.
+                'x_fotografia_url': photo_urls[lot_id],
+                'x_cantidad_fotos': self._stone_safe_get(lot, 'x_cantidad_fotos', 0) or 0,
+            }
+
+        for line in lines:
+            result[line.id] = line._stone_lots_full_status_rows(
+                lots_by_line[line.id], current_by_line[line.id],
+                ghosts_by_line[line.id], info, lots_map, lot_common, qty_map)
+        return result
+
+    def _stone_lots_full_status_rows(self, all_lot_ids, current_lot_ids,
+                                     ghost_lot_ids, info, lots_map,
+                                     lot_common, qty_map):
+        self.ensure_one()
+        breakdown = self._stone_breakdown()
+
         result = []
         for lot_id in all_lot_ids:
             lot = lots_map.get(lot_id)
             if not lot:
                 continue
 
-            d = info.get(lot_id)
+            d = info.get((self.id, lot_id))
             is_ghost = lot_id in ghost_lot_ids and lot_id not in current_lot_ids
-            tipo = (lot.x_tipo or 'placa').lower() if self._stone_safe_get(lot, 'x_tipo') else 'placa'
+            common = lot_common[lot_id]
+            tipo = common['tipo']
             available_qty = qty_map.get(lot_id, 0.0)
 
             if is_ghost:
@@ -1003,7 +1557,6 @@ class SaleOrderLine(models.Model):
             badges = []
             is_locked = False
             swap_locked = False
-
             if d:
                 for sw in d['swap_replaced_by']:
                     badges.append({
@@ -1090,20 +1643,23 @@ class SaleOrderLine(models.Model):
 
             result.append({
                 'lot_id': lot_id,
-                'lot_name': lot.name or '',
+                'lot_name': common['lot_name'],
                 'product_id': self.product_id.id,
                 'available_qty': available_qty,
                 'displayed_qty': displayed_qty,
                 'tipo': tipo,
-                'x_bloque': self._stone_safe_get(lot, 'x_bloque', '') or '',
-                'x_atado': self._stone_safe_get(lot, 'x_atado', '') or '',
-                'x_alto': self._stone_safe_get(lot, 'x_alto', 0) or 0,
-                'x_ancho': self._stone_safe_get(lot, 'x_ancho', 0) or 0,
-                'x_grosor': self._stone_safe_get(lot, 'x_grosor', 0) or 0,
-                'x_color': self._stone_safe_get(lot, 'x_color', '') or '',
-                'location': loc_map.get(lot_id, ''),
-                'x_fotografia_principal': self._stone_safe_get(lot, 'x_fotografia_principal', False) or False,
-                'x_cantidad_fotos': self._stone_safe_get(lot, 'x_cantidad_fotos', 0) or 0,
+                'x_bloque': common['x_bloque'],
+                'x_atado': common['x_atado'],
+                'x_alto': common['x_alto'],
+                'x_ancho': common['x_ancho'],
+                'x_grosor': common['x_grosor'],
+                'x_color': common['x_color'],
+                'location': common['location'],
+                # Llave vieja, vacía: los llamadores RPC la siguen recibiendo
+                # pero la foto viaja por URL.
+                'x_fotografia_principal': False,
+                'x_fotografia_url': common['x_fotografia_url'],
+                'x_cantidad_fotos': common['x_cantidad_fotos'],
                 'status_badges': badges,
                 'is_locked': is_locked,
                 'is_ghost': is_ghost,
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import logging
+
+from .stone_precommit import stone_savepoint
+
+_logger = logging.getLogger(__name__)
+
+DEFER_MIN_LINES_PARAM = 'sale_stone_selection.deferred_confirm_min_lines'
+ASSIGN_CHUNK_PARAM = 'sale_stone_selection.deferred_confirm_chunk_lines'
+# Un job 'running' más viejo que esto es de un worker que murió: su
+# transacción ya se revirtió y la orden sigue siendo cotización.
+STALE_RUNNING_HOURS = 2
+
+
+class SaleStoneConfirmJob(models.Model):
+    """
+    Cola local de confirmaciones diferidas de órdenes grandes.
+
+    La confirmación completa (backup de la cotización, folio V/, super(),
+    asignación forzada y limpieza del origen) corre en el cron, en UNA
+    transacción por orden: si algo falla se revierte completa y la orden
+    queda como la cotización limpia que era. Mientras tanto la orden está
+    marcada 'en cola' / 'confirmando' y no se puede confirmar de nuevo.
+
+    El avance (por bloques de líneas en la asignación) se publica con un
+    cursor aparte para que la UI lo vea antes de que termine el job.
+    """
+    _name = 'sale.stone.confirm.job'
+    _description = 'Confirmación Diferida de Orden (Selección de Piedra)'
+    _order = 'id desc'
+
+    order_id = fields.Many2one(
+        'sale.order', string='Orden',
+        required=True, index=True, ondelete='cascade',
+    )
+    user_id = fields.Many2one(
+        'res.users', string='Solicitado por',
+        required=True, default=lambda s: s.env.user,
+    )
+    state = fields.Selection([
+        ('pending', 'En cola'),
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', required=True, default='pending', index=True)
+    # El avance vive en sale.stone.confirm.job.progress (lo escribe un
+    # cursor aparte); aquí solo se lee.
+    progress_ids = fields.One2many(
+        'sale.stone.confirm.job.progress', 'job_id', string='Avance publicado')
+    stage = fields.Char(string='Etapa', compute='_compute_progress')
+    progress_done = fields.Integer(string='Avance', compute='_compute_progress')
+    progress_total = fields.Integer(string='Total', compute='_compute_progress')
+    progress_label = fields.Char(
+        string='Progreso', compute='_compute_progress_label')
+    error = fields.Text(string='Error')
+    date_started = fields.Datetime(string='Inicio')
+    date_done = fields.Datetime(string='Fin')
+
+    @api.depends('progress_ids.stage', 'progress_ids.progress_done',
+                 'progress_ids.progress_total')
+    def _compute_progress(self):
+        for job in self:
+            progress = job.progress_ids[:1]
+            job.stage = progress.stage or False
+            job.progress_done = progress.progress_done
+            job.progress_total = progress.progress_total
+
+    @api.depends('state', 'stage', 'progress_done', 'progress_total')
+    def _compute_progress_label(self):
+        labels = dict(self._fields['state']._description_selection(self.env))
+        for job in self:
+            label = labels.get(job.state, '')
+            # Terminado/fallido: el estado ya lo dice todo, la última etapa
+            # publicada no aplica.
+            if job.state not in ('pending', 'running'):
+                job.progress_label = label
+                continue
+            if job.stage:
+                label = '%s · %s' % (label, job.stage)
+            if job.progress_total:
+                label = '%s (%s/%s)' % (
+                    label, job.progress_done, job.progress_total)
+            job.progress_label = label
+
+    # =========================================================================
+    # Encolar
+    # =========================================================================
+
+    @api.model
+    def _stone_should_defer(self, orders):
+        """True si la orden es lo bastante grande para confirmarse en cola
+        (parámetro en líneas; 0 / sin definir = nunca)."""
+        try:
+            min_lines = int(self.env['ir.config_parameter'].sudo().get_param(
+                DEFER_MIN_LINES_PARAM, '0') or 0)
+        except ValueError:
+            min_lines = 0
+        if min_lines <= 0:
+            return False
+        return any(
+            len(order.order_line.filtered(lambda l: not l.display_type)) >= min_lines
+            for order in orders
+        )
+
+    @api.model
+    def _stone_enqueue(self, orders):
+        """Crea un job por orden y marca la orden 'en cola'. El llamador ya
+        tomó el candado de fila de sale_order y pasó los guards."""
+        jobs = self.sudo().create([{
+            'order_id': order.id,
+            'user_id': self.env.user.id,
+        } for order in orders])
+        for job in jobs:
+            job.order_id.write({
+                'x_stone_confirm_state': 'queued',
+                'x_stone_confirm_job_id': job.id,
+            })
+            _logger.info(
+                "[STONE CONFIRM QUEUE] Orden %s encolada (job %s).",
+                job.order_id.name, job.id)
+        cron = self.env.ref(
+            'sale_stone_selection.ir_cron_stone_confirm_jobs',
+            raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return jobs
+
+    # =========================================================================
+    # Runner (cron)
+    # =========================================================================
+
+    @api.model
+    def _stone_run_pending_jobs(self, limit=5):
+        self._stone_fail_stale_jobs()
+        for _i in range(limit):
+            job = self._stone_claim_next_job()
+            if not job:
+                break
+            job._stone_run()
+            self.env.cr.commit()
+        return True
+
+    @api.model
+    def _stone_claim_next_job(self):
+        """Toma el siguiente job pendiente y lo marca 'running' en su propia
+        transacción (SKIP LOCKED: dos workers nunca toman el mismo)."""
+        self.env.cr.execute("""
+            UPDATE sale_stone_confirm_job
+               SET state = 'running', date_started = now() at time zone 'UTC'
+             WHERE id = (
+                   SELECT id FROM sale_stone_confirm_job
+                    WHERE state = 'pending'
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED)
+         RETURNING id, order_id
+        """)
+        row = self.env.cr.fetchone()
+        if row:
+            self.env.cr.execute("""
+                UPDATE sale_order SET x_stone_confirm_state = 'running'
+                 WHERE id = %s
+            """, (row[1],))
+        self.env.cr.commit()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.invalidate_recordset()
+        job.order_id.invalidate_recordset(['x_stone_confirm_state'])
+        return job
+
+    @api.model
+    def _stone_fail_stale_jobs(self):
+        stale = self.search([
+            ('state', '=', 'running'),
+            ('date_started', '<', fields.Datetime.subtract(
+                fields.Datetime.now(), hours=STALE_RUNNING_HOURS)),
+        ])
+        for job in stale:
+            job._stone_mark_failed(_(
+                'El proceso de confirmación se interrumpió (worker detenido '
+                'o tiempo agotado).'))
+        if stale:
+            self.env.cr.commit()
+
+    def _stone_run(self):
+        self.ensure_one()
+        order = self.order_id
+        _logger.info(
+            "[STONE CONFIRM QUEUE] Job %s: confirmando %s.", self.id, order.name)
+        try:
+            with stone_savepoint(self.env.cr):
+                order.with_user(self.user_id).with_company(
+                    order.company_id,
+                ).with_context(
+                    stone_confirm_job_id=self.id,
+                ).action_confirm()
+        except Exception as exc:
+            _logger.exception(
+                "[STONE CONFIRM QUEUE] Job %s falló; la orden %s se queda "
+                "como cotización.", self.id, order.name)
+            self._stone_mark_failed(
+                exc.args[0] if isinstance(exc, UserError) and exc.args
+                else str(exc))
+            return False
+
+        self.write({
+            'state': 'done',
+            'date_done': fields.Datetime.now(),
+        })
+        order.write({'x_stone_confirm_state': False})
+        order.message_post(body=_(
+            'Confirmación en segundo plano terminada: %s.') % order.name)
+        return True
+
+    def _stone_mark_failed(self, message):
+        for job in self:
+            job.write({
+                'state': 'failed',
+                'error': message,
+                'date_done': fields.Datetime.now(),
+            })
+            job.order_id.write({'x_stone_confirm_state': False})
+            job.order_id.message_post(body=_(
+                'La confirmación en segundo plano falló y la cotización '
+                'quedó sin cambios: %s') % message)
+
+    def _stone_report_progress(self, stage, done=0, total=0):
+        """Publica el avance con un cursor propio: la transacción del job no
+        se confirma hasta el final y la UI necesita verlo antes. Se escribe
+        en la tabla de avance, nunca en la fila del job: la transacción
+        principal la actualiza al terminar y chocaría por serialización."""
+        self.ensure_one()
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                INSERT INTO sale_stone_confirm_job_progress
+                       (job_id, stage, progress_done, progress_total)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (job_id) DO UPDATE
+                   SET stage = EXCLUDED.stage,
+                       progress_done = EXCLUDED.progress_done,
+                       progress_total = EXCLUDED.progress_total
+            """, (self.id, stage, done, total))
+        _logger.info(
+            "[STONE CONFIRM QUEUE] Job %s: %s (%s/%s)",
+            self.id, stage, done, total)
+
+    @api.model
+    def _stone_assign_chunk_size(self):
+        try:
+            size = int(self.env['ir.config_parameter'].sudo().get_param(
+                ASSIGN_CHUNK_PARAM, '25') or 25)
+        except ValueError:
+            size = 25
+        return max(size, 1)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class SaleStoneConfirmJobProgress(models.Model):
+    """
+    Avance publicado de un job de confirmación diferida.
+
+    Vive aparte del job a propósito: lo escribe (y confirma) un cursor
+    propio mientras la transacción del job sigue abierta. Si ese avance se
+    guardara en la fila del job, la transacción principal (REPEATABLE READ)
+    fallaría por serialización al marcar el job como terminado o fallido.
+    La transacción del job NUNCA escribe aquí.
+    """
+    _name = 'sale.stone.confirm.job.progress'
+    _description = 'Avance de Confirmación Diferida (Selección de Piedra)'
+    _log_access = False
+
+    job_id = fields.Many2one(
+        'sale.stone.confirm.job', string='Job',
+        required=True, index=True, ondelete='cascade',
+    )
+    stage = fields.Char(string='Etapa')
+    progress_done = fields.Integer(string='Avance')
+    progress_total = fields.Integer(string='Total')
+
+    _job_uniq = models.Constraint(
+        'UNIQUE(job_id)',
+        'Un job solo puede tener una fila de avance.',
+    )
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class SaleStoneSelectorGeneration(models.Model):
+    """
+    Contador de generación por producto para la caché del selector
+    (stock.quant._stone_passthrough_sets). Lo incrementa un postcommit con
+    upsert SQL directo; aquí solo se declara la tabla.
+    """
+    _name = 'sale.stone.selector.generation'
+    _description = 'Generación de Caché del Selector de Piedra'
+    _log_access = False
+
+    product_id = fields.Many2one(
+        'product.product',
+        string='Producto',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+    generation = fields.Integer(string='Generación', default=0)
+
+    _product_uniq = models.Constraint(
+        'UNIQUE(product_id)',
+        'Un producto solo puede tener un contador de generación.',
+    )
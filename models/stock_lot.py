@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from odoo.tools import sql
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+# Filtros de texto del selector: (llave del popup, columna de stock.lot).
+STONE_TEXT_FILTERS = (
+    ('bloque', 'x_bloque'),
+    ('atado', 'x_atado'),
+    ('lot_name', 'name'),
+)
+# Filtros de rango: (llave del popup, columna, operador).
+STONE_RANGE_FILTERS = (
+    ('alto_min', 'x_alto', '>='),
+    ('alto_max', 'x_alto', '<='),
+    ('ancho_min', 'x_ancho', '>='),
+    ('ancho_max', 'x_ancho', '<='),
+    ('grosor_min', 'x_grosor', '>='),
+    ('grosor_max', 'x_grosor', '<='),
+)
+# Columnas de dimensión del índice compuesto por producto.
+STONE_DIMENSION_COLUMNS = ('x_alto', 'x_ancho', 'x_grosor')
+
+# Recencia del bloque (misma regla del Inventario Visual): serie S<edad>
+# primero (número mayor = más nuevo), luego folios numéricos (mayor = más
+# nuevo), sin folio al final. El folio replica parseInt() del grid:
+# signo opcional y dígitos al inicio ("-12" → -12, "+3" → 3, "12A" → 12).
+STONE_BLOCK_SERIES_RE = re.compile(r'^S\s*-?(\d+)')
+STONE_BLOCK_FOLIO_RE = re.compile(r'^([+-]?\d+)')
+STONE_BLOCK_RANK_SERIES = 2
+STONE_BLOCK_RANK_FOLIO = 1
+STONE_BLOCK_RANK_NONE = 0
+# Tope de la columna integer (en ambos signos): un folio más largo se
+# satura, no revienta.
+STONE_BLOCK_SEQ_MAX = 2 ** 31 - 1
+
+
+class StockLot(models.Model):
+    _inherit = 'stock.lot'
+
+    # ilike '%texto%' del popup: índice trigram del ORM (el nombre ya lo
+    # trae stock). Se redefinen solo para agregar el índice.
+    x_bloque = fields.Char(index='trigram')
+    x_atado = fields.Char(index='trigram')
+
+    # Llave de orden del bloque, guardada: el selector ordena por recencia
+    # en el servidor y la paginación trae el top-N correcto.
+    x_stone_block_rank = fields.Integer(
+        string='Rango de bloque', compute='_compute_stone_block_sort_key',
+        store=True, index=True)
+    x_stone_block_seq = fields.Integer(
+        string='Folio de bloque', compute='_compute_stone_block_sort_key',
+        store=True)
+
+    @api.depends('x_bloque')
+    def _compute_stone_block_sort_key(self):
+        for lot in self:
+            lot.x_stone_block_rank, lot.x_stone_block_seq = (
+                self._stone_block_sort_key(lot.x_bloque))
+
+    @api.model
+    def _stone_block_sort_key(self, bloque):
+        """(rango, folio) del bloque; mayor = más reciente."""
+        value = str(bloque or '').strip().upper()
+        match = STONE_BLOCK_SERIES_RE.match(value)
+        if match:
+            return STONE_BLOCK_RANK_SERIES, min(int(match.group(1)), STONE_BLOCK_SEQ_MAX)
+        match = STONE_BLOCK_FOLIO_RE.match(value)
+        if match:
+            seq = int(match.group(1))
+            return STONE_BLOCK_RANK_FOLIO, max(min(seq, STONE_BLOCK_SEQ_MAX), -STONE_BLOCK_SEQ_MAX)
+        return STONE_BLOCK_RANK_NONE, 0
+
+    # =========================================================================
+    # Filtros del selector
+    # =========================================================================
+    # Antes cada filtro del popup era un 'lot_id.x_*' suelto sobre el quant
+    # (una subconsulta por filtro). Aquí todos se juntan en UN dominio de
+    # stock.lot acotado por producto, que el quant usa con 'any'.
+
+    @api.model
+    def _stone_selector_lot_domain(self, product_id, filters):
+        """Dominio de stock.lot para los filtros del popup, o [] si no hay
+        filtro de lote. Filtros de columnas que no existen se ignoran."""
+        filters = filters or {}
+        domain = []
+        for key, fname in STONE_TEXT_FILTERS:
+            value = filters.get(key)
+            if value and fname in self._fields:
+                domain.append((fname, 'ilike', value))
+        for key, fname, operator in STONE_RANGE_FILTERS:
+            value = filters.get(key)
+            if value in (None, '', False) or fname not in self._fields:
+                continue
+            try:
+                domain.append((fname, operator, float(value)))
+            except (TypeError, ValueError):
+                continue
+        if filters.get('tipo') and 'x_tipo' in self._fields:
+            domain.append(('x_tipo', '=', filters['tipo']))
+        if domain:
+            domain.insert(0, ('product_id', '=', int(product_id)))
+        return domain
+
+    # =========================================================================
+    # Índices del selector
+    # =========================================================================
+    # Los textos usan el índice trigram de los campos (arriba). Aquí van
+    # los compuestos por producto para dimensiones y para los quants
+    # disponibles; se crean solo si faltan (init y migración).
+
+    def init(self):
+        super().init()
+        self._stone_ensure_selector_indexes()
+
+    @api.model
+    def _stone_ensure_selector_indexes(self):
+        cr = self.env.cr
+        created = []
+
+        dims = [
+            fname for fname in STONE_DIMENSION_COLUMNS
+            if fname in self._fields and self._fields[fname].store
+        ]
+        if dims and not sql.index_exists(cr, 'stock_lot_stone_dims_idx'):
+            sql.create_index(
+                cr, 'stock_lot_stone_dims_idx', 'stock_lot',
+                ['product_id'] + ['"%s"' % fname for fname in dims])
+            created.append('stock_lot_stone_dims_idx')
+
+        if not sql.index_exists(cr, 'stock_quant_stone_selector_idx'):
+            sql.create_index(
+                cr, 'stock_quant_stone_selector_idx', 'stock_quant',
+                ['product_id', 'location_id', 'lot_id'],
+                where='quantity > 0')
+            created.append('stock_quant_stone_selector_idx')
+
+        if created:
+            _logger.info(
+                "[STONE INDEX] Índices del selector creados: %s",
+                ', '.join(created))
+        return created
+
+    # =========================================================================
+    # Libro de compromisos
+    # =========================================================================
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Placa vs formato/pieza cambia cómo se compromete el lote.
+        if 'x_tipo' in vals:
+            self.env['stock.lot.commitment']._stone_mark_dirty(self.ids)
+            self.env['stock.quant']._stone_bump_selector_generation(
+                self.mapped('product_id').ids)
+        return res
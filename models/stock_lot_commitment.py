@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from odoo.tools import SQL
+import logging
+
+_logger = logging.getLogger(__name__)
+
+LEDGER_READY_PARAM = 'sale_stone_selection.commitment_ledger_ready'
+
+
+class StockLotCommitment(models.Model):
+    """
+    Libro materializado de compromiso por lote: ¿el lote está libre,
+    parcialmente comprometido o comprometido completo?
+
+    Antes esta pregunta se recalculaba desde cero en cada petición del
+    selector. Aquí vive ya resuelta, indexada, y se mantiene incremental:
+    los writes de sale.order.line, stock.move.line y stock.quant marcan
+    sus lotes como sucios y el recálculo (acotado a esos lotes) corre una
+    sola vez en el precommit de la transacción.
+
+    Fuentes que marcan lotes sucios: lot_ids / cantidad / producto de
+    sale.order.line (y su borrado), estado de sale.order, move lines
+    (alta, cambios, borrado), cambios de estado de stock.move (validar o
+    cancelar el picking cambia el estado relacionado de sus move lines sin
+    pasar por su write), quants y x_tipo de stock.lot.
+
+    Solo existen filas para lotes comprometidos o con entregas a cliente;
+    un lote sin fila está libre.
+    """
+    _name = 'stock.lot.commitment'
+    _description = 'Libro de Compromiso por Lote (Selección de Piedra)'
+    _order = 'product_id, lot_id'
+
+    lot_id = fields.Many2one(
+        'stock.lot', string='Lote',
+        required=True, index=True, ondelete='cascade',
+    )
+    product_id = fields.Many2one(
+        'product.product', string='Producto',
+        required=True, index=True, ondelete='cascade',
+    )
+    tipo = fields.Char(string='Tipo')
+    committed_qty = fields.Float(string='Comprometido')
+    delivered_qty = fields.Float(string='Entregado')
+    physical_qty = fields.Float(string='Físico')
+    state = fields.Selection([
+        ('free', 'Libre'),
+        ('partial', 'Parcialmente comprometido'),
+        ('full', 'Comprometido completo'),
+    ], string='Estado', required=True, default='free', index=True)
+
+    _lot_uniq = models.Constraint(
+        'UNIQUE(lot_id)',
+        'Un lote solo puede tener una fila en el libro de compromisos.',
+    )
+
+    # =========================================================================
+    # Cálculo vivo (fuente de verdad)
+    # =========================================================================
+
+    @api.model
+    def _stone_compute_live(self, product_ids, lot_ids=None):
+        """{lot_id: vals} calculado en vivo con el motor de compromiso de
+        stock.quant más las entregas DONE a cliente de líneas de venta."""
+        Quant = self.env['stock.quant'].sudo()
+        MoveLine = self.env['stock.move.line'].sudo()
+        qty_field = 'quantity' if 'quantity' in MoveLine._fields else 'qty_done'
+
+        commitment = Quant._stone_lot_commitment(product_ids, lot_ids=lot_ids)
+
+        domain = [
+            ('product_id', 'in', list(product_ids)),
+            ('lot_id', '!=', False),
+            ('state', '=', 'done'),
+            ('location_dest_id.usage', '=', 'customer'),
+            ('move_id.sale_line_id', '!=', False),
+        ]
+        if lot_ids is not None:
+            domain.append(('lot_id', 'in', list(lot_ids)))
+        delivered = {}
+        delivered_product = {}
+        for lot, product, qty in MoveLine._read_group(
+                domain, ['lot_id', 'product_id'], ['%s:sum' % qty_field]):
+            delivered[lot.id] = delivered.get(lot.id, 0.0) + (qty or 0.0)
+            delivered_product[lot.id] = product.id
+
+        # Lotes solo entregados: el motor no los devuelve, se completan
+        # físico y tipo aquí.
+        only_delivered = [lid for lid in delivered if lid not in commitment]
+        physical = {}
+        if only_delivered:
+            for lot, qty in Quant._read_group([
+                ('lot_id', 'in', only_delivered),
+                ('location_id.usage', '=', 'internal'),
+                ('quantity', '>', 0),
+            ], ['lot_id'], ['quantity:sum']):
+                physical[lot.id] = qty or 0.0
+
+        result = {}
+        for lot_id, data in commitment.items():
+            if data['fully']:
+                state = 'full'
+            elif data['committed'] > 0.0001:
+                state = 'partial'
+            else:
+                state = 'free'
+            result[lot_id] = {
+                'lot_id': lot_id,
+                'product_id': data['product_id'],
+                'tipo': data['tipo'],
+                'committed_qty': data['committed'],
+                'delivered_qty': delivered.get(lot_id, 0.0),
+                'physical_qty': data['physical'],
+                'state': state,
+            }
+        for lot in self.env['stock.lot'].sudo().browse(only_delivered):
+            result[lot.id] = {
+                'lot_id': lot.id,
+                'product_id': delivered_product[lot.id],
+                'tipo': str(getattr(lot, 'x_tipo', '') or 'placa').lower(),
+                'committed_qty': 0.0,
+                'delivered_qty': delivered[lot.id],
+                'physical_qty': physical.get(lot.id, 0.0),
+                'state': 'free',
+            }
+        return result
+
+    def _stone_sync_rows(self, computed, scope_domain):
+        """Alinea las filas de `scope_domain` con `computed`: crea, actualiza
+        solo lo que cambió y borra las que ya no aplican."""
+        existing = self.sudo().search(scope_domain)
+        by_lot = {row.lot_id.id: row for row in existing}
+        to_create = []
+        for lot_id, vals in computed.items():
+            row = by_lot.pop(lot_id, None)
+            if not row:
+                to_create.append(vals)
+                continue
+            changes = {
+                key: value for key, value in vals.items()
+                if key not in ('lot_id',) and self._stone_value_differs(
+                    row, key, value)
+            }
+            if changes:
+                row.write(changes)
+        stale = existing.browse([row.id for row in by_lot.values()])
+        if stale:
+            stale.unlink()
+        if to_create:
+            self._stone_upsert_rows(to_create)
+        return len(to_create), len(stale)
+
+    @api.model
+    def _stone_upsert_rows(self, vals_list):
+        """Alta de filas con INSERT ... ON CONFLICT (lot_id): dos
+        transacciones que crean la primera fila del mismo lote ya no chocan
+        contra UNIQUE(lot_id); la segunda actualiza la fila de la primera."""
+        self.flush_model()
+        uid = self.env.uid
+        values = SQL(', ').join(
+            SQL(
+                "(%s, %s, %s, %s, %s, %s, %s, %s, %s, "
+                "now() at time zone 'UTC', now() at time zone 'UTC')",
+                vals['lot_id'], vals['product_id'], vals.get('tipo') or None,
+                vals.get('committed_qty') or 0.0,
+                vals.get('delivered_qty') or 0.0,
+                vals.get('physical_qty') or 0.0,
+                vals.get('state') or 'free', uid, uid,
+            )
+            for vals in vals_list
+        )
+        self.env.cr.execute(SQL("""
+            INSERT INTO stock_lot_commitment (
+                lot_id, product_id, tipo, committed_qty, delivered_qty,
+                physical_qty, state, create_uid, write_uid,
+                create_date, write_date)
+            VALUES %s
+            ON CONFLICT (lot_id) DO UPDATE SET
+                product_id = EXCLUDED.product_id,
+                tipo = EXCLUDED.tipo,
+                committed_qty = EXCLUDED.committed_qty,
+                delivered_qty = EXCLUDED.delivered_qty,
+                physical_qty = EXCLUDED.physical_qty,
+                state = EXCLUDED.state,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """, values))
+        self.invalidate_model()
+
+    @api.model
+    def _stone_value_differs(self, row, key, value):
+        current = row[key]
+        if key == 'product_id':
+            return current.id != value
+        if isinstance(value, float):
+            return abs((current or 0.0) - value) > 0.0001
+        return current != value
+
+    # =========================================================================
+    # Mantenimiento incremental
+    # =========================================================================
+
+    @api.model
+    def _stone_mark_dirty(self, lot_ids):
+        """Marca lotes para recalcular en el precommit de la transacción.
+        Varios writes sobre el mismo lote cuestan un solo recálculo."""
+        lot_ids = {int(lid) for lid in (lot_ids or []) if lid}
+        if not lot_ids:
+            return
+        data = self.env.cr.precommit.data
+        dirty = data.get('stone_commitment_dirty')
+        if dirty is None:
+            dirty = data['stone_commitment_dirty'] = set()
+            env = self.env(su=True)
+
+            @self.env.cr.precommit.add
+            def _stone_refresh_commitment_ledger():
+                pending = data.pop('stone_commitment_dirty', set())
+                if pending:
+                    env['stock.lot.commitment']._stone_refresh_lots(pending)
+                    env.flush_all()
+        dirty.update(lot_ids)
+
+    @api.model
+    def _stone_refresh_lots(self, lot_ids):
+        lots = self.env['stock.lot'].sudo().browse(list(lot_ids)).exists()
+        if not lots:
+            return
+        computed = self._stone_compute_live(
+            lots.mapped('product_id').ids, lot_ids=lots.ids)
+        self._stone_sync_rows(computed, [('lot_id', 'in', lots.ids)])
+
+    # =========================================================================
+    # Reconstrucción / verificación
+    # =========================================================================
+
+    @api.model
+    def _stone_ledger_products(self):
+        """Productos con lotes en líneas confirmadas o con filas vigentes."""
+        Sol = self.env['sale.order.line']
+        field = Sol._fields['lot_ids']
+        Sol.flush_model(['lot_ids', 'product_id', 'order_id'])
+        self.env['sale.order'].flush_model(['state'])
+        self.env.cr.execute("""
+            SELECT DISTINCT sol.product_id
+              FROM {rel} rel
+              JOIN sale_order_line sol ON sol.id = rel.{col1}
+              JOIN sale_order so ON so.id = sol.order_id
+             WHERE so.state IN ('sale', 'done')
+               AND sol.product_id IS NOT NULL
+        """.format(rel=field.relation, col1=field.column1))
+        product_ids = {row[0] for row in self.env.cr.fetchall()}
+        product_ids.update(self.sudo().search([]).mapped('product_id').ids)
+        return sorted(product_ids)
+
+    @api.model
+    def _stone_rebuild_ledger(self, product_ids=None, chunk_size=200):
+        """Reconstruye el libro desde el cálculo vivo, por bloques de
+        productos. Al terminar sin acotar productos, el selector empieza a
+        leer del libro. Privado: lo corre el cron (_stone_ledger_cron), no
+        un RPC."""
+        full_rebuild = not product_ids
+        product_ids = list(product_ids or self._stone_ledger_products())
+        created = removed = 0
+        for start in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[start:start + chunk_size]
+            computed = self._stone_compute_live(chunk)
+            c, r = self._stone_sync_rows(
+                computed, [('product_id', 'in', chunk)])
+            created += c
+            removed += r
+        if full_rebuild:
+            self.env['ir.config_parameter'].sudo().set_param(
+                LEDGER_READY_PARAM, 'True')
+        _logger.info(
+            '[STONE LEDGER] Reconstruido: %s productos, %s filas nuevas, '
+            '%s filas borradas.', len(product_ids), created, removed)
+        return True
+
+    @api.model
+    def _stone_verify_ledger(self, product_ids=None, chunk_size=200):
+        """Compara el libro contra el cálculo vivo. Retorna la lista de
+        diferencias (vacía = consistente); no corrige nada."""
+        product_ids = list(product_ids or self._stone_ledger_products())
+        fields_to_check = (
+            'committed_qty', 'delivered_qty', 'physical_qty', 'state')
+        mismatches = []
+        for start in range(0, len(product_ids), chunk_size):
+            chunk = product_ids[start:start + chunk_size]
+            computed = self._stone_compute_live(chunk)
+            rows = self.sudo().search([('product_id', 'in', chunk)])
+            by_lot = {row.lot_id.id: row for row in rows}
+            for lot_id in set(computed) | set(by_lot):
+                live = computed.get(lot_id)
+                row = by_lot.get(lot_id)
+                if not live or not row:
+                    mismatches.append({
+                        'lot_id': lot_id,
+                        'issue': 'missing_row' if live else 'stale_row',
+                    })
+                    continue
+                diff = {
+                    key: (row[key], live[key]) for key in fields_to_check
+                    if self._stone_value_differs(row, key, live[key])
+                }
+                if diff:
+                    mismatches.append({
+                        'lot_id': lot_id, 'issue': 'mismatch', 'diff': diff})
+        if mismatches:
+            _logger.warning(
+                '[STONE LEDGER] %s diferencia(s) contra el cálculo vivo: %s',
+                len(mismatches), mismatches[:20])
+        else:
+            _logger.info(
+                '[STONE LEDGER] Libro consistente (%s productos).',
+                len(product_ids))
+        return mismatches
+
+    @api.model
+    def _stone_ledger_cron(self):
+        """Primera corrida: reconstrucción completa (marca el libro como
+        listo). Después, verificación diaria: los lotes que difieren del
+        cálculo vivo se recalculan."""
+        if not self.env['ir.config_parameter'].sudo().get_param(
+                LEDGER_READY_PARAM):
+            return self._stone_rebuild_ledger()
+        mismatches = self._stone_verify_ledger()
+        if mismatches:
+            self._stone_refresh_lots({m['lot_id'] for m in mismatches})
+            _logger.info(
+                '[STONE LEDGER] %s lote(s) corregidos contra el cálculo vivo.',
+                len(mismatches))
+        return True
+
+    @api.model
+    def _stone_enqueue_ledger_rebuild(self):
+        """Paso de actualización del módulo: despierta al cron del libro
+        para que se construya (o verifique) fuera del -u."""
+        cron = self.env.ref(
+            'sale_stone_selection.ir_cron_stone_commitment_ledger',
+            raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        else:
+            _logger.warning(
+                '[STONE LEDGER] Cron del libro de compromisos no encontrado; '
+                'el selector sigue con el cálculo vivo.')
+        return True
+
+    # =========================================================================
+    # Lectura
+    # =========================================================================
+
+    @api.model
+    def _stone_ledger_ready(self):
+        """El libro se usa solo si ya se reconstruyó Y no hay lotes sucios
+        pendientes en esta transacción: esos cambios aún no llegan a las
+        filas (se recalculan en el precommit) y ahí manda el cálculo vivo."""
+        if self.env.cr.precommit.data.get('stone_commitment_dirty'):
+            return False
+        return bool(self.env['ir.config_parameter'].sudo().get_param(
+            LEDGER_READY_PARAM))
+
+    @api.model
+    def _stone_fully_committed_lot_ids(self, product_ids):
+        return self.sudo().search([
+            ('product_id', 'in', list(product_ids)),
+            ('state', '=', 'full'),
+        ]).mapped('lot_id').ids
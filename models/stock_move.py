@@ -16,27 +16,106 @@ class StockMove(models.Model):
         return res
 
     def _sync_stone_sale_lines(self):
+        """
+        Encola la sincronización picking → línea de venta. Validar o
+        re-reservar un picking de 200 líneas disparaba este sync (y el
+        write (6, 0, ...) con holds, duplicados, bitácora y ratchet) una
+        vez por cada move line tocada; ahora cada línea de venta afectada
+        se sincroniza UNA vez, en el precommit de la transacción, con el
+        estado final de sus pickings. El resultado es la misma unión.
+
+        Con el contexto `stone_sync_sale_lines_now` corre en el acto.
+        """
         if self.env.context.get('is_stone_confirming'):
             _logger.info("[STONE SYNC] Saltando sync durante confirmación inicial")
             return
 
-        for move in self:
-            if not move.sale_line_id:
-                continue
+        # El estado se filtra al ENCOLAR: al llegar el precommit un picking
+        # recién validado ya tiene sus moves en 'done' y no debe perderse.
+        moves = self.filtered(
+            lambda m: m.sale_line_id and m.state not in ['done', 'cancel'])
+        if not moves:
+            return
 
-            if move.state in ['done', 'cancel']:
-                continue
+        if self.env.context.get('stone_sync_sale_lines_now'):
+            moves._stone_sync_sale_lines_now()
+            return
+
+        data = self.env.cr.precommit.data
+        pending = data.get('stone_sale_line_sync')
+        if pending is None:
+            pending = data['stone_sale_line_sync'] = {}
+
+            @self.env.cr.precommit.add
+            def _stone_coalesced_sale_line_sync():
+                queued = data.pop('stone_sale_line_sync', {})
+                if queued:
+                    _logger.info(
+                        "[STONE SYNC] Sync coalescido: %s línea(s) de venta",
+                        len(queued))
+                    self.env['stock.move']._stone_run_queued_sale_line_sync(
+                        queued)
 
-            sol = move.sale_line_id
+        # Un move por línea de venta basta: el sync recorre TODOS los moves
+        # de la línea (la unión no depende de cuál lo dispare). Cada entrada
+        # guarda el env de quien la encoló (usuario, compañía, contexto):
+        # el precommit corre cada grupo con el suyo, no con el del primero.
+        for move in moves:
+            pending[move.sale_line_id.id] = (move.id, self.env)
 
-            all_lot_ids = set()
+    @api.model
+    def _stone_run_queued_sale_line_sync(self, queued):
+        """Corre el sync encolado, agrupado por env. Moves borrados después
+        de encolarse (p. ej. en un savepoint que se revirtió) se descartan."""
+        by_env = {}
+        for move_id, env in queued.values():
+            by_env.setdefault(id(env), (env, []))[1].append(move_id)
+        for env, move_ids in by_env.values():
+            moves = env['stock.move'].browse(move_ids).exists()
+            moves = moves.filtered(lambda m: m.sale_line_id.exists())
+            if moves:
+                moves._stone_sync_sale_lines_now()
+            env.flush_all()
 
-            for sibling_move in sol.move_ids:
-                if sibling_move.state == 'cancel':
-                    continue
-                for ml in sibling_move.move_line_ids:
-                    if ml.lot_id:
-                        all_lot_ids.add(ml.lot_id.id)
+    def _stone_sale_line_lot_aggregate(self, sale_lines):
+        """
+        {sol_id: {lot_id: {state: qty}}} de las move lines con lote de los
+        moves NO cancelados de `sale_lines`, con UN solo read_group. Un lote
+        presente con cantidad 0 también aparece (basta con estar en la
+        entrega para oficializarse).
+        """
+        MoveLine = self.env['stock.move.line']
+        moves = sale_lines.move_ids
+        if not moves:
+            return {}
+        sol_by_move = {move.id: move.sale_line_id.id for move in moves}
+        MoveLine.flush_model(['move_id', 'lot_id', 'state', 'quantity'])
+
+        aggregate = {}
+        for move, lot, state, qty in MoveLine._read_group(
+            [
+                ('move_id', 'in', moves.ids),
+                ('lot_id', '!=', False),
+                ('state', '!=', 'cancel'),
+            ],
+            ['move_id', 'lot_id', 'state'],
+            ['quantity:sum'],
+        ):
+            by_state = aggregate.setdefault(
+                sol_by_move[move.id], {}).setdefault(lot.id, {})
+            by_state[state] = by_state.get(state, 0.0) + (qty or 0.0)
+        return aggregate
+
+    def _stone_sale_line_sync_plan(self, sale_lines, aggregate):
+        """Plan de escritura por línea de venta a partir del agregado:
+        [(sol, write_vals, all_lot_ids, suppress_ratchet)]."""
+        Lot = self.env['stock.lot']
+        pending = []
+        added_lot_ids = set()
+
+        for sol in sale_lines:
+            lots_qty = aggregate.get(sol.id) or {}
+            all_lot_ids = set(lots_qty)
 
             existing_lots = set(sol.lot_ids.ids) if sol.lot_ids else set()
 
@@ -75,19 +154,23 @@ class StockMove(models.Model):
             # La unión de arriba los cubre a los dos y a todos los demás
             # casos que no habíamos encontrado todavía.
             added = all_lot_ids - existing_lots
+            if all_lot_ids == existing_lots:
+                continue
+
+            added_lot_ids |= added
+            pending.append((sol, all_lot_ids, added))
+
+        # Nombres y tipo de todos los lotes agregados: una sola lectura.
+        lots_by_id = {lot.id: lot for lot in Lot.browse(list(added_lot_ids))}
+
+        plan = []
+        for sol, all_lot_ids, added in pending:
+            lots_qty = aggregate.get(sol.id) or {}
             if added:
-                added_names = self.env['stock.lot'].browse(
-                    list(added)).mapped('name')
                 _logger.info(
                     "[STONE SYNC] Oficializando en el selector lotes "
                     "presentes en la ENTREGA (SO Line %s): %s",
-                    sol.id, added_names)
-
-            if all_lot_ids == existing_lots:
-                continue
-
-            _logger.info("[STONE SYNC] Picking %s -> SO Line %s",
-                         move.picking_id.name if move.picking_id else 'N/A', sol.id)
+                    sol.id, [lots_by_id[lid].name for lid in added])
 
             # SEMBRAR EL DESGLOSE de los lotes formato/pieza recién
             # oficializados: sin entrada en x_lot_breakdown_json, el lote se
@@ -97,23 +180,19 @@ class StockMove(models.Model):
             # lo que la entrega dice.
             write_vals = {'lot_ids': [(6, 0, list(all_lot_ids))]}
             if added and 'x_lot_breakdown_json' in sol._fields:
-                breakdown = dict(sol.x_lot_breakdown_json or {})
+                accessor = sol._stone_breakdown()
+                breakdown = dict(accessor.raw)
                 changed_bd = False
                 for lot_id in added:
-                    lot = self.env['stock.lot'].browse(lot_id)
+                    lot = lots_by_id[lot_id]
                     tipo = ''
                     if 'x_tipo' in lot._fields and lot.x_tipo:
                         tipo = str(lot.x_tipo).strip().lower()
                     if tipo not in ('formato', 'pieza'):
                         continue
-                    if sol._som_breakdown_qty_for_lot(breakdown, lot) is not None:
+                    if accessor.qty(lot_id) is not None:
                         continue
-                    ml_qty = sum(
-                        ml.quantity or 0.0
-                        for ml in sol.move_ids.mapped('move_line_ids')
-                        if ml.lot_id.id == lot_id
-                        and ml.state not in ('cancel',)
-                    )
+                    ml_qty = sum((lots_qty.get(lot_id) or {}).values())
                     if ml_qty > 0:
                         breakdown[str(lot_id)] = ml_qty
                         changed_bd = True
@@ -128,17 +207,34 @@ class StockMove(models.Model):
             # 'solicitado >= asignado' es universal y este contexto lo
             # apagaba parejo — asignar placas directo en la entrega dejaba
             # el Solicitado congelado en lo capturado al inicio.
-            delivered_added = set()
-            for lot_id in added:
-                done_qty = sum(
-                    ml.quantity or 0.0
-                    for ml in sol.move_ids.mapped('move_line_ids')
-                    if ml.lot_id.id == lot_id and ml.state == 'done'
-                )
-                if done_qty > 0:
-                    delivered_added.add(lot_id)
+            delivered_added = {
+                lot_id for lot_id in added
+                if (lots_qty.get(lot_id) or {}).get('done', 0.0) > 0
+            }
             suppress_ratchet = not (added - delivered_added)
 
+            plan.append((sol, write_vals, all_lot_ids, suppress_ratchet))
+        return plan
+
+    def _stone_sync_sale_lines_now(self):
+        moves = self.filtered(
+            lambda m: m.sale_line_id and m.state != 'cancel')
+        if not moves:
+            return
+        # Un move representativo por línea (solo para el nombre del picking
+        # en la bitácora); la unión se calcula sobre todos sus moves.
+        move_by_sol = {}
+        for move in moves:
+            move_by_sol.setdefault(move.sale_line_id.id, move)
+        sale_lines = moves.mapped('sale_line_id')
+
+        aggregate = self._stone_sale_line_lot_aggregate(sale_lines)
+        plan = self._stone_sale_line_sync_plan(sale_lines, aggregate)
+
+        for sol, write_vals, all_lot_ids, suppress_ratchet in plan:
+            move = move_by_sol[sol.id]
+            _logger.info("[STONE SYNC] Picking %s -> SO Line %s",
+                         move.picking_id.name if move.picking_id else 'N/A', sol.id)
             try:
                 # tc_qty_sync_from_lots: solo cuando TODO lo agregado es
                 # oficialización de entregado (ver arriba). Sin esta marca,
@@ -183,6 +279,17 @@ class StockMove(models.Model):
     def write(self, vals):
         res = super(StockMove, self).write(vals)
 
+        # El estado de las move lines es relacionado al del move: validar o
+        # cancelar un picking no pasa por stock.move.line.write, así que el
+        # libro de compromisos se marca desde aquí.
+        if 'state' in vals:
+            lines = self.move_line_ids.filtered('lot_id')
+            if lines:
+                self.env['stock.lot.commitment']._stone_mark_dirty(
+                    lines.mapped('lot_id').ids)
+                self.env['stock.quant']._stone_bump_selector_generation(
+                    lines.mapped('product_id').ids)
+
         if 'move_line_ids' in vals and not self.env.context.get('skip_stone_sync_so'):
             for move in self:
                 if move.sale_line_id and move.state not in ['done', 'cancel']:
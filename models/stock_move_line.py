@@ -42,6 +42,10 @@ class StockMoveLine(models.Model):
         de venta tiene lotes seleccionados manualmente.
         """
         lines = super(StockMoveLine, self).create(vals_list)
+        self.env['stock.lot.commitment']._stone_mark_dirty(
+            lines.mapped('lot_id').ids)
+        self.env['stock.quant']._stone_bump_selector_generation(
+            lines.mapped('product_id').ids)
         
         if (not self.env.context.get('skip_stone_sync_so') 
             and not self.env.context.get('is_stone_confirming')):
@@ -55,7 +59,16 @@ class StockMoveLine(models.Model):
         return lines
 
     def write(self, vals):
+        ledger_lot_ids = (
+            set(self.mapped('lot_id').ids)
+            if {'lot_id', 'quantity', 'move_id', 'state'} & set(vals)
+            else set())
         res = super(StockMoveLine, self).write(vals)
+        if ledger_lot_ids or 'lot_id' in vals:
+            ledger_lot_ids.update(self.mapped('lot_id').ids)
+            self.env['stock.lot.commitment']._stone_mark_dirty(ledger_lot_ids)
+            self.env['stock.quant']._stone_bump_selector_generation(
+                self.mapped('product_id').ids)
         
         if (('lot_id' in vals or 'quantity' in vals) 
             and not self.env.context.get('skip_stone_sync_so')):
@@ -71,6 +84,10 @@ class StockMoveLine(models.Model):
         moves_to_sync = self.mapped('move_id').filtered(
             lambda m: m.sale_line_id and m.state not in ['done', 'cancel']
         )
+        self.env['stock.lot.commitment']._stone_mark_dirty(
+            self.mapped('lot_id').ids)
+        self.env['stock.quant']._stone_bump_selector_generation(
+            self.mapped('product_id').ids)
         
         res = super(StockMoveLine, self).unlink()
         
@@ -1,31 +1,141 @@
 # -*- coding: utf-8 -*-
 from odoo import models, api
+from odoo.tools import SQL, ormcache
+from odoo.tools.lru import LRU
+import base64
+import json
 import logging
+import time
 _logger = logging.getLogger(__name__)
 
+# Caché de proceso para los conjuntos passthrough del selector:
+# {(db, product_id, company_id, generation): (monotonic, sets)}.
+_PASSTHROUGH_CACHE = LRU(512)
+PASSTHROUGH_CACHE_TTL = 60.0
+
+# Vacíos del formato compacto: mismos defaults que _quants_to_result
+# (texto '' , números 0); lo que no está aquí viaja como ''.
+COMPACT_LOT_DEFAULTS = {
+    'x_grosor': 0, 'x_alto': 0, 'x_ancho': 0, 'x_peso': 0,
+    'x_cantidad_fotos': 0,
+    'x_tiene_fotografias': False, 'x_fotografia_url': False,
+}
+
+# Atributos de lote que puede pedir el selector, en el orden del formato
+# clásico, con su vacío. Los que no existen en stock.lot viajan con él.
+# x_fotografia_url es derivada (miniatura), no una columna.
+STONE_LOT_FIELD_DEFAULTS = {
+    'name': '',
+    'x_grosor': 0, 'x_alto': 0, 'x_ancho': 0, 'x_peso': 0,
+    'x_tipo': '', 'x_numero_placa': '', 'x_bloque': '', 'x_atado': '',
+    'x_grupo': '', 'x_color': '', 'x_pedimento': '', 'x_contenedor': '',
+    'x_referencia_proveedor': '', 'x_proveedor': '', 'x_origen': '',
+    'x_fotografia_principal': False, 'x_fotografia_url': False,
+    'x_tiene_fotografias': False, 'x_cantidad_fotos': 0,
+    'x_detalles_placa': '',
+}
+# Orden del selector en el servidor: llave -> [(columna, dirección)].
+# 'l.' = stock_lot, 'q.' = stock_quant. Siempre desempata lote y quant.
+STONE_SORT_ORDERS = {
+    'recency': [('l.x_stone_block_rank', 'DESC'), ('l.x_stone_block_seq', 'DESC'),
+                ('l.x_bloque', 'ASC')],
+    'folio': [('l.x_stone_block_rank', 'DESC'), ('l.x_stone_block_seq', 'ASC'),
+              ('l.x_bloque', 'ASC')],
+    'alto': [('l.x_alto', 'DESC'), ('l.x_ancho', 'DESC')],
+    'ancho': [('l.x_ancho', 'DESC'), ('l.x_alto', 'DESC')],
+    'area': [('q.quantity', 'DESC')],
+}
+
+# Facetas del selector: atributos de lote agrupables (además de ubicación).
+STONE_FACET_LOT_FIELDS = ('x_bloque', 'x_atado', 'x_tipo', 'x_color')
+STONE_FACET_LIMIT = 50
+
+# Lo que ya devolvía el formato clásico (sin URL de miniatura).
+STONE_RESULT_LOT_FIELDS = tuple(
+    key for key in STONE_LOT_FIELD_DEFAULTS if key != 'x_fotografia_url')
+
 
 class StockQuant(models.Model):
     _inherit = 'stock.quant'
 
+    # El físico por lote alimenta el libro de compromisos
+    # (stock.lot.commitment): todo cambio de cantidad marca su lote.
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super(StockQuant, self).create(vals_list)
+        self.env['stock.lot.commitment']._stone_mark_dirty(
+            quants.mapped('lot_id').ids)
+        self._stone_bump_selector_generation(quants.mapped('product_id').ids)
+        return quants
+
+    def write(self, vals):
+        res = super(StockQuant, self).write(vals)
+        if 'quantity' in vals or 'lot_id' in vals or 'location_id' in vals:
+            self.env['stock.lot.commitment']._stone_mark_dirty(
+                self.mapped('lot_id').ids)
+        if {'quantity', 'reserved_quantity', 'lot_id', 'location_id',
+                'x_tiene_hold', 'x_hold_activo_id'} & set(vals):
+            self._stone_bump_selector_generation(
+                self.mapped('product_id').ids)
+        return res
+
     @api.model
-    def _get_committed_lot_ids(self, product_id):
+    def _stone_lot_commitment(self, product_ids, lot_ids=None):
         """
-        Retorna IDs de lotes que están comprometidos en órdenes de venta confirmadas.
+        Motor de compromiso por lote, basado en conjuntos: resuelve TODOS los
+        productos de una vez con consultas agrupadas (move lines, quants y
+        relación línea↔lote), sin búsquedas por lote ni recorridos anidados.
+
+        Retorna {lot_id: {'product_id', 'tipo', 'committed', 'physical',
+        'fully'}} solo para los lotes comprometidos:
+        - committed: máx entre move lines vivas y capturas en órdenes
+          (topada al físico), mismo criterio que siempre.
+        - fully: el lote debe excluirse del selector.
+
+        Con `lot_ids` el cálculo se acota a esos lotes (mantenimiento
+        incremental del libro de compromisos).
         """
-        committed_move_lines = self.env['stock.move.line'].search([
-            ('product_id', '=', product_id),
+        if isinstance(product_ids, int):
+            product_ids = [product_ids]
+        product_ids = tuple({int(pid) for pid in (product_ids or []) if pid})
+        if not product_ids:
+            return {}
+        lot_scope = None
+        if lot_ids is not None:
+            lot_scope = tuple({int(lid) for lid in lot_ids if lid})
+            if not lot_scope:
+                return {}
+
+        MoveLine = self.env['stock.move.line'].sudo()
+        Sol = self.env['sale.order.line'].sudo()
+        qty_field = 'quantity' if 'quantity' in MoveLine._fields else 'qty_done'
+
+        # 1. Move lines vivas de ventas confirmadas: cantidad por lote.
+        ml_qty = {}
+        ml_product = {}
+        ml_domain = [
+            ('product_id', 'in', list(product_ids)),
             ('lot_id', '!=', False),
             ('state', 'not in', ['done', 'cancel']),
             ('move_id.sale_line_id', '!=', False),
             ('move_id.sale_line_id.order_id.state', 'in', ['sale', 'done']),
-        ])
-        committed_ids = set(committed_move_lines.mapped('lot_id').ids)
+        ]
+        if lot_scope:
+            ml_domain.append(('lot_id', 'in', list(lot_scope)))
+        for lot, product, qty in MoveLine._read_group(
+                ml_domain, ['lot_id', 'product_id'], ['%s:sum' % qty_field]):
+            ml_qty[lot.id] = ml_qty.get(lot.id, 0.0) + (qty or 0.0)
+            ml_product[lot.id] = product.id
+        committed_ids = set(ml_qty)
+
+        # 2. Pares (línea, lote) de líneas confirmadas, directo de la tabla
+        #    relación del many2many.
+        pairs = self._stone_confirmed_sol_lot_pairs(
+            product_ids, lot_ids=lot_scope)
+        sol_lots = {}
+        for sol_id, lot_id in pairs:
+            sol_lots.setdefault(sol_id, set()).add(lot_id)
 
-        committed_sol = self.env['sale.order.line'].search([
-            ('product_id', '=', product_id),
-            ('lot_ids', '!=', False),
-            ('order_id.state', 'in', ['sale', 'done']),
-        ])
         # ENTREGADO NO COMPROMETE (2026-08-14): lot_ids conserva los lotes
         # oficializados aunque la línea YA se entregó. Si ese material
         # regresó por devolución, está físicamente disponible y debe ser
@@ -33,25 +143,29 @@ class StockQuant(models.Model):
         # = pendiente de entregar: se descuentan los lotes con salida DONE
         # a cliente de SU MISMA línea (si otra orden abierta los tiene,
         # esa orden los sigue comprometiendo por su cuenta).
-        sol_lot_ids = set()
-        for sol in committed_sol:
-            sol_lot_ids.update(sol.lot_ids.ids)
-        delivered_by_line = {}
-        if sol_lot_ids:
-            done_mls = self.env['stock.move.line'].sudo().search([
-                ('product_id', '=', product_id),
-                ('lot_id', 'in', list(sol_lot_ids)),
-                ('state', '=', 'done'),
-                ('location_dest_id.usage', '=', 'customer'),
-                ('move_id.sale_line_id', 'in', committed_sol.ids),
-            ])
-            for ml in done_mls:
-                delivered_by_line.setdefault(
-                    ml.move_id.sale_line_id.id, set()).add(ml.lot_id.id)
-        for sol in committed_sol:
-            delivered = delivered_by_line.get(sol.id, set())
+        delivered = set()
+        if sol_lots:
+            MoveLine.flush_model(['state', 'lot_id', 'move_id', 'product_id',
+                                  'location_dest_id'])
+            self.env['stock.move'].flush_model(['sale_line_id'])
+            self.env.cr.execute("""
+                SELECT DISTINCT m.sale_line_id, ml.lot_id
+                  FROM stock_move_line ml
+                  JOIN stock_move m ON m.id = ml.move_id
+                  JOIN stock_location dest ON dest.id = ml.location_dest_id
+                 WHERE ml.state = 'done'
+                   AND ml.lot_id IS NOT NULL
+                   AND dest.usage = 'customer'
+                   AND ml.product_id IN %s
+                   AND m.sale_line_id IN %s
+            """, (product_ids, tuple(sol_lots)))
+            delivered = set(self.env.cr.fetchall())
+        for sol_id, lot_ids in sol_lots.items():
             committed_ids.update(
-                lid for lid in sol.lot_ids.ids if lid not in delivered)
+                lid for lid in lot_ids if (sol_id, lid) not in delivered)
+
+        if not committed_ids:
+            return {}
 
         # PARCIALIDADES (2026-08-11): el validador de duplicados ya es
         # partial-aware para FORMATO/PIEZA, así que aquí solo se excluyen
@@ -61,54 +175,187 @@ class StockQuant(models.Model):
         #   lines vivas y capturas en órdenes) cubre todo el físico; con
         #   remanente siguen seleccionables (el caller los pasa al
         #   passthrough para librar los filtros de reserva/hold).
-        if not committed_ids:
-            return []
-        fully = []
-        for lot in self.env['stock.lot'].browse(list(committed_ids)):
-            tipo = str(getattr(lot, 'x_tipo', '') or '').lower()
-            if tipo not in ('formato', 'pieza'):
-                fully.append(lot.id)
-                continue
-            quants = self.env['stock.quant'].sudo().search([
-                ('lot_id', '=', lot.id),
-                ('location_id.usage', '=', 'internal'),
-                ('quantity', '>', 0),
-            ])
-            fisico = sum(quants.mapped('quantity'))
-            ml_qty = 0.0
-            for ml in committed_move_lines:
-                if ml.lot_id.id == lot.id:
-                    ml_qty += (ml.quantity if 'quantity' in ml._fields
-                               else getattr(ml, 'qty_done', 0.0)) or 0.0
-            sol_qty = 0.0
-            for sol in committed_sol:
-                if lot.id not in sol.lot_ids.ids:
-                    continue
-                qty = None
-                if hasattr(sol, '_som_breakdown_qty_for_lot'):
-                    bd = getattr(sol, 'x_lot_breakdown_json', None)
-                    if bd:
-                        qty = sol._som_breakdown_qty_for_lot(bd, lot)
-                sol_qty += float(qty) if qty is not None else fisico
-            comprometido = max(ml_qty, min(sol_qty, fisico))
-            if comprometido >= fisico - 0.0001:
-                fully.append(lot.id)
-        return fully
+        lots = self.env['stock.lot'].sudo().browse(list(committed_ids))
+        tipo_by_lot = {
+            lot.id: str(getattr(lot, 'x_tipo', '') or '').lower()
+            for lot in lots
+        }
+        partial_ids = [
+            lid for lid, tipo in tipo_by_lot.items()
+            if tipo in ('formato', 'pieza')
+        ]
 
-    def _build_stone_domain(self, product_id, filters, safe_current_ids, excluded_lot_ids):
-        base_domain = [
-            ('product_id', '=', int(product_id)),
+        physical = {}
+        for lot, qty in self.sudo()._read_group([
+            ('lot_id', 'in', list(committed_ids)),
             ('location_id.usage', '=', 'internal'),
-            ('quantity', '>', 0)
-        ]
+            ('quantity', '>', 0),
+        ], ['lot_id'], ['quantity:sum']):
+            physical[lot.id] = qty or 0.0
+
+        # Captura en órdenes por lote parcial: desglose de cada línea (una
+        # sola lectura prefetcheada) o el físico completo si no lo trae.
+        sol_qty = {}
+        lot_by_id = {lot.id: lot for lot in lots}
+        partial_set = set(partial_ids)
+        if partial_set:
+            sols = Sol.browse([
+                sid for sid, lids in sol_lots.items() if lids & partial_set])
+            for sol in sols:
+                bd = sol._stone_breakdown()
+                for lid in sol_lots[sol.id] & partial_set:
+                    qty = None
+                    if bd:
+                        qty = bd.qty(lid)
+                    sol_qty[lid] = sol_qty.get(lid, 0.0) + (
+                        float(qty) if qty is not None
+                        else physical.get(lid, 0.0))
 
-        if excluded_lot_ids:
-            base_domain.append(('lot_id', 'not in', excluded_lot_ids))
+        result = {}
+        for lot in lots:
+            tipo = tipo_by_lot[lot.id]
+            fisico = physical.get(lot.id, 0.0)
+            if tipo in ('formato', 'pieza'):
+                comprometido = max(
+                    ml_qty.get(lot.id, 0.0),
+                    min(sol_qty.get(lot.id, 0.0), fisico))
+                fully = comprometido >= fisico - 0.0001
+            else:
+                comprometido = fisico
+                fully = True
+            result[lot.id] = {
+                'product_id': ml_product.get(lot.id) or lot.product_id.id,
+                'tipo': tipo or 'placa',
+                'committed': comprometido,
+                'physical': fisico,
+                'fully': fully,
+            }
+        return result
 
-        free_domain = [('reserved_quantity', '=', 0)]
-        if 'x_tiene_hold' in self.env['stock.quant']._fields:
-            free_domain.append(('x_tiene_hold', '=', False))
+    @api.model
+    def _stone_confirmed_sol_lot_pairs(self, product_ids, lot_ids=None):
+        """[(sale_line_id, lot_id)] de líneas en órdenes confirmadas para los
+        productos dados, leídos de la tabla relación de lot_ids."""
+        Sol = self.env['sale.order.line']
+        field = Sol._fields['lot_ids']
+        Sol.flush_model(['lot_ids', 'product_id', 'order_id'])
+        self.env['sale.order'].flush_model(['state'])
+        query = """
+            SELECT rel.{col1}, rel.{col2}
+              FROM {rel} rel
+              JOIN sale_order_line sol ON sol.id = rel.{col1}
+              JOIN sale_order so ON so.id = sol.order_id
+             WHERE sol.product_id IN %s
+               AND so.state IN ('sale', 'done')
+        """.format(rel=field.relation, col1=field.column1, col2=field.column2)
+        params = [tuple(product_ids)]
+        if lot_ids:
+            query += " AND rel.{col2} IN %s".format(col2=field.column2)
+            params.append(tuple(lot_ids))
+        self.env.cr.execute(query, params)
+        return self.env.cr.fetchall()
 
+    @api.model
+    def _get_committed_lot_ids(self, product_id):
+        """
+        Retorna IDs de lotes que están COMPLETAMENTE comprometidos en órdenes
+        de venta confirmadas. Acepta un producto o una lista: los callers en
+        lote pagan las consultas una sola vez.
+
+        Con el libro de compromisos reconstruido (stock.lot.commitment) la
+        respuesta es una sola lectura indexada; si no, se calcula en vivo.
+        """
+        Ledger = self.env['stock.lot.commitment']
+        if Ledger._stone_ledger_ready():
+            product_ids = (
+                [product_id] if isinstance(product_id, int) else product_id)
+            return Ledger._stone_fully_committed_lot_ids(product_ids)
+        commitment = self._stone_lot_commitment(product_id)
+        return [lid for lid, data in commitment.items() if data['fully']]
+
+    # =========================================================================
+    # Conjuntos passthrough del selector (caché por generación)
+    # =========================================================================
+    # El popup pagina de 35 en 35: cada scroll repetía las tres búsquedas de
+    # abajo. Se cachean por (base, producto, compañía, generación); la
+    # generación por producto sube DESPUÉS del commit de cualquier write que
+    # pueda cambiarlas (move lines, quants/holds, lot_ids de ventas), así que
+    # ningún worker sirve un conjunto viejo. La transacción que escribió no
+    # usa la caché hasta cerrar. El TTL cubre cambios que no pasan por
+    # write() (campos de hold calculados en otro módulo).
+
+    @api.model
+    def _stone_bump_selector_generation(self, product_ids):
+        """Marca productos para subir su generación DESPUÉS del commit. Solo
+        productos con seguimiento por lote (los únicos que pasan por el
+        selector): un movimiento de stock de cualquier otro producto no
+        registra nada. Un solo postcommit y un solo upsert por transacción."""
+        product_ids = {int(pid) for pid in (product_ids or []) if pid}
+        if not product_ids:
+            return
+        data = self.env.cr.postcommit.data
+        dirty = data.get('stone_selector_dirty_products')
+        product_ids -= dirty or set()
+        if not product_ids:
+            return
+        product_ids = set(self.env['product.product'].sudo().browse(
+            product_ids).filtered(lambda p: p.tracking == 'lot').ids)
+        if not product_ids:
+            return
+        if dirty is None:
+            dirty = data['stone_selector_dirty_products'] = set()
+            registry = self.env.registry
+
+            @self.env.cr.postcommit.add
+            def _stone_bump_generations():
+                pending = data.pop('stone_selector_dirty_products', set())
+                if not pending:
+                    return
+                with registry.cursor() as cr:
+                    cr.execute("""
+                        INSERT INTO sale_stone_selector_generation
+                               (product_id, generation)
+                        SELECT pid, 1 FROM unnest(%s::int[]) AS pid
+                        ON CONFLICT (product_id) DO UPDATE
+                           SET generation =
+                               sale_stone_selector_generation.generation + 1
+                    """, (sorted(pending),))
+        dirty.update(product_ids)
+
+    @api.model
+    def _stone_selector_generation(self, product_id):
+        self.env.cr.execute(
+            "SELECT generation FROM sale_stone_selector_generation "
+            "WHERE product_id = %s", (int(product_id),))
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def _stone_passthrough_sets(self, product_id):
+        """{'weak', 'partial_hold', 'partial_committed'}: frozensets de lotes
+        que libran el filtro de reserva/hold, sin acotar por excluidos."""
+        product_id = int(product_id)
+        dirty = self.env.cr.postcommit.data.get(
+            'stone_selector_dirty_products') or ()
+        if product_id in dirty:
+            return self._stone_compute_passthrough_sets(product_id)
+
+        key = (
+            self.env.cr.dbname,
+            product_id,
+            self.env.company.id,
+            self._stone_selector_generation(product_id),
+        )
+        cached = _PASSTHROUGH_CACHE.get(key)
+        now = time.monotonic()
+        if cached and now - cached[0] < PASSTHROUGH_CACHE_TTL:
+            return cached[1]
+        sets = self._stone_compute_passthrough_sets(product_id)
+        _PASSTHROUGH_CACHE[key] = (now, sets)
+        return sets
+
+    @api.model
+    def _stone_compute_passthrough_sets(self, product_id):
         # Placas retenidas SOLO por un traslado interno de carrito/escáner
         # ABIERTO (reserva DÉBIL de reacomodo de ubicación) siguen siendo
         # vendibles: esa reserva se libera sola al confirmar la venta, así
@@ -121,15 +368,12 @@ class StockQuant(models.Model):
             ('picking_id.origin', '=like', 'Carrito - %'),
             ('picking_id.state', 'not in', ('done', 'cancel')),
         ])
-        weak_lot_ids = [
-            lid for lid in weak_lines.mapped('lot_id').ids
-            if lid not in (excluded_lot_ids or [])
-        ]
+        weak_lot_ids = frozenset(weak_lines.mapped('lot_id').ids)
 
         # APARTADO PARCIAL: un formato/pieza con hold que solo retiene su
         # parcialidad sigue siendo vendible por el REMANENTE — pasa al
         # selector (la validación de holds y los topes cuidan la cantidad).
-        partial_hold_lot_ids = []
+        partial_hold_lot_ids = frozenset()
         if 'x_tiene_hold' in self.env['stock.quant']._fields:
             held_quants = self.env['stock.quant'].sudo().search([
                 ('product_id', '=', int(product_id)),
@@ -138,31 +382,49 @@ class StockQuant(models.Model):
                 ('x_tiene_hold', '=', True),
                 ('lot_id.x_tipo', 'in', ('formato', 'pieza')),
             ])
-            partial_hold_lot_ids = [
+            partial_hold_lot_ids = frozenset(
                 q.lot_id.id for q in held_quants
-                if q.lot_id
-                and q.lot_id.id not in (excluded_lot_ids or [])
-                and q.som_hold_free_qty() > 0.0001
-            ]
+                if q.lot_id and q.som_hold_free_qty() > 0.0001
+            )
 
         # Comprometidos PARCIALES (formato/pieza con remanente): pueden
         # traer reserva nativa — pasan al passthrough para ser visibles.
-        partial_committed_ids = []
-        Sol = self.env['sale.order.line'].sudo()
-        sols_live = Sol.search([
+        partial_committed_ids = set()
+        pairs = self._stone_confirmed_sol_lot_pairs([int(product_id)])
+        if pairs:
+            lots = self.env['stock.lot'].sudo().browse(
+                list({lot_id for _sol_id, lot_id in pairs}))
+            partial_committed_ids = {
+                lot.id for lot in lots
+                if str(getattr(lot, 'x_tipo', '') or '').lower()
+                in ('formato', 'pieza')
+            }
+
+        return {
+            'weak': weak_lot_ids,
+            'partial_hold': partial_hold_lot_ids,
+            'partial_committed': frozenset(partial_committed_ids),
+        }
+
+    def _build_stone_domain(self, product_id, filters, safe_current_ids, excluded_lot_ids):
+        base_domain = [
             ('product_id', '=', int(product_id)),
-            ('lot_ids', '!=', False),
-            ('order_id.state', 'in', ['sale', 'done']),
-        ])
-        seen_partial = set()
-        for sol in sols_live:
-            for lot in sol.lot_ids:
-                if lot.id in seen_partial or lot.id in (excluded_lot_ids or []):
-                    continue
-                tipo = str(getattr(lot, 'x_tipo', '') or '').lower()
-                if tipo in ('formato', 'pieza'):
-                    seen_partial.add(lot.id)
-                    partial_committed_ids.append(lot.id)
+            ('location_id.usage', '=', 'internal'),
+            ('quantity', '>', 0)
+        ]
+
+        if excluded_lot_ids:
+            base_domain.append(('lot_id', 'not in', excluded_lot_ids))
+
+        free_domain = [('reserved_quantity', '=', 0)]
+        if 'x_tiene_hold' in self.env['stock.quant']._fields:
+            free_domain.append(('x_tiene_hold', '=', False))
+
+        sets = self._stone_passthrough_sets(product_id)
+        excluded = set(excluded_lot_ids or [])
+        weak_lot_ids = sets['weak'] - excluded
+        partial_hold_lot_ids = sets['partial_hold'] - excluded
+        partial_committed_ids = sets['partial_committed'] - excluded
 
         passthrough_ids = list(
             set(safe_current_ids or [])
@@ -181,106 +443,210 @@ class StockQuant(models.Model):
 
         domain = base_domain + availability_domain
 
-        if filters.get('bloque'):
-            domain.append(('lot_id.x_bloque', 'ilike', filters['bloque']))
-        if filters.get('atado'):
-            domain.append(('lot_id.x_atado', 'ilike', filters['atado']))
-        if filters.get('lot_name'):
-            domain.append(('lot_id.name', 'ilike', filters['lot_name']))
-        if filters.get('alto_min'):
-            try:
-                domain.append(('lot_id.x_alto', '>=', float(filters['alto_min'])))
-            except Exception:
-                pass
-        if filters.get('ancho_min'):
-            try:
-                domain.append(('lot_id.x_ancho', '>=', float(filters['ancho_min'])))
-            except Exception:
-                pass
-        if filters.get('tipo'):
-            domain.append(('lot_id.x_tipo', '=', filters['tipo']))
+        # Filtros de lote (texto con trigram, rangos de dimensión, tipo) en
+        # una sola subconsulta sobre stock_lot acotada por producto.
+        lot_domain = self.env['stock.lot']._stone_selector_lot_domain(
+            product_id, filters)
+        if lot_domain:
+            domain.append(('lot_id', 'any', lot_domain))
 
         return domain
 
-    def _build_lots_data(self, lot_ids):
+    @api.model
+    @ormcache()
+    def _stone_lot_field_plan(self):
+        """((llave, es_many2one), ...) de los atributos de lote que existen
+        en este registro. Se resuelve una vez por registro (la caché se
+        limpia al recargarlo), no 20 consultas a _fields por lote."""
+        Lot = self.env['stock.lot']
+        plan = []
+        for key in STONE_LOT_FIELD_DEFAULTS:
+            field = Lot._fields.get(key)
+            if field is not None:
+                plan.append((key, field.type == 'many2one'))
+        return tuple(plan)
+
+    @api.model
+    def _stone_wanted_lot_fields(self, fields, default):
+        """Lista blanca del llamador, en orden canónico; el nombre siempre
+        viaja. Llaves desconocidas se ignoran."""
+        if not fields:
+            return default
+        wanted = set(fields) | {'name'}
+        return tuple(key for key in STONE_LOT_FIELD_DEFAULTS if key in wanted)
+
+    def _build_lots_data(self, lot_ids, with_photo=True, fields=None):
+        """Datos de lote para el selector. Con `with_photo=False` no se lee
+        el binario de la foto principal: viaja su URL de miniatura, que el
+        navegador cachea.
+
+        Un solo read() con las columnas pedidas (`fields`, lista blanca;
+        por omisión todas): la lista inline y el grid de moves no pagan
+        por atributos que no muestran."""
         lots_data = {}
         if not lot_ids:
             return lots_data
 
-        lots = self.env['stock.lot'].browse(lot_ids)
-        for lot in lots:
-            x_proveedor_value = lot.x_proveedor if 'x_proveedor' in lot._fields else False
-            if x_proveedor_value:
-                field_type = lot._fields.get('x_proveedor')
-                if field_type and field_type.type == 'many2one':
-                    x_proveedor_display = x_proveedor_value.name if x_proveedor_value else ''
-                else:
-                    x_proveedor_display = str(x_proveedor_value) if x_proveedor_value else ''
-            else:
-                x_proveedor_display = ''
-
-            lots_data[lot.id] = {
-                'name': lot.name,
-                'x_grosor': lot.x_grosor if 'x_grosor' in lot._fields else 0,
-                'x_alto': lot.x_alto if 'x_alto' in lot._fields else 0,
-                'x_ancho': lot.x_ancho if 'x_ancho' in lot._fields else 0,
-                'x_peso': lot.x_peso if 'x_peso' in lot._fields else 0,
-                'x_tipo': lot.x_tipo if 'x_tipo' in lot._fields else '',
-                'x_numero_placa': lot.x_numero_placa if 'x_numero_placa' in lot._fields else '',
-                'x_bloque': lot.x_bloque if 'x_bloque' in lot._fields else '',
-                'x_atado': lot.x_atado if 'x_atado' in lot._fields else '',
-                'x_grupo': lot.x_grupo if 'x_grupo' in lot._fields else '',
-                'x_color': lot.x_color if 'x_color' in lot._fields else '',
-                'x_pedimento': lot.x_pedimento if 'x_pedimento' in lot._fields else '',
-                'x_contenedor': lot.x_contenedor if 'x_contenedor' in lot._fields else '',
-                'x_referencia_proveedor': lot.x_referencia_proveedor if 'x_referencia_proveedor' in lot._fields else '',
-                'x_proveedor': x_proveedor_display,
-                'x_origen': lot.x_origen if 'x_origen' in lot._fields else '',
-                'x_fotografia_principal': lot.x_fotografia_principal if 'x_fotografia_principal' in lot._fields else False,
-                'x_tiene_fotografias': lot.x_tiene_fotografias if 'x_tiene_fotografias' in lot._fields else False,
-                'x_cantidad_fotos': lot.x_cantidad_fotos if 'x_cantidad_fotos' in lot._fields else 0,
-                'x_detalles_placa': lot.x_detalles_placa if 'x_detalles_placa' in lot._fields else '',
-            }
+        wanted = self._stone_wanted_lot_fields(
+            fields, tuple(STONE_LOT_FIELD_DEFAULTS))
+        want_url = not with_photo and 'x_fotografia_url' in wanted
+        plan = dict(self._stone_lot_field_plan())
+        columns = [
+            key for key in wanted
+            if key in plan
+            and (with_photo or key != 'x_fotografia_principal')
+        ]
+        read_columns = list(columns)
+        if want_url:
+            # _stone_lot_photo_urls decide con estas dos; que queden en caché.
+            read_columns += [
+                key for key in ('x_tiene_fotografias', 'x_cantidad_fotos')
+                if key in plan and key not in read_columns]
+
+        Lot = self.env['stock.lot']
+        lots = Lot.browse(lot_ids)
+        rows = lots.read(read_columns, load=None)
+
+        # Many2one (x_proveedor): el nombre, con una lectura por columna.
+        m2o_names = {}
+        for key in columns:
+            if not plan[key]:
+                continue
+            ids = {row[key] for row in rows if row[key]}
+            comodel = Lot.env[Lot._fields[key].comodel_name]
+            m2o_names[key] = {
+                rec['id']: rec['name'] or ''
+                for rec in comodel.browse(ids).read(['name'])
+            } if ids else {}
+
+        photo_urls = self._stone_lot_photo_urls(lots) if want_url else {}
+
+        missing = [
+            key for key in wanted
+            if key not in plan and key != 'x_fotografia_url']
+        for row in rows:
+            info = {key: STONE_LOT_FIELD_DEFAULTS[key] for key in missing}
+            for key in columns:
+                value = row[key]
+                if key in m2o_names:
+                    value = m2o_names[key].get(value, '') if value else ''
+                info[key] = value
+            if 'x_fotografia_principal' in wanted and not with_photo:
+                info['x_fotografia_principal'] = False
+            if 'x_fotografia_url' in wanted:
+                info['x_fotografia_url'] = photo_urls.get(row['id'], False)
+            lots_data[row['id']] = info
 
         return lots_data
 
-    def _quants_to_result(self, quants, lots_data):
+    def _stone_quant_rows(self, quants):
+        """read() de los quants + nombres de ubicación en bloque (el
+        display_name de cada ubicación ya no dispara su cadena de padres
+        quant por quant)."""
+        rows = quants.read(
+            ['lot_id', 'location_id', 'quantity', 'reserved_quantity'],
+            load=None)
+        locations = quants.location_id
+        location_names = dict(zip(locations.ids, locations.mapped('display_name')))
+        return rows, location_names
+
+    def _quants_to_result(self, quants, lots_data, fields=None):
+        lot_keys = [
+            key for key in self._stone_wanted_lot_fields(
+                fields, STONE_RESULT_LOT_FIELDS)
+            if key != 'name'
+        ]
+        rows, location_names = self._stone_quant_rows(quants)
         result = []
-        for q in quants:
-            lot_id = q.lot_id.id if q.lot_id else False
+        for q in rows:
+            lot_id = q['lot_id']
+            loc_id = q['location_id']
             lot_info = lots_data.get(lot_id, {})
-            result.append({
-                'id': q.id,
+            item = {
+                'id': q['id'],
                 'lot_id': [lot_id, lot_info.get('name', '')] if lot_id else False,
-                'location_id': [q.location_id.id, q.location_id.display_name] if q.location_id else False,
-                'quantity': q.quantity,
-                'reserved_quantity': q.reserved_quantity,
-                'x_grosor': lot_info.get('x_grosor', 0) or 0,
-                'x_alto': lot_info.get('x_alto', 0) or 0,
-                'x_ancho': lot_info.get('x_ancho', 0) or 0,
-                'x_peso': lot_info.get('x_peso', 0) or 0,
-                'x_tipo': lot_info.get('x_tipo', '') or '',
-                'x_numero_placa': lot_info.get('x_numero_placa', '') or '',
-                'x_bloque': lot_info.get('x_bloque', '') or '',
-                'x_atado': lot_info.get('x_atado', '') or '',
-                'x_grupo': lot_info.get('x_grupo', '') or '',
-                'x_color': lot_info.get('x_color', '') or '',
-                'x_pedimento': lot_info.get('x_pedimento', '') or '',
-                'x_contenedor': lot_info.get('x_contenedor', '') or '',
-                'x_referencia_proveedor': lot_info.get('x_referencia_proveedor', '') or '',
-                'x_proveedor': lot_info.get('x_proveedor', '') or '',
-                'x_origen': lot_info.get('x_origen', '') or '',
-                'x_fotografia_principal': lot_info.get('x_fotografia_principal', False),
-                'x_tiene_fotografias': lot_info.get('x_tiene_fotografias', False),
-                'x_cantidad_fotos': lot_info.get('x_cantidad_fotos', 0) or 0,
-                'x_detalles_placa': lot_info.get('x_detalles_placa', '') or '',
-            })
+                'location_id': [loc_id, location_names.get(loc_id, '')] if loc_id else False,
+                'quantity': q['quantity'],
+                'reserved_quantity': q['reserved_quantity'],
+            }
+            for key in lot_keys:
+                item[key] = lot_info.get(key) or STONE_LOT_FIELD_DEFAULTS[key]
+            result.append(item)
         return result
 
     @api.model
-    def search_stone_inventory_for_so(self, product_id, filters=None, current_lot_ids=None):
-        _logger.info("[STONE QUANT SEARCH] INICIO - product_id: %s, filters: %s", product_id, filters)
+    def _stone_lot_photo_urls(self, lots):
+        """{lot_id: URL de miniatura o False} para toda la página: los
+        checksums de las fotos se leen en una sola consulta."""
+        urls = dict.fromkeys(lots.ids, False)
+        if 'x_fotografia_principal' not in lots._fields:
+            return urls
+        if 'x_tiene_fotografias' in lots._fields:
+            lots = lots.filtered(lambda lot: (
+                lot.x_tiene_fotografias
+                or ('x_cantidad_fotos' in lot._fields and lot.x_cantidad_fotos)))
+        urls.update(self.env['stone.image.variant']._stone_image_urls(
+            'lot', lots, '128'))
+        return urls
 
+    @api.model
+    def _stone_lot_photo_url(self, lot):
+        return self._stone_lot_photo_urls(lot)[lot.id]
+
+    # Formato COMPACTO (opt-in): en vez de ~25 llaves repetidas por quant
+    # viaja una lista de columnas + filas, y los datos de cada lote y
+    # ubicación una sola vez en diccionarios aparte. Sin base64 de fotos.
+    COMPACT_QUANT_FIELDS = (
+        'id', 'lot_id', 'location_id', 'quantity', 'reserved_quantity')
+    COMPACT_LOT_FIELDS = (
+        'name', 'x_grosor', 'x_alto', 'x_ancho', 'x_peso', 'x_tipo',
+        'x_numero_placa', 'x_bloque', 'x_atado', 'x_grupo', 'x_color',
+        'x_pedimento', 'x_contenedor', 'x_referencia_proveedor',
+        'x_proveedor', 'x_origen', 'x_fotografia_url', 'x_tiene_fotografias',
+        'x_cantidad_fotos', 'x_detalles_placa')
+
+    def _quants_to_compact(self, quants, lots_data, fields=None):
+        lot_fields = self._stone_wanted_lot_fields(
+            fields, self.COMPACT_LOT_FIELDS)
+        lot_fields = [f for f in self.COMPACT_LOT_FIELDS if f in lot_fields]
+        rows_in, location_names = self._stone_quant_rows(quants)
+        rows = []
+        lots = {}
+        locations = {}
+        for q in rows_in:
+            lot_id = q['lot_id']
+            if lot_id and lot_id not in lots:
+                lot_info = lots_data.get(lot_id, {})
+                lots[lot_id] = [
+                    lot_info.get(fname) or COMPACT_LOT_DEFAULTS.get(fname, '')
+                    for fname in lot_fields
+                ]
+            loc_id = q['location_id']
+            if loc_id and loc_id not in locations:
+                locations[loc_id] = location_names.get(loc_id, '')
+            rows.append([q['id'], lot_id, loc_id, q['quantity'], q['reserved_quantity']])
+        return {
+            'compact': True,
+            'fields': list(self.COMPACT_QUANT_FIELDS),
+            'rows': rows,
+            'lot_fields': lot_fields,
+            'lots': lots,
+            'locations': locations,
+        }
+
+    def _stone_serialize_quants(self, quants, compact=False, fields=None):
+        """`fields`: lista blanca de atributos de lote (None = todos)."""
+        lot_ids = quants.mapped('lot_id').ids
+        lots_data = self._build_lots_data(
+            lot_ids, with_photo=not compact, fields=fields)
+        if compact:
+            return self._quants_to_compact(quants, lots_data, fields=fields)
+        return self._quants_to_result(quants, lots_data, fields=fields)
+
+    @api.model
+    def _stone_inventory_domain(self, product_id, filters=None, current_lot_ids=None):
+        """Dominio del selector para un producto: excluye los comprometidos
+        (salvo los que ya trae la línea) y aplica los filtros del popup."""
         if not filters:
             filters = {}
 
@@ -292,43 +658,291 @@ class StockQuant(models.Model):
         committed_lot_ids = self._get_committed_lot_ids(int(product_id))
         excluded_lot_ids = [lid for lid in committed_lot_ids if lid not in safe_current_ids]
 
-        domain = self._build_stone_domain(product_id, filters, safe_current_ids, excluded_lot_ids)
-        quants = self.search(domain, limit=300, order='lot_id')
+        return self._build_stone_domain(product_id, filters, safe_current_ids, excluded_lot_ids)
 
-        lot_ids = quants.mapped('lot_id').ids
-        lots_data = self._build_lots_data(lot_ids)
-        result = self._quants_to_result(quants, lots_data)
+    @api.model
+    def _stone_sort_terms(self, sort, current_lot_ids=None):
+        """[(expresión SQL, dirección)] del orden `sort` (ver
+        STONE_SORT_ORDERS), con los lotes que ya trae la línea primero y
+        los desempates finales (lote por nombre, lote, quant). Sin `sort`
+        (o uno desconocido) solo quedan los desempates: el orden por lote
+        de siempre."""
+        terms = []
+        if STONE_SORT_ORDERS.get(sort):
+            Lot = self.env['stock.lot']
+            current = [x for x in (current_lot_ids or []) if isinstance(x, int)]
+            if current:
+                terms.append((SQL("(q.lot_id = ANY(%s))", current), 'DESC'))
+            for column, direction in STONE_SORT_ORDERS[sort]:
+                alias, fname = column.split('.')
+                model = Lot if alias == 'l' else self
+                if fname not in model._fields or not model._fields[fname].store:
+                    continue
+                terms.append((
+                    SQL("%s.%s", SQL(alias), SQL.identifier(fname)), direction))
+        terms += [(SQL('l.name'), 'ASC'), (SQL('l.id'), 'ASC'), (SQL('q.id'), 'ASC')]
+        return terms
 
-        _logger.info("[STONE QUANT SEARCH] Encontrados: %s quants", len(result))
-        return result
+    @api.model
+    def _stone_keyset_after(self, terms, values):
+        """Condición de las filas que van DESPUÉS de `values` en el orden
+        `terms` (todas las columnas con NULLS LAST): igual en las primeras
+        i-1 llaves y posterior en la i-ésima."""
+        branches = []
+        for index, ((expr, direction), value) in enumerate(zip(terms, values)):
+            if value is None:
+                # Tras un NULL solo vienen NULLs: lo decide la llave siguiente.
+                continue
+            after = SQL(
+                "(%s %s %s OR %s IS NULL)",
+                expr, SQL('<' if direction == 'DESC' else '>'), value, expr)
+            equal = [
+                SQL("%s IS NOT DISTINCT FROM %s", prev_expr, prev_value)
+                for (prev_expr, _dir), prev_value in zip(terms[:index], values[:index])
+            ]
+            branches.append(SQL(" AND ").join(equal + [after]))
+        if not branches:
+            return SQL("FALSE")
+        return SQL("(%s)", SQL(" OR ").join(branches))
 
     @api.model
-    def search_stone_inventory_for_so_paginated(self, product_id, filters=None, current_lot_ids=None, page=0, page_size=35):
-        if not filters:
-            filters = {}
+    def _stone_sorted_rows(self, domain, terms, after=None, limit=None, offset=0):
+        """[(quant_id, llaves del orden)] del dominio en el orden `terms`;
+        con `after` (llaves de la última fila vista) arranca después de
+        ella."""
+        query = self._search(domain)
+        where = SQL("q.id IN %s", query.subselect())
+        if after is not None:
+            where = SQL("%s AND %s", where, self._stone_keyset_after(terms, after))
+        self.env.cr.execute(SQL(
+            """
+            SELECT q.id, %s
+              FROM stock_quant q
+              LEFT JOIN stock_lot l ON l.id = q.lot_id
+             WHERE %s
+             ORDER BY %s
+             LIMIT %s OFFSET %s
+            """,
+            SQL(', ').join(expr for expr, _dir in terms),
+            where,
+            SQL(', ').join(
+                SQL("%s %s NULLS LAST", expr, SQL(direction))
+                for expr, direction in terms),
+            limit, int(offset or 0),
+        ))
+        return [(row[0], list(row[1:])) for row in self.env.cr.fetchall()]
 
-        safe_current_ids = []
-        if current_lot_ids:
-            if isinstance(current_lot_ids, list):
-                safe_current_ids = [x for x in current_lot_ids if isinstance(x, int)]
+    @api.model
+    def _stone_search_sorted(self, domain, sort=None, current_lot_ids=None, limit=None, offset=0):
+        """Quants del dominio en el orden `sort` (ver STONE_SORT_ORDERS).
+        Con orden explícito los lotes que ya trae la línea van primero. Sin
+        `sort` (o uno desconocido) se conserva el orden por lote."""
+        if not STONE_SORT_ORDERS.get(sort):
+            return self.search(domain, limit=limit, offset=offset, order='lot_id')
+        rows = self._stone_sorted_rows(
+            domain, self._stone_sort_terms(sort, current_lot_ids),
+            limit=limit, offset=offset)
+        return self.browse([quant_id for quant_id, _keys in rows])
 
-        committed_lot_ids = self._get_committed_lot_ids(int(product_id))
-        excluded_lot_ids = [lid for lid in committed_lot_ids if lid not in safe_current_ids]
+    @api.model
+    def search_stone_inventory_for_so(self, product_id, filters=None, current_lot_ids=None, compact=False, fields=None, sort=None):
+        """`sort`: 'recency' (bloques más nuevos primero), 'folio', 'alto',
+        'ancho' o 'area'; vacío = por lote, como siempre."""
+        _logger.info("[STONE QUANT SEARCH] INICIO - product_id: %s, filters: %s", product_id, filters)
+
+        domain = self._stone_inventory_domain(product_id, filters, current_lot_ids)
+        quants = self._stone_search_sorted(
+            domain, sort, current_lot_ids, limit=300)
 
-        domain = self._build_stone_domain(product_id, filters, safe_current_ids, excluded_lot_ids)
+        result = self._stone_serialize_quants(quants, compact=compact, fields=fields)
+
+        _logger.info("[STONE QUANT SEARCH] Encontrados: %s quants", len(quants))
+        return result
+
+    @api.model
+    def search_stone_inventory_for_so_paginated(self, product_id, filters=None, current_lot_ids=None, page=0, page_size=35, compact=False, fields=None, sort=None):
+        domain = self._stone_inventory_domain(product_id, filters, current_lot_ids)
 
         total = self.search_count(domain)
 
         offset = int(page) * int(page_size)
-        quants = self.search(domain, limit=int(page_size), offset=offset, order='lot_id')
+        quants = self._stone_search_sorted(
+            domain, sort, current_lot_ids, limit=int(page_size), offset=offset)
 
-        lot_ids = quants.mapped('lot_id').ids
-        lots_data = self._build_lots_data(lot_ids)
-        items = self._quants_to_result(quants, lots_data)
+        items = self._stone_serialize_quants(quants, compact=compact, fields=fields)
 
         _logger.info(
             "[STONE QUANT PAGINATED] product=%s page=%s total=%s got=%s",
-            product_id, page, total, len(items)
+            product_id, page, total, len(quants)
+        )
+
+        return {'items': items, 'total': total}
+
+    # =========================================================================
+    # Facetas (conteos por bloque / atado / tipo / color / ubicación)
+    # =========================================================================
+    # El vendedor adivinaba bloques y atados y cada intento costaba una
+    # búsqueda paginada con su search_count. Aquí, para el mismo dominio del
+    # selector, una sola consulta con GROUPING SETS devuelve cuántos quants
+    # y cuántos m² hay por cada valor.
+
+    @api.model
+    def search_stone_inventory_facets(self, product_id, filters=None, current_lot_ids=None, limit=STONE_FACET_LIMIT):
+        """{'total', 'total_qty', 'facets': {campo: [{'value', 'label',
+        'count', 'qty'}, ...]}} con los valores ordenados por conteo. Cada
+        faceta trae a lo más `limit` valores; atributos que no existen en
+        stock.lot no aparecen."""
+        domain = self._stone_inventory_domain(product_id, filters, current_lot_ids)
+        Lot = self.env['stock.lot']
+        facet_fields = [
+            fname for fname in STONE_FACET_LOT_FIELDS
+            if fname in Lot._fields and Lot._fields[fname].store
+            and Lot._fields[fname].column_type
+        ]
+        columns = [SQL('l.%s', SQL.identifier(fname)) for fname in facet_fields]
+        columns.append(SQL('q.location_id'))
+        keys = facet_fields + ['location_id']
+
+        query = self._search(domain)
+        self.env.cr.execute(SQL(
+            """
+            SELECT GROUPING(%(cols)s), %(cols)s,
+                   COUNT(*), COALESCE(SUM(q.quantity), 0)
+              FROM stock_quant q
+              LEFT JOIN stock_lot l ON l.id = q.lot_id
+             WHERE q.id IN %(ids)s
+             GROUP BY GROUPING SETS (%(sets)s, ())
+            """,
+            cols=SQL(', ').join(columns),
+            ids=query.subselect(),
+            sets=SQL(', ').join(SQL('(%s)', col) for col in columns),
+        ))
+
+        # GROUPING(...) trae un bit por columna (la primera es el más alto);
+        # en 1 = esa columna NO agrupa esta fila.
+        width = len(keys)
+        all_bits = (1 << width) - 1
+        facets = {key: [] for key in keys}
+        total, total_qty = 0, 0.0
+        for row in self.env.cr.fetchall():
+            grouping, values = row[0], row[1:1 + width]
+            count, qty = row[1 + width], row[2 + width]
+            if grouping == all_bits:
+                total, total_qty = count, qty
+                continue
+            idx = next(
+                i for i in range(width)
+                if not grouping & (1 << (width - 1 - i)))
+            facets[keys[idx]].append({
+                'value': values[idx],
+                'count': count,
+                'qty': qty,
+            })
+
+        labels = {
+            key: self._stone_facet_labels(key, [
+                f['value'] for f in facets[key] if f['value'] is not None])
+            for key in keys
+        }
+        for key in keys:
+            entries = sorted(
+                facets[key],
+                key=lambda f: (-f['count'], str(f['value'] or '')))[:int(limit)]
+            for entry in entries:
+                value = entry['value']
+                entry['label'] = labels[key].get(value, '') if value is not None else ''
+                if value is None:
+                    entry['value'] = False
+            facets[key] = entries
+
+        _logger.info(
+            "[STONE QUANT FACETS] product=%s total=%s facets=%s",
+            product_id, total, {k: len(v) for k, v in facets.items()})
+        return {'total': total, 'total_qty': total_qty, 'facets': facets}
+
+    @api.model
+    def _stone_facet_labels(self, key, values):
+        """Etiqueta por valor: nombre de ubicación / many2one, texto de la
+        selección, o el valor tal cual."""
+        if key == 'location_id':
+            locations = self.env['stock.location'].browse(values)
+            return dict(zip(locations.ids, locations.mapped('display_name')))
+        field = self.env['stock.lot']._fields[key]
+        if field.type == 'many2one':
+            records = self.env[field.comodel_name].browse(values)
+            return dict(zip(records.ids, records.mapped('display_name')))
+        if field.type == 'selection':
+            selection = dict(field._description_selection(self.env))
+            return {value: selection.get(value, value) for value in values}
+        return {value: str(value) for value in values}
+
+    # =========================================================================
+    # Paginación por cursor (keyset)
+    # =========================================================================
+    # Con offset, la página N obliga a recorrer y descartar N×35 filas y el
+    # search_count se repetía en cada scroll. Aquí cada página arranca justo
+    # después de la última fila vista — mismo orden que la versión por
+    # offset (`sort`, o lote por nombre si no hay) — y el total solo viaja
+    # con la primera página. El cursor lleva el orden y las llaves de esa
+    # última fila.
+
+    @api.model
+    def _stone_encode_cursor(self, sort, keys):
+        payload = {'sort': sort or False, 'keys': keys}
+        return base64.urlsafe_b64encode(
+            json.dumps(payload, default=str).encode()).decode()
+
+    @api.model
+    def _stone_decode_cursor(self, cursor, sort, terms):
+        """Llaves de la última fila, o None si el cursor no es de este
+        orden (se vuelve a la primera página)."""
+        try:
+            payload = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()).decode())
+            keys = payload['keys']
+            if payload['sort'] != (sort or False) or len(keys) != len(terms):
+                raise ValueError(payload)
+            return keys
+        except (ValueError, TypeError, AttributeError, KeyError):
+            _logger.warning("[STONE QUANT CURSOR] Cursor inválido: %r", cursor)
+            return None
+
+    @api.model
+    def search_stone_inventory_for_so_cursor(self, product_id, filters=None, current_lot_ids=None, cursor=None, page_size=35, compact=False, fields=None, sort=None):
+        """Siguiente página del selector a partir de `cursor` (opaco, lo
+        devuelve la página anterior; vacío = primera página). `sort` como en
+        search_stone_inventory_for_so; debe repetirse en cada página.
+
+        Retorna {'items', 'cursor', 'has_more', 'total'}; 'total' solo se
+        calcula en la primera página (en las demás viene en None). Quants
+        sin lote no entran: no hay placa que seleccionar."""
+        page_size = int(page_size)
+        sort = sort if STONE_SORT_ORDERS.get(sort) else None
+        domain = self._stone_inventory_domain(product_id, filters, current_lot_ids)
+        domain = domain + [('lot_id', '!=', False)]
+        terms = self._stone_sort_terms(sort, current_lot_ids)
+
+        position = self._stone_decode_cursor(cursor, sort, terms) if cursor else None
+        total = None
+        if position is None:
+            total = self.search_count(domain)
+
+        rows = self._stone_sorted_rows(
+            domain, terms, after=position, limit=page_size + 1)
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        quants = self.browse([quant_id for quant_id, _keys in rows])
+
+        items = self._stone_serialize_quants(quants, compact=compact, fields=fields)
+
+        _logger.info(
+            "[STONE QUANT CURSOR] product=%s sort=%s first_page=%s total=%s got=%s more=%s",
+            product_id, sort, position is None, total, len(quants), has_more
         )
 
-        return {'items': items, 'total': total}
\ No newline at end of file
+        return {
+            'items': items,
+            'cursor': self._stone_encode_cursor(sort, rows[-1][1]) if has_more else False,
+            'has_more': has_more,
+            'total': total,
+        }
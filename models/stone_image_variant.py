@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import logging
+
+from odoo import api, fields, models
+from odoo.tools.image import image_process
+from odoo.tools.mimetypes import guess_mimetype
+
+_logger = logging.getLogger(__name__)
+
+# Fotos que sirve el selector: llave de URL → (modelo, campo binario).
+STONE_IMAGE_SOURCES = {
+    'lot': ('stock.lot', 'x_fotografia_principal'),
+    'lot_image': ('stock.lot.image', 'image'),
+}
+STONE_IMAGE_SIZES = {
+    '128': (128, 128),
+    '512': (512, 512),
+    'original': None,
+}
+
+
+class StoneImageVariant(models.AbstractModel):
+    """
+    Miniaturas y previews de las fotos de lotes.
+
+    El lightbox leía hasta 50 fotos a resolución completa en base64 en un
+    solo searchRead: abrir un lote con 30 fotos movía decenas de MB antes
+    de pintar la primera. Aquí cada tamaño (128/512) se genera la primera
+    vez que se pide y queda guardado como ir.attachment del registro; el
+    controlador lo sirve con ETag para que el navegador lo cachee.
+    """
+    _name = 'stone.image.variant'
+    _description = 'Variantes de Imagen de Lotes (Selección de Piedra)'
+
+    @api.model
+    def _stone_variant_name(self, field_name, size):
+        return 'stone_%s_%s' % (field_name, size)
+
+    @api.model
+    def _stone_variant_res_field(self, field_name, size):
+        """res_field de la variante: campo fuente + tamaño. Con res_field el
+        adjunto no aparece en el chatter del lote; no puede ser el nombre
+        exacto del campo porque ese lo usa el ORM para guardar el binario."""
+        return '%s_stone_%s' % (field_name, size)
+
+    @api.model
+    def _stone_source_checksums(self, records, field_name):
+        """{id: checksum} del binario fuente de `records`, en bloque.
+        write_date del lote no cambia cuando la foto principal se recalcula
+        desde stock.lot.image, así que la variante se identifica por el
+        contenido, no por la fecha: con campo en adjunto se usa su checksum
+        (un solo search_read, sin leer binarios); si no, se calcula sobre
+        el valor."""
+        checksums = dict.fromkeys(records.ids, '')
+        if not records:
+            return checksums
+        field = records._fields[field_name]
+        if getattr(field, 'attachment', False) and field.store:
+            for row in self.env['ir.attachment'].sudo().search_read([
+                ('res_model', '=', records._name),
+                ('res_id', 'in', records.ids),
+                ('res_field', '=', field_name),
+            ], ['res_id', 'checksum']):
+                checksums[row['res_id']] = row['checksum'] or ''
+            return checksums
+        for record in records.sudo().with_context(bin_size=False):
+            value = record[field_name]
+            if not value:
+                continue
+            if isinstance(value, str):
+                value = value.encode()
+            checksums[record.id] = hashlib.sha1(value).hexdigest()
+        return checksums
+
+    @api.model
+    def _stone_variant_etag(self, record, field_name, size, checksum=None):
+        if checksum is None:
+            checksum = self._stone_source_checksums(record, field_name)[record.id]
+        key = '%s:%s:%s:%s:%s' % (
+            record._name, record.id, field_name, size, checksum)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @api.model
+    def _stone_find_variant(self, record, field_name, size):
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', record._name),
+            ('res_id', '=', record.id),
+            ('res_field', '=', self._stone_variant_res_field(field_name, size)),
+        ], limit=1)
+
+    @api.model
+    def _stone_get_variant(self, record, field_name, size):
+        """(contenido, mimetype, etag) del tamaño pedido, o None si el
+        registro no tiene foto. El registro ya viene con acceso validado."""
+        if size not in STONE_IMAGE_SIZES or field_name not in record._fields:
+            return None
+        etag = self._stone_variant_etag(record, field_name, size)
+        record = record.sudo()
+
+        cached = None
+        if size != 'original':
+            cached = self._stone_find_variant(record, field_name, size)
+            if cached and cached.description == etag:
+                return cached.raw, cached.mimetype, etag
+            # Dos primeras peticiones simultáneas de la misma variante: la
+            # segunda espera a la primera y reutiliza lo que generó en vez de
+            # crear un adjunto duplicado.
+            self.env.cr.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                ('stone_image_variant:%s:%s:%s:%s' % (
+                    record._name, record.id, field_name, size),))
+            cached = self._stone_find_variant(record, field_name, size)
+            if cached and cached.description == etag:
+                return cached.raw, cached.mimetype, etag
+
+        source = record[field_name]
+        if not source:
+            return None
+        raw = base64.b64decode(source)
+        if size == 'original':
+            return raw, guess_mimetype(raw, default='image/jpeg'), etag
+
+        try:
+            content = image_process(raw, size=STONE_IMAGE_SIZES[size])
+        except Exception:
+            _logger.warning(
+                '[STONE IMAGE] No se pudo generar %s de %s,%s; se sirve el '
+                'original.', size, record._name, record.id)
+            return raw, guess_mimetype(raw, default='image/jpeg'), etag
+        mimetype = guess_mimetype(content, default='image/jpeg')
+
+        vals = {
+            'name': self._stone_variant_name(field_name, size),
+            'res_model': record._name,
+            'res_id': record.id,
+            'res_field': self._stone_variant_res_field(field_name, size),
+            'raw': content,
+            'mimetype': mimetype,
+            'description': etag,
+        }
+        if cached:
+            cached.write(vals)
+        else:
+            self.env['ir.attachment'].sudo().create(vals)
+        return content, mimetype, etag
+
+    @api.model
+    def _stone_image_urls(self, source_key, records, size='128'):
+        """{id: URL} de la miniatura de cada registro; los checksums de
+        toda la página se leen de una vez."""
+        model_name, field_name = STONE_IMAGE_SOURCES[source_key]
+        checksums = self._stone_source_checksums(records, field_name)
+        return {
+            record.id: '/sale_stone_selection/image/%s/%s/%s?unique=%s' % (
+                source_key, record.id, size,
+                self._stone_variant_etag(
+                    record, field_name, size, checksums[record.id])[:12])
+            for record in records
+        }
+
+    @api.model
+    def _stone_image_url(self, source_key, record, size='128'):
+        return self._stone_image_urls(source_key, record, size)[record.id]
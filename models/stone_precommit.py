@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+
+# Buffers de precommit de este módulo (cr.precommit.data) que registran
+# trabajo diferido de la transacción. Si un savepoint se revierte, lo que
+# se encoló dentro de él debe desaparecer con él.
+STONE_PRECOMMIT_BUFFERS = (
+    'stone_sale_line_sync',
+    'stone_assignment_log',
+)
+
+
+@contextmanager
+def stone_savepoint(cr, flush=True):
+    """cr.savepoint() que además regresa los buffers de precommit del
+    módulo a su marca de entrada cuando el bloque se revierte. Lo encolado
+    ANTES del savepoint se conserva."""
+    data = cr.precommit.data
+    marks = {}
+    for key in STONE_PRECOMMIT_BUFFERS:
+        buffer = data.get(key)
+        if isinstance(buffer, list):
+            marks[key] = len(buffer)
+        elif isinstance(buffer, dict):
+            marks[key] = dict(buffer)
+        else:
+            marks[key] = None
+    try:
+        with cr.savepoint(flush=flush):
+            yield
+    except Exception:
+        for key, mark in marks.items():
+            buffer = data.get(key)
+            if buffer is None:
+                continue
+            if isinstance(buffer, list):
+                del buffer[mark or 0:]
+            else:
+                buffer.clear()
+                if mark:
+                    buffer.update(mark)
+        raise
@@ -1,6 +1,11 @@
 /** @odoo-module */
 import { Component, useState, onWillStart, onWillUpdateProps } from "@odoo/owl";
 import { useService } from "@web/core/utils/hooks";
+import { expandStoneInventory } from "@sale_stone_selection/js/stone_inventory_payload";
+
+const GRID_LOT_FIELDS = [
+    "x_grosor", "x_alto", "x_ancho", "x_bloque", "x_tipo", "x_color", "x_pedimento",
+];
 
 export class StoneGrid extends Component {
     setup() {
@@ -23,21 +28,19 @@ export class StoneGrid extends Component {
     async loadStock() {
         this.state.isLoading = true;
         try {
-            const domain = [
-                ['product_id', '=', this.props.productId],
-                ['location_id.usage', '=', 'internal'],
-                ['quantity', '>', 0]
-            ];
-
-            const fields = [
-                'lot_id', 'location_id', 'quantity', 'reserved_quantity',
-                'x_grosor', 'x_alto', 'x_ancho', 'x_bloque', 'x_tipo',
-                'x_color', 'x_pedimento'
-            ];
-
-            const quants = await this.orm.searchRead('stock.quant', domain, fields);
+            // Mismo endpoint y orden que el grid de moves: bloques más
+            // recientes primero (lo ordena el servidor), seleccionados al
+            // inicio.
+            const quants = expandStoneInventory(await this.orm.call(
+                "stock.quant", "search_stone_inventory_for_so", [], {
+                    product_id: this.props.productId,
+                    current_lot_ids: Array.from(this.state.selectedLotIds),
+                    compact: true,
+                    fields: GRID_LOT_FIELDS,
+                    sort: "recency",
+                }));
 
-            this.state.details = quants.map(q => ({
+            this.state.details = (quants || []).map(q => ({
                 id: q.id,
                 lot_id: q.lot_id ? q.lot_id[0] : false,
                 lot_name: q.lot_id ? q.lot_id[1] : 'Sin Lote',
@@ -62,47 +65,21 @@ export class StoneGrid extends Component {
         }
     }
 
-    // Recencia del bloque (misma regla del Inventario Visual): serie
-    // S<edad> = lo más reciente (número mayor = más nuevo); folios
-    // numéricos después (mayor = más nuevo); sin folio al final.
-    _blockRecency(name) {
-        const s = String(name || "").trim().toUpperCase();
-        const m = s.match(/^S\s*-?(\d+)/);
-        if (m) {
-            return [2, parseInt(m[1], 10)];
-        }
-        const n = parseInt(s, 10);
-        if (!isNaN(n)) {
-            return [1, n];
-        }
-        return [0, 0];
-    }
-
+    // Bloques en el orden en que llegan del servidor (Map: un bloque
+    // numérico como llave de objeto se reordenaría solo).
     get groupedDetails() {
-        const groups = {};
+        const groups = new Map();
         for (const detail of this.state.details) {
             const blockName = detail.bloque;
-            if (!groups[blockName]) {
-                groups[blockName] = { blockName, items: [], totalArea: 0, count: 0 };
+            if (!groups.has(blockName)) {
+                groups.set(blockName, { blockName, items: [], totalArea: 0, count: 0 });
             }
-            groups[blockName].items.push(detail);
-            groups[blockName].count++;
-            groups[blockName].totalArea += detail.quantity;
+            const group = groups.get(blockName);
+            group.items.push(detail);
+            group.count++;
+            group.totalArea += detail.quantity;
         }
-        const out = Object.values(groups);
-        // Placas dentro del bloque: orden natural ascendente (S26-01,
-        // S26-02, ... S26-10 — no el orden de llegada del search).
-        for (const g of out) {
-            g.items.sort((a, b) => String(a.lot_name).localeCompare(
-                String(b.lot_name), "es", { numeric: true }));
-        }
-        // Bloques: del MÁS NUEVO al más viejo, como el Inventario Visual.
-        return out.sort((a, b) => {
-            const ka = this._blockRecency(a.blockName);
-            const kb = this._blockRecency(b.blockName);
-            return (kb[0] - ka[0]) || (kb[1] - ka[1])
-                || String(a.blockName).localeCompare(String(b.blockName));
-        });
+        return Array.from(groups.values());
     }
 
     toggleSelection(detail) {
@@ -11,8 +11,15 @@ import {
     onWillUnmount,
 } from "@odoo/owl";
 import { useService } from "@web/core/utils/hooks";
+import { expandStoneInventory } from "@sale_stone_selection/js/stone_inventory_payload";
 
 const AUTO_OPEN_STONE_SELECTOR_KEY = "stock_transit_allocation.auto_open_stone_selector";
+// Atributos de lote que pinta el popup del selector (lista blanca del RPC:
+// el servidor solo lee estas columnas).
+const SELECTOR_LOT_FIELDS = [
+    "x_bloque", "x_atado", "x_alto", "x_ancho", "x_grosor", "x_tipo",
+    "x_color", "x_fotografia_url", "x_cantidad_fotos",
+];
 
 const STATUS_CLASS_MAP = {
     delivered: "stone-tag-delivered",
@@ -25,6 +32,43 @@ const STATUS_CLASS_MAP = {
     pending: "stone-tag-pending",
 };
 
+// Snapshots de línea AGRUPADOS: las líneas que piden su snapshot en el
+// mismo tick (p. ej. al desplegar varias) viajan en UNA sola llamada a
+// sale.order.line.get_stone_line_snapshot.
+const snapshotQueue = { waiters: [], timer: null, orm: null };
+
+function requestLineSnapshot(orm, lineId) {
+    return new Promise((resolve, reject) => {
+        snapshotQueue.waiters.push({ lineId, resolve, reject });
+        snapshotQueue.orm = orm;
+        if (!snapshotQueue.timer) {
+            snapshotQueue.timer = setTimeout(flushLineSnapshots, 0);
+        }
+    });
+}
+
+async function flushLineSnapshots() {
+    const { waiters, orm } = snapshotQueue;
+    snapshotQueue.waiters = [];
+    snapshotQueue.timer = null;
+    const ids = [...new Set(waiters.map((w) => w.lineId))];
+    try {
+        const result = (await orm.call(
+            "sale.order.line", "get_stone_line_snapshot", [ids])) || {};
+        for (const w of waiters) {
+            w.resolve(result[w.lineId] || null);
+        }
+    } catch (e) {
+        for (const w of waiters) {
+            w.reject(e);
+        }
+    }
+}
+
+// Un snapshot pedido justo después de un write sirve para el repintado
+// inmediato; más viejo que esto se vuelve a pedir.
+const SNAPSHOT_REUSE_MS = 2000;
+
 export class StoneExpandButton extends Component {
     static template = "sale_stone_selection.StoneExpandButton";
     static props = { ...standardFieldProps };
@@ -413,11 +457,22 @@ export class StoneExpandButton extends Component {
      * que la línea lo muestre al instante y para que un guardado posterior del
      * formulario no reescriba el valor viejo encima del derivado.
      */
-    async _refreshRequestedQtyFromServer() {
+    async _refreshRequestedQtyFromServer(opts = {}) {
         const recordId = this._getRecordId();
         if (!recordId || typeof recordId !== "number" || recordId <= 0) {
             return;
         }
+        // Tras cambiar la selección viene un repintado: el snapshot trae
+        // Solicitado + estatus + empaque en el mismo viaje y el repintado
+        // lo reutiliza.
+        if (opts.snapshot) {
+            const snap = await this._loadLineSnapshot();
+            if (snap) {
+                await this._applyServerRequestedQty(snap.product_uom_qty || 0);
+                this._freshSnapshot = { snap, at: Date.now() };
+                return;
+            }
+        }
         try {
             const rows = await this.orm.read(
                 "sale.order.line",
@@ -427,16 +482,65 @@ export class StoneExpandButton extends Component {
             if (!rows || !rows.length) {
                 return;
             }
-            const serverQty = rows[0].product_uom_qty || 0;
-            const currentQty = this._getRequestedQty();
-            if (Math.abs(serverQty - currentQty) > 0.000001) {
-                await this.props.record.update({ product_uom_qty: serverQty });
-            }
+            await this._applyServerRequestedQty(rows[0].product_uom_qty || 0);
         } catch (e) {
             console.warn("[STONE] No se pudo refrescar la cantidad solicitada:", e);
         }
     }
 
+    async _applyServerRequestedQty(serverQty) {
+        const currentQty = this._getRequestedQty();
+        if (Math.abs(serverQty - currentQty) > 0.000001) {
+            await this.props.record.update({ product_uom_qty: serverQty });
+        }
+    }
+
+    /**
+     * Empaque, estatus completo por lote y Solicitado de la línea en un solo
+     * RPC (agrupado con otras líneas del mismo tick). Deja el empaque en
+     * caché. Solicitado NO se aplica aquí: solo tras escribir la selección
+     * (_refreshRequestedQtyFromServer), para no pisar una cantidad editada
+     * y aún sin guardar (p. ej. 'Mandar a pedir').
+     */
+    async _loadLineSnapshot() {
+        if (this.isSelectionLocked()) {
+            return null;
+        }
+        const recordId = this._getRecordId();
+        if (!recordId || typeof recordId !== "number" || recordId <= 0) {
+            return null;
+        }
+        try {
+            const snap = await requestLineSnapshot(this.orm, recordId);
+            if (!snap) {
+                return null;
+            }
+            const data = this.props?.record?.data || {};
+            const directQpp = this._parseFloatField(data.qty_per_pack);
+            if (!(data.has_standard_pack && directQpp > 0) && snap.pack) {
+                const qpp = this._parseFloatField(snap.pack.qty_per_pack);
+                this._packInfo = {
+                    hasPack: !!snap.pack.has_pack && qpp > 0,
+                    qtyPerPack: qpp,
+                    packId: this._extractM2oId(data.standard_pack_id),
+                };
+            }
+            return snap;
+        } catch (e) {
+            console.warn("[STONE] No se pudo cargar el snapshot de la línea:", e);
+            return null;
+        }
+    }
+
+    _takeFreshSnapshot() {
+        const fresh = this._freshSnapshot;
+        this._freshSnapshot = null;
+        if (fresh && Date.now() - fresh.at < SNAPSHOT_REUSE_MS) {
+            return fresh.snap;
+        }
+        return null;
+    }
+
     /**
      * Persiste lot_ids + breakdown de inmediato al backend SIN recargar la página.
      * 1. Actualiza el record en memoria para mantener coherente la orden y el popup.
@@ -502,7 +606,7 @@ export class StoneExpandButton extends Component {
                 x_lot_breakdown_json: breakdown,
             });
             // Sin 'Mandar a pedir', el backend iguala Solicitado a la suma de placas.
-            await this._refreshRequestedQtyFromServer();
+            await this._refreshRequestedQtyFromServer({ snapshot: true });
         } else {
             // Línea aún no guardada: el record es la única fuente, con su
             // onchange normal.
@@ -605,7 +709,7 @@ export class StoneExpandButton extends Component {
         this._lightboxRoot.className = "stone-lightbox-root";
         document.body.appendChild(this._lightboxRoot);
 
-        const initialSrc = mainPhoto ? `data:image/jpeg;base64,${mainPhoto}` : null;
+        const initialSrc = this._photoSrc(mainPhoto) || null;
 
         this._lightboxRoot.innerHTML = `
             <div class="stone-lightbox-overlay" id="slb-overlay">
@@ -658,10 +762,13 @@ export class StoneExpandButton extends Component {
         this._lightboxKeyHandler = keyHandler;
 
         try {
+            // Solo metadatos: las imágenes viajan por URL cacheable
+            // (miniatura 128 en la tira, preview 512 al mostrar, original
+            // solo si se pide), una a la vez y nunca en base64.
             const photos = await this.orm.searchRead(
                 "stock.lot.image",
                 [["lot_id", "=", lotId]],
-                ["id", "name", "image", "notas", "fecha_captura"],
+                ["id", "name", "notas", "fecha_captura", "write_date"],
                 { order: "sequence, id", limit: 50 }
             );
 
@@ -683,9 +790,9 @@ export class StoneExpandButton extends Component {
             const showPhoto = (idx) => {
                 currentIdx = idx;
                 const photo = photos[idx];
-                const src = `data:image/jpeg;base64,${photo.image}`;
+                const src = this._lotImageUrl(photo, "512");
                 bodyEl.innerHTML = `
-                    <img src="${src}" class="stone-lightbox-img" id="slb-main-img"/>
+                    <img src="${src}" class="stone-lightbox-img" id="slb-main-img" title="Clic para ver en resolución original"/>
                     <div class="stone-lightbox-info" id="slb-info">
                         <strong>${this._escapeHtml(photo.name || "")}</strong>
                         ${photo.notas ? `<span class="ms-3 text-muted">${this._escapeHtml(photo.notas)}</span>` : ""}
@@ -693,6 +800,13 @@ export class StoneExpandButton extends Component {
                     </div>`;
                 counterEl.textContent = `(${idx + 1} / ${photos.length})`;
 
+                const mainImg = bodyEl.querySelector("#slb-main-img");
+                mainImg.addEventListener("click", () => {
+                    mainImg.src = this._lotImageUrl(photo, "original");
+                    mainImg.style.cursor = "default";
+                }, { once: true });
+                mainImg.style.cursor = "zoom-in";
+
                 thumbsEl.querySelectorAll(".stone-lightbox-thumb").forEach((th, i) => {
                     th.classList.toggle("active", i === idx);
                 });
@@ -702,8 +816,8 @@ export class StoneExpandButton extends Component {
                 navEl.style.display = "flex";
                 let thumbsHtml = "";
                 for (let i = 0; i < photos.length; i++) {
-                    const src = `data:image/jpeg;base64,${photos[i].image}`;
-                    thumbsHtml += `<img src="${src}" class="stone-lightbox-thumb ${i === 0 ? "active" : ""}" data-idx="${i}"/>`;
+                    const src = this._lotImageUrl(photos[i], "128");
+                    thumbsHtml += `<img src="${src}" class="stone-lightbox-thumb ${i === 0 ? "active" : ""}" data-idx="${i}" loading="lazy"/>`;
                 }
                 thumbsEl.innerHTML = thumbsHtml;
 
@@ -731,6 +845,21 @@ export class StoneExpandButton extends Component {
         }
     }
 
+    // Miniatura de la foto principal del lote para el respaldo sin snapshot
+    // (el servidor arma la suya con el checksum; aquí basta write_date).
+    _lotThumbUrl(lot) {
+        if (!lot.x_cantidad_fotos) {
+            return false;
+        }
+        const unique = String(lot.write_date || "").replace(/\D/g, "");
+        return `/sale_stone_selection/image/lot/${lot.id}/128?unique=${unique}`;
+    }
+
+    _lotImageUrl(photo, size) {
+        const unique = String(photo.write_date || "").replace(/\D/g, "");
+        return `/sale_stone_selection/image/lot_image/${photo.id}/${size}?unique=${unique}`;
+    }
+
     _destroyLightbox() {
         if (this._lightboxKeyHandler) {
             document.removeEventListener("keydown", this._lightboxKeyHandler);
@@ -742,12 +871,21 @@ export class StoneExpandButton extends Component {
         }
     }
 
-    _renderPhotoCell(photoBase64, photoCount, lotId, lotName) {
+    // La foto puede llegar como base64 (formato clásico) o como URL de
+    // miniatura cacheable (formato compacto).
+    _photoSrc(photo) {
+        if (!photo) return false;
+        // Ojo: un base64 JPEG empieza con "/9j/" — solo rutas conocidas.
+        if (/^(data:|https?:|\/web\/|\/sale_stone_selection\/)/.test(photo)) return photo;
+        return `data:image/jpeg;base64,${photo}`;
+    }
+
+    _renderPhotoCell(photo, photoCount, lotId, lotName) {
         const safeName = this._escapeHtml(lotName);
-        if (photoBase64) {
+        if (photo) {
             const badge = photoCount > 1 ? `<span class="stone-photo-count">${photoCount}</span>` : "";
             return `<div class="stone-photo-cell" data-lot-id="${lotId}" data-lot-name="${safeName}" data-has-photo="1">
-                        <img src="data:image/jpeg;base64,${photoBase64}" class="stone-photo-thumb" alt="Foto"/>
+                        <img src="${this._escapeHtml(this._photoSrc(photo))}" class="stone-photo-thumb" alt="Foto" loading="lazy"/>
                         ${badge}
                     </div>`;
         }
@@ -770,6 +908,8 @@ export class StoneExpandButton extends Component {
                 let mainPhoto = false;
                 if (img && img.src.startsWith("data:")) {
                     mainPhoto = img.src.replace(/^data:image\/\w+;base64,/, "");
+                } else if (img) {
+                    mainPhoto = img.getAttribute("src");
                 }
                 this.openLightbox(lotId, lotName, mainPhoto);
             });
@@ -921,6 +1061,12 @@ export class StoneExpandButton extends Component {
         container.innerHTML = `<div class="stone-table-loading"><i class="fa fa-circle-o-notch fa-spin me-1"></i> Cargando...</div>`;
 
         try {
+            const snap = this._takeFreshSnapshot() || await this._loadLineSnapshot();
+            if (snap) {
+                this._renderSelectedTableFromFullStatus(container, snap.lots || []);
+                return;
+            }
+
             await this._ensurePackInfo();
             const fullStatus = await this._loadFullStatus();
 
@@ -988,7 +1134,7 @@ export class StoneExpandButton extends Component {
             const inputStep = tipo === "pieza" ? "1" : "0.01";
 
             const photoCell = this._renderPhotoCell(
-                item.x_fotografia_principal,
+                item.x_fotografia_url || item.x_fotografia_principal,
                 item.x_cantidad_fotos || 0,
                 item.lot_id,
                 item.lot_name
@@ -1157,7 +1303,7 @@ export class StoneExpandButton extends Component {
                 "stock.lot",
                 [["id", "in", lotIds]],
                 ["name", "x_bloque", "x_atado", "x_alto", "x_ancho", "x_grosor", "x_tipo", "x_color",
-                 "x_fotografia_principal", "x_cantidad_fotos"],
+                 "x_cantidad_fotos", "write_date"],
                 { limit: lotIds.length }
             ),
             this.orm.searchRead(
@@ -1211,7 +1357,9 @@ export class StoneExpandButton extends Component {
                 x_ancho: lot.x_ancho || 0,
                 x_grosor: lot.x_grosor || 0,
                 x_color: lot.x_color || "",
-                x_fotografia_principal: lot.x_fotografia_principal || false,
+                // Sin base64 también en el respaldo: miniatura por URL.
+                x_fotografia_principal: false,
+                x_fotografia_url: this._lotThumbUrl(lot),
                 x_cantidad_fotos: lot.x_cantidad_fotos || 0,
                 status_badges: [{ type: "pending", label: "Pendiente", icon: "fa-clock-o" }],
                 is_locked: false,
@@ -1402,85 +1550,6 @@ export class StoneExpandButton extends Component {
         }
     }
 
-    async _computeTotalQty(lotIds, breakdown, quantsCache = null) {
-        if (!lotIds || lotIds.length === 0) return 0;
-
-        let qtyMap = {};
-
-        if (quantsCache) {
-            for (const q of quantsCache) {
-                const lid = q.lot_id ? q.lot_id[0] : 0;
-                if (lid && lotIds.includes(lid)) {
-                    qtyMap[lid] = { qty: q.quantity || 0, tipo: (q.x_tipo || "placa").toLowerCase() };
-                }
-            }
-        }
-
-        const missingIds = lotIds.filter((id) => !qtyMap[id]);
-        if (missingIds.length > 0) {
-            try {
-                const [lotsData, quants] = await Promise.all([
-                    this.orm.searchRead(
-                        "stock.lot",
-                        [["id", "in", missingIds]],
-                        ["id", "x_tipo"],
-                        { limit: missingIds.length }
-                    ),
-                    this.orm.searchRead(
-                        "stock.quant",
-                        [
-                            ["lot_id", "in", missingIds],
-                            ["location_id.usage", "=", "internal"],
-                            ["quantity", ">", 0],
-                        ],
-                        ["lot_id", "quantity"],
-                        { limit: missingIds.length * 2 }
-                    ),
-                ]);
-
-                const tipoMap = {};
-                for (const l of lotsData) {
-                    tipoMap[l.id] = (l.x_tipo || "placa").toLowerCase();
-                }
-
-                for (const q of quants) {
-                    const lid = q.lot_id[0];
-                    const prevQty = qtyMap[lid]?.qty || 0;
-                    qtyMap[lid] = {
-                        qty: prevQty + q.quantity,
-                        tipo: tipoMap[lid] || "placa",
-                    };
-                }
-
-                for (const lid of missingIds) {
-                    if (!qtyMap[lid]) {
-                        qtyMap[lid] = { qty: 0, tipo: tipoMap[lid] || "placa" };
-                    }
-                }
-            } catch (e) {
-                console.error("[STONE] Error calculando qty total:", e);
-            }
-        }
-
-        let total = 0;
-        for (const lid of lotIds) {
-            const info = qtyMap[lid];
-            if (!info) continue;
-
-            const tipo = info.tipo;
-            const lotIdStr = String(lid);
-            const isPartial = tipo === "formato" || tipo === "pieza";
-
-            if (isPartial && breakdown[lotIdStr] !== undefined) {
-                total += parseFloat(breakdown[lotIdStr]) || 0;
-            } else {
-                total += info.qty;
-            }
-        }
-
-        return total;
-    }
-
     openPopup() {
         if (this.isSelectionLocked()) {
             this._warnQuoteSelectionBlocked();
@@ -1499,7 +1568,8 @@ export class StoneExpandButton extends Component {
     }
 
     async _loadPopupStatusMap() {
-        const fullStatus = await this._loadFullStatus();
+        const snap = await this._loadLineSnapshot();
+        const fullStatus = snap ? snap.lots : await this._loadFullStatus();
         if (!fullStatus) return new Map();
         const m = new Map();
         for (const item of fullStatus) {
@@ -1513,8 +1583,8 @@ export class StoneExpandButton extends Component {
         const PAGE_SIZE = 35;
         const self = this;
 
-        await this._ensurePackInfo();
         const statusMap = await this._loadPopupStatusMap();
+        await this._ensurePackInfo();
 
         const state = {
             quants: [],
@@ -1523,6 +1593,11 @@ export class StoneExpandButton extends Component {
             isLoading: false,
             isLoadingMore: false,
             page: 0,
+            cursor: false,
+            // Orden del servidor (STONE_SORT_ORDERS), el mismo de los grids:
+            // bloques más recientes primero, asignados al inicio.
+            sort: "recency",
+            cursorLotIds: [],
             pendingIds: new Set(this.getCurrentLotIds()),
             pendingBreakdown: { ...this.getBreakdown() },
             requestedQty: this._getRequestedQty(),
@@ -1596,11 +1671,13 @@ export class StoneExpandButton extends Component {
                         </div>
                         <div class="stone-filter-group">
                             <label>Bloque</label>
-                            <input type="text" class="stone-filter-input" id="sf-bloque" placeholder="Bloque..."/>
+                            <input type="text" class="stone-filter-input" id="sf-bloque" placeholder="Bloque..." list="sf-bloque-facets" autocomplete="off"/>
+                            <datalist id="sf-bloque-facets"></datalist>
                         </div>
                         <div class="stone-filter-group">
                             <label>Atado</label>
-                            <input type="text" class="stone-filter-input" id="sf-atado" placeholder="Atado..."/>
+                            <input type="text" class="stone-filter-input" id="sf-atado" placeholder="Atado..." list="sf-atado-facets" autocomplete="off"/>
+                            <datalist id="sf-atado-facets"></datalist>
                         </div>
                         <div class="stone-filter-group">
                             <label>Alto mín.</label>
@@ -1977,7 +2054,7 @@ export class StoneExpandButton extends Component {
                 }
 
                 const photoCell = self._renderPhotoCell(
-                    q.x_fotografia_principal || false,
+                    q.x_fotografia_url || q.x_fotografia_principal || false,
                     q.x_cantidad_fotos || 0,
                     lotId,
                     lotName
@@ -2175,19 +2252,31 @@ export class StoneExpandButton extends Component {
 
             try {
                 let result;
+                // El cursor guarda el orden de la primera página: los
+                // asignados se congelan ahí para que las llaves no cambien
+                // a mitad del scroll.
+                if (reset || page === 0) {
+                    state.cursorLotIds = Array.from(state.pendingIds);
+                }
                 try {
+                    // Paginación por cursor: cada página cuesta lo mismo que
+                    // la primera y el total solo viaja con la página 0.
                     result = await self.orm.call(
                         "stock.quant",
-                        "search_stone_inventory_for_so_paginated",
+                        "search_stone_inventory_for_so_cursor",
                         [],
                         {
                             product_id: productId,
                             filters: state.filters,
-                            current_lot_ids: Array.from(state.pendingIds),
-                            page,
+                            current_lot_ids: state.cursorLotIds,
+                            cursor: (reset || page === 0) ? false : state.cursor,
                             page_size: PAGE_SIZE,
+                            compact: true,
+                            fields: SELECTOR_LOT_FIELDS,
+                            sort: state.sort,
                         }
                     );
+                    result.items = expandStoneInventory(result.items);
                 } catch (_e) {
                     const all = (await self.orm.call(
                         "stock.quant",
@@ -2196,7 +2285,8 @@ export class StoneExpandButton extends Component {
                         {
                             product_id: productId,
                             filters: state.filters,
-                            current_lot_ids: Array.from(state.pendingIds),
+                            current_lot_ids: state.cursorLotIds,
+                            sort: state.sort,
                         }
                     )) || [];
                     result = {
@@ -2209,13 +2299,19 @@ export class StoneExpandButton extends Component {
                 cacheQuantListForTotals(items);
 
                 if (reset || page === 0) {
+                    loadFacets();
                     state.quants = items;
                 } else {
                     state.quants = [...state.quants, ...items];
                 }
-                state.totalCount = result.total || 0;
+                if (result.total !== null && result.total !== undefined) {
+                    state.totalCount = result.total || 0;
+                }
                 state.page = page;
-                state.hasMore = state.quants.length < state.totalCount;
+                state.cursor = result.cursor || false;
+                state.hasMore = ("has_more" in result)
+                    ? !!result.has_more
+                    : state.quants.length < state.totalCount;
 
                 await ensureQtyCacheForPending();
             } catch (err) {
@@ -2277,6 +2373,39 @@ export class StoneExpandButton extends Component {
         document.addEventListener("keydown", onKeyDown);
         this._popupKeyHandler = onKeyDown;
 
+        // Facetas: bloques y atados disponibles (con conteo y m²) como
+        // sugerencias de los filtros de texto. Se piden SIN el propio filtro
+        // de bloque/atado para que las opciones no se reduzcan a lo tecleado.
+        let facetsSeq = 0;
+        const loadFacets = async () => {
+            const seq = ++facetsSeq;
+            const facetFilters = { ...state.filters, bloque: "", atado: "" };
+            let result;
+            try {
+                result = await self.orm.call(
+                    "stock.quant",
+                    "search_stone_inventory_facets",
+                    [],
+                    {
+                        product_id: productId,
+                        filters: facetFilters,
+                        current_lot_ids: Array.from(state.pendingIds),
+                    }
+                );
+            } catch (_e) {
+                return;
+            }
+            if (seq !== facetsSeq || !result) return;
+            for (const [key, fname] of [["bloque", "x_bloque"], ["atado", "x_atado"]]) {
+                const list = root.querySelector(`#sf-${key}-facets`);
+                if (!list) continue;
+                list.innerHTML = ((result.facets || {})[fname] || [])
+                    .filter((f) => f.value)
+                    .map((f) => `<option value="${self._escapeHtml(f.label)}">${f.count} · ${self._fmt(f.qty)} m²</option>`)
+                    .join("");
+            }
+        };
+
         const bindFilter = (id, key) => {
             const input = root.querySelector(`#${id}`);
             if (!input) return;
@@ -2,8 +2,15 @@
 import { registry } from "@web/core/registry";
 import { standardFieldProps } from "@web/views/fields/standard_field_props";
 import { useService } from "@web/core/utils/hooks";
+import { expandStoneInventory } from "@sale_stone_selection/js/stone_inventory_payload";
 import { Component, useState, onWillStart, onWillUpdateProps } from "@odoo/owl";
 
+// Atributos de lote que muestra el grid (lista blanca del RPC).
+const GRID_LOT_FIELDS = [
+    "x_bloque", "x_atado", "x_tipo", "x_alto", "x_ancho", "x_grosor",
+    "x_color", "x_pedimento", "x_origen", "x_detalles_placa",
+];
+
 export class StoneMoveGridField extends Component {
     setup() {
         this.orm = useService("orm");
@@ -109,11 +116,16 @@ export class StoneMoveGridField extends Component {
         const assignedLotsData = this._getAssignedLotsData(currentProps);
 
         try {
-            const quants = await this.orm.call('stock.quant', 'search_stone_inventory_for_so', [], {
+            const quants = expandStoneInventory(await this.orm.call('stock.quant', 'search_stone_inventory_for_so', [], {
                 product_id: productId,
                 filters: this.state.filters,
-                current_lot_ids: assignedLotIds
-            });
+                current_lot_ids: assignedLotIds,
+                compact: true,
+                fields: GRID_LOT_FIELDS,
+                // Asignados primero y bloques más recientes: lo ordena el
+                // servidor, así el tope de 300 trae los bloques correctos.
+                sort: 'recency'
+            }));
 
             const quantsMap = new Map();
             for (const q of (quants || [])) {
@@ -168,13 +180,7 @@ export class StoneMoveGridField extends Component {
     }
 
     get allItems() {
-        return [...this.state.quants].sort((a, b) => {
-            if (a._isAssigned && !b._isAssigned) return -1;
-            if (!a._isAssigned && b._isAssigned) return 1;
-            const bla = a.x_bloque || 'zzz';
-            const blb = b.x_bloque || 'zzz';
-            return bla.localeCompare(blb);
-        });
+        return this.state.quants;
     }
 
     get selectedCount() {
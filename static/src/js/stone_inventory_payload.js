@@ -0,0 +1,44 @@
+/** @odoo-module */
+/**
+ * Formato COMPACTO de los RPC de inventario de piedra (compact: true).
+ *
+ * El servidor manda columnas + filas, y los datos de cada lote y ubicación
+ * una sola vez (ver stock.quant._quants_to_compact). Aquí se expande a la
+ * misma forma de objeto que devolvía el formato clásico, así el render de
+ * los widgets no cambia. La foto principal llega como URL de miniatura
+ * (x_fotografia_url) en vez de base64.
+ */
+
+export function expandStoneInventory(payload) {
+    if (!payload || !payload.compact) {
+        return payload || [];
+    }
+    const lotFields = payload.lot_fields || [];
+    const lots = payload.lots || {};
+    const locations = payload.locations || {};
+    const items = [];
+    for (const row of payload.rows || []) {
+        const item = {};
+        payload.fields.forEach((fname, idx) => {
+            item[fname] = row[idx];
+        });
+        const lotId = item.lot_id;
+        const lotValues = lotId ? lots[lotId] || [] : [];
+        const lot = {};
+        lotFields.forEach((fname, idx) => {
+            lot[fname] = lotValues[idx];
+        });
+        for (const fname of lotFields) {
+            if (fname !== "name") {
+                item[fname] = lot[fname] === undefined ? false : lot[fname];
+            }
+        }
+        item.lot_id = lotId ? [lotId, lot.name || ""] : false;
+        item.location_id = item.location_id
+            ? [item.location_id, locations[item.location_id] || ""]
+            : false;
+        item.x_fotografia_principal = false;
+        items.push(item);
+    }
+    return items;
+}